@@ -13,6 +13,20 @@ data "aws_lambda_function" "environment_handler" {
   depends_on    = [aws_lambda_function.environment_handler]
 }
 
+data "aws_lambda_function" "classify_handler" {
+  function_name = aws_lambda_function.classify_handler.function_name
+  depends_on    = [aws_lambda_function.classify_handler]
+}
+
+# With var.unified_enc every integration points at encHandler instead
+locals {
+  node_handler_invoke_arn        = var.unified_enc ? aws_lambda_function.enc_handler[0].invoke_arn : data.aws_lambda_function.node_handler.invoke_arn
+  node_group_handler_invoke_arn  = var.unified_enc ? aws_lambda_function.enc_handler[0].invoke_arn : data.aws_lambda_function.node_group_handler.invoke_arn
+  environment_handler_invoke_arn = var.unified_enc ? aws_lambda_function.enc_handler[0].invoke_arn : data.aws_lambda_function.environment_handler.invoke_arn
+  classify_handler_invoke_arn    = var.unified_enc ? aws_lambda_function.enc_handler[0].invoke_arn : data.aws_lambda_function.classify_handler.invoke_arn
+  changes_handler_invoke_arn     = var.unified_enc ? aws_lambda_function.enc_handler[0].invoke_arn : aws_lambda_function.changes_handler.invoke_arn
+}
+
 data "aws_iam_policy_document" "api_gateway_policy" {
   statement {
     effect = "Allow"
@@ -51,12 +65,26 @@ resource "aws_api_gateway_rest_api" "api" {
   }
 }
 
-# resource "aws_api_gateway_method" "get_all_nodes" {
-#   rest_api_id   = aws_api_gateway_rest_api.api.id
-#   resource_id   = aws_api_gateway_resource.nodes.id
-#   http_method   = "GET"
-#   authorization = "NONE"
-# }
+resource "aws_api_gateway_method" "get_all_nodes" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.nodes.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_method" "get_all_nodegroups" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.nodegroup.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_method" "get_all_environments" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.environment.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
 
 resource "aws_api_gateway_resource" "nodes" {
   rest_api_id = aws_api_gateway_rest_api.api.id
@@ -70,11 +98,23 @@ resource "aws_api_gateway_resource" "unique_name" {
   path_part   = "{unique_name}"
 }
 
-# resource "aws_api_gateway_resource" "nodes_by_puppet_cluster" {
-#   rest_api_id = aws_api_gateway_rest_api.api.id
-#   parent_id   = aws_api_gateway_resource.nodes.id
-#   path_part   = "puppet_cluster"
-# }
+resource "aws_api_gateway_resource" "nodes_batch" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.nodes.id
+  path_part   = "batch"
+}
+
+resource "aws_api_gateway_resource" "nodes_lookup" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.nodes.id
+  path_part   = "lookup"
+}
+
+resource "aws_api_gateway_resource" "nodes_by_puppet_cluster" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.nodes.id
+  path_part   = "puppet_cluster"
+}
 
 # resource "aws_api_gateway_resource" "healthcheck" {
 #   rest_api_id = aws_api_gateway_rest_api.api.id
@@ -82,35 +122,35 @@ resource "aws_api_gateway_resource" "unique_name" {
 #   path_part   = "healthcheck"
 # }
 
-# resource "aws_api_gateway_resource" "nodes_by_puppet_cluster_name" {
-#   rest_api_id = aws_api_gateway_rest_api.api.id
-#   parent_id   = aws_api_gateway_resource.nodes_by_puppet_cluster.id
-#   path_part   = "{puppet_cluster_name}"
-# }
+resource "aws_api_gateway_resource" "nodes_by_puppet_cluster_name" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.nodes_by_puppet_cluster.id
+  path_part   = "{puppet_cluster_name}"
+}
 
-# resource "aws_api_gateway_resource" "hostgroup" {
-#   rest_api_id = aws_api_gateway_rest_api.api.id
-#   parent_id   = aws_api_gateway_resource.nodes.id
-#   path_part   = "hostgroup"
-# }
+resource "aws_api_gateway_resource" "hostgroup" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.nodes.id
+  path_part   = "hostgroup"
+}
 
-# resource "aws_api_gateway_resource" "hostgroup_name" {
-#   rest_api_id = aws_api_gateway_rest_api.api.id
-#   parent_id   = aws_api_gateway_resource.hostgroup.id
-#   path_part   = "{node_group_name}"
-# }
+resource "aws_api_gateway_resource" "hostgroup_name" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.hostgroup.id
+  path_part   = "{node_group_name}"
+}
 
-# resource "aws_api_gateway_resource" "nodes_by_environment" {
-#   rest_api_id = aws_api_gateway_rest_api.api.id
-#   parent_id   = aws_api_gateway_resource.nodes.id
-#   path_part   = "environment"
-# }
+resource "aws_api_gateway_resource" "nodes_by_environment" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.nodes.id
+  path_part   = "environment"
+}
 
-# resource "aws_api_gateway_resource" "nodes_by_environment_name" {
-#   rest_api_id = aws_api_gateway_rest_api.api.id
-#   parent_id   = aws_api_gateway_resource.nodes_by_environment.id
-#   path_part   = "{environment_name}"
-# }
+resource "aws_api_gateway_resource" "nodes_by_environment_name" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.nodes_by_environment.id
+  path_part   = "{environment_name}"
+}
 
 resource "aws_api_gateway_resource" "nodegroup" {
   rest_api_id = aws_api_gateway_rest_api.api.id
@@ -124,6 +164,24 @@ resource "aws_api_gateway_resource" "node_group_name" {
   path_part   = "{node_group_name}"
 }
 
+resource "aws_api_gateway_resource" "node_group_parameters" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.node_group_name.id
+  path_part   = "parameters"
+}
+
+resource "aws_api_gateway_resource" "node_group_nodes" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.node_group_name.id
+  path_part   = "nodes"
+}
+
+resource "aws_api_gateway_resource" "node_group_reassign" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.node_group_name.id
+  path_part   = "reassign"
+}
+
 resource "aws_api_gateway_resource" "environment" {
   rest_api_id = aws_api_gateway_rest_api.api.id
   parent_id   = aws_api_gateway_rest_api.api.root_resource_id
@@ -142,6 +200,24 @@ resource "aws_api_gateway_resource" "puppet_cluster_name" {
   path_part   = "{puppet_cluster_name}"
 }
 
+resource "aws_api_gateway_resource" "changes" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_rest_api.api.root_resource_id
+  path_part   = "changes"
+}
+
+resource "aws_api_gateway_resource" "classify" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_rest_api.api.root_resource_id
+  path_part   = "classify"
+}
+
+resource "aws_api_gateway_resource" "classify_unique_name" {
+  rest_api_id = aws_api_gateway_rest_api.api.id
+  parent_id   = aws_api_gateway_resource.classify.id
+  path_part   = "{unique_name}"
+}
+
 resource "aws_api_gateway_method" "get_node" {
   rest_api_id   = aws_api_gateway_rest_api.api.id
   resource_id   = aws_api_gateway_resource.unique_name.id
@@ -170,12 +246,33 @@ resource "aws_api_gateway_method" "delete_node" {
   authorization = "NONE"
 }
 
-# resource "aws_api_gateway_method" "get_nodes_by_puppet_cluster" {
-#   rest_api_id   = aws_api_gateway_rest_api.api.id
-#   resource_id   = aws_api_gateway_resource.nodes_by_puppet_cluster_name.id
-#   http_method   = "GET"
-#   authorization = "NONE"
-# }
+resource "aws_api_gateway_method" "create_nodes_batch" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.nodes_batch.id
+  http_method   = "POST"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_method" "delete_nodes_batch" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.nodes_batch.id
+  http_method   = "DELETE"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_method" "lookup_nodes" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.nodes_lookup.id
+  http_method   = "POST"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_method" "get_nodes_by_puppet_cluster" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.nodes_by_puppet_cluster_name.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
 
 # resource "aws_api_gateway_method" "get_healthcheck" {
 #   rest_api_id   = aws_api_gateway_rest_api.api.id
@@ -184,19 +281,19 @@ resource "aws_api_gateway_method" "delete_node" {
 #   authorization = "NONE"
 # }
 
-# resource "aws_api_gateway_method" "get_nodes_by_hostgroup" {
-#   rest_api_id   = aws_api_gateway_rest_api.api.id
-#   resource_id   = aws_api_gateway_resource.hostgroup_name.id
-#   http_method   = "GET"
-#   authorization = "NONE"
-# }
+resource "aws_api_gateway_method" "get_nodes_by_hostgroup" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.hostgroup_name.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
 
-# resource "aws_api_gateway_method" "get_nodes_by_environment" {
-#   rest_api_id   = aws_api_gateway_rest_api.api.id
-#   resource_id   = aws_api_gateway_resource.nodes_by_environment_name.id
-#   http_method   = "GET"
-#   authorization = "NONE"
-# }
+resource "aws_api_gateway_method" "get_nodes_by_environment" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.nodes_by_environment_name.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
 
 resource "aws_api_gateway_method" "get_nodegroup" {
   rest_api_id   = aws_api_gateway_rest_api.api.id
@@ -226,6 +323,27 @@ resource "aws_api_gateway_method" "delete_nodegroup" {
   authorization = "NONE"
 }
 
+resource "aws_api_gateway_method" "patch_nodegroup_parameters" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.node_group_parameters.id
+  http_method   = "PATCH"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_method" "get_nodegroup_nodes" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.node_group_nodes.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_method" "reassign_nodegroup" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.node_group_reassign.id
+  http_method   = "POST"
+  authorization = "NONE"
+}
+
 resource "aws_api_gateway_method" "get_environment" {
   rest_api_id   = aws_api_gateway_rest_api.api.id
   resource_id   = aws_api_gateway_resource.puppet_cluster_name.id
@@ -247,13 +365,27 @@ resource "aws_api_gateway_method" "delete_environment" {
   authorization = "NONE"
 }
 
+resource "aws_api_gateway_method" "get_changes" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.changes.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_method" "classify_node" {
+  rest_api_id   = aws_api_gateway_rest_api.api.id
+  resource_id   = aws_api_gateway_resource.classify_unique_name.id
+  http_method   = "GET"
+  authorization = "NONE"
+}
+
 resource "aws_api_gateway_integration" "lambda_get_node" {
   rest_api_id             = aws_api_gateway_rest_api.api.id
   resource_id             = aws_api_gateway_resource.unique_name.id
   http_method             = aws_api_gateway_method.get_node.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.node_handler.invoke_arn
+  uri                     = local.node_handler_invoke_arn
   depends_on              = [aws_lambda_function.node_handler]
 }
 
@@ -263,7 +395,7 @@ resource "aws_api_gateway_integration" "lambda_create_node" {
   http_method             = aws_api_gateway_method.create_node.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.node_handler.invoke_arn
+  uri                     = local.node_handler_invoke_arn
   depends_on              = [aws_lambda_function.node_handler]
 }
 
@@ -273,7 +405,7 @@ resource "aws_api_gateway_integration" "lambda_update_node" {
   http_method             = aws_api_gateway_method.update_node.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.node_handler.invoke_arn
+  uri                     = local.node_handler_invoke_arn
   depends_on              = [aws_lambda_function.node_handler]
 }
 
@@ -283,19 +415,69 @@ resource "aws_api_gateway_integration" "lambda_delete_node" {
   http_method             = aws_api_gateway_method.delete_node.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.node_handler.invoke_arn
+  uri                     = local.node_handler_invoke_arn
   depends_on              = [aws_lambda_function.node_handler]
 }
 
-# resource "aws_api_gateway_integration" "lambda_get_all_nodes" {
-#   rest_api_id             = aws_api_gateway_rest_api.api.id
-#   resource_id             = aws_api_gateway_resource.nodes.id
-#   http_method             = aws_api_gateway_method.get_all_nodes.http_method
-#   integration_http_method = "POST"
-#   type                    = "AWS_PROXY"
-#   uri                     = data.aws_lambda_function.node_handler.invoke_arn
-#   depends_on              = [aws_lambda_function.node_handler]
-# }
+resource "aws_api_gateway_integration" "lambda_create_nodes_batch" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.nodes_batch.id
+  http_method             = aws_api_gateway_method.create_nodes_batch.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_handler]
+}
+
+resource "aws_api_gateway_integration" "lambda_delete_nodes_batch" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.nodes_batch.id
+  http_method             = aws_api_gateway_method.delete_nodes_batch.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_handler]
+}
+
+resource "aws_api_gateway_integration" "lambda_lookup_nodes" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.nodes_lookup.id
+  http_method             = aws_api_gateway_method.lookup_nodes.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_handler]
+}
+
+resource "aws_api_gateway_integration" "lambda_get_all_nodes" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.nodes.id
+  http_method             = aws_api_gateway_method.get_all_nodes.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_handler]
+}
+
+resource "aws_api_gateway_integration" "lambda_get_all_nodegroups" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.nodegroup.id
+  http_method             = aws_api_gateway_method.get_all_nodegroups.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_group_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_group_handler]
+}
+
+resource "aws_api_gateway_integration" "lambda_get_all_environments" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.environment.id
+  http_method             = aws_api_gateway_method.get_all_environments.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.environment_handler_invoke_arn
+  depends_on              = [aws_lambda_function.environment_handler]
+}
 
 # resource "aws_api_gateway_integration" "lambda_get_healthcheck" {
 #   rest_api_id             = aws_api_gateway_rest_api.api.id
@@ -303,39 +485,39 @@ resource "aws_api_gateway_integration" "lambda_delete_node" {
 #   http_method             = aws_api_gateway_method.get_healthcheck.http_method
 #   integration_http_method = "POST"
 #   type                    = "AWS_PROXY"
-#   uri                     = data.aws_lambda_function.node_handler.invoke_arn
+#   uri                     = local.node_handler_invoke_arn
 #   depends_on              = [aws_lambda_function.node_handler]
 # }
 
-# resource "aws_api_gateway_integration" "lambda_get_nodes_by_puppet_cluster" {
-#   rest_api_id             = aws_api_gateway_rest_api.api.id
-#   resource_id             = aws_api_gateway_resource.nodes_by_puppet_cluster_name.id
-#   http_method             = aws_api_gateway_method.get_nodes_by_puppet_cluster.http_method
-#   integration_http_method = "POST"
-#   type                    = "AWS_PROXY"
-#   uri                     = data.aws_lambda_function.node_handler.invoke_arn
-#   depends_on              = [aws_lambda_function.node_handler]
-# }
+resource "aws_api_gateway_integration" "lambda_get_nodes_by_puppet_cluster" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.nodes_by_puppet_cluster_name.id
+  http_method             = aws_api_gateway_method.get_nodes_by_puppet_cluster.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_handler]
+}
 
-# resource "aws_api_gateway_integration" "lambda_get_nodes_by_hostgroup" {
-#   rest_api_id             = aws_api_gateway_rest_api.api.id
-#   resource_id             = aws_api_gateway_resource.hostgroup_name.id
-#   http_method             = aws_api_gateway_method.get_nodes_by_hostgroup.http_method
-#   integration_http_method = "POST"
-#   type                    = "AWS_PROXY"
-#   uri                     = data.aws_lambda_function.node_handler.invoke_arn
-#   depends_on              = [aws_lambda_function.node_handler]
-# }
+resource "aws_api_gateway_integration" "lambda_get_nodes_by_hostgroup" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.hostgroup_name.id
+  http_method             = aws_api_gateway_method.get_nodes_by_hostgroup.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_handler]
+}
 
-# resource "aws_api_gateway_integration" "lambda_get_nodes_by_environment" {
-#   rest_api_id             = aws_api_gateway_rest_api.api.id
-#   resource_id             = aws_api_gateway_resource.nodes_by_environment_name.id
-#   http_method             = aws_api_gateway_method.get_nodes_by_environment.http_method
-#   integration_http_method = "POST"
-#   type                    = "AWS_PROXY"
-#   uri                     = data.aws_lambda_function.node_handler.invoke_arn
-#   depends_on              = [aws_lambda_function.node_handler]
-# }
+resource "aws_api_gateway_integration" "lambda_get_nodes_by_environment" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.nodes_by_environment_name.id
+  http_method             = aws_api_gateway_method.get_nodes_by_environment.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_handler]
+}
 
 resource "aws_api_gateway_integration" "lambda_get_nodegroup" {
   rest_api_id             = aws_api_gateway_rest_api.api.id
@@ -343,7 +525,7 @@ resource "aws_api_gateway_integration" "lambda_get_nodegroup" {
   http_method             = aws_api_gateway_method.get_nodegroup.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.node_group_handler.invoke_arn
+  uri                     = local.node_group_handler_invoke_arn
   depends_on              = [aws_lambda_function.node_group_handler]
 }
 
@@ -353,7 +535,7 @@ resource "aws_api_gateway_integration" "lambda_create_nodegroup" {
   http_method             = aws_api_gateway_method.create_nodegroup.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.node_group_handler.invoke_arn
+  uri                     = local.node_group_handler_invoke_arn
   depends_on              = [aws_lambda_function.node_group_handler]
 }
 
@@ -363,7 +545,7 @@ resource "aws_api_gateway_integration" "lambda_update_nodegroup" {
   http_method             = aws_api_gateway_method.update_nodegroup.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.node_group_handler.invoke_arn
+  uri                     = local.node_group_handler_invoke_arn
   depends_on              = [aws_lambda_function.node_group_handler]
 }
 
@@ -373,7 +555,37 @@ resource "aws_api_gateway_integration" "lambda_delete_nodegroup" {
   http_method             = aws_api_gateway_method.delete_nodegroup.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.node_group_handler.invoke_arn
+  uri                     = local.node_group_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_group_handler]
+}
+
+resource "aws_api_gateway_integration" "lambda_patch_nodegroup_parameters" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.node_group_parameters.id
+  http_method             = aws_api_gateway_method.patch_nodegroup_parameters.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_group_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_group_handler]
+}
+
+resource "aws_api_gateway_integration" "lambda_get_nodegroup_nodes" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.node_group_nodes.id
+  http_method             = aws_api_gateway_method.get_nodegroup_nodes.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_group_handler_invoke_arn
+  depends_on              = [aws_lambda_function.node_group_handler]
+}
+
+resource "aws_api_gateway_integration" "lambda_reassign_nodegroup" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.node_group_reassign.id
+  http_method             = aws_api_gateway_method.reassign_nodegroup.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.node_group_handler_invoke_arn
   depends_on              = [aws_lambda_function.node_group_handler]
 }
 
@@ -383,7 +595,7 @@ resource "aws_api_gateway_integration" "lambda_get_environment" {
   http_method             = aws_api_gateway_method.get_environment.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.environment_handler.invoke_arn
+  uri                     = local.environment_handler_invoke_arn
   depends_on              = [aws_lambda_function.environment_handler]
 }
 
@@ -393,7 +605,7 @@ resource "aws_api_gateway_integration" "lambda_create_environment" {
   http_method             = aws_api_gateway_method.create_environment.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.environment_handler.invoke_arn
+  uri                     = local.environment_handler_invoke_arn
   depends_on              = [aws_lambda_function.environment_handler]
 }
 
@@ -403,10 +615,30 @@ resource "aws_api_gateway_integration" "lambda_delete_environment" {
   http_method             = aws_api_gateway_method.delete_environment.http_method
   integration_http_method = "POST"
   type                    = "AWS_PROXY"
-  uri                     = data.aws_lambda_function.environment_handler.invoke_arn
+  uri                     = local.environment_handler_invoke_arn
   depends_on              = [aws_lambda_function.environment_handler]
 }
 
+resource "aws_api_gateway_integration" "lambda_classify_node" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.classify_unique_name.id
+  http_method             = aws_api_gateway_method.classify_node.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.classify_handler_invoke_arn
+  depends_on              = [aws_lambda_function.classify_handler]
+}
+
+resource "aws_api_gateway_integration" "lambda_get_changes" {
+  rest_api_id             = aws_api_gateway_rest_api.api.id
+  resource_id             = aws_api_gateway_resource.changes.id
+  http_method             = aws_api_gateway_method.get_changes.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = local.changes_handler_invoke_arn
+  depends_on              = [aws_lambda_function.changes_handler]
+}
+
 resource "aws_api_gateway_deployment" "api_deployment" {
   rest_api_id = aws_api_gateway_rest_api.api.id
   stage_name  = "sandbox"
@@ -415,18 +647,28 @@ resource "aws_api_gateway_deployment" "api_deployment" {
     aws_api_gateway_integration.lambda_create_node,
     aws_api_gateway_integration.lambda_update_node,
     aws_api_gateway_integration.lambda_delete_node,
-    # aws_api_gateway_integration.lambda_get_all_nodes,
+    aws_api_gateway_integration.lambda_create_nodes_batch,
+    aws_api_gateway_integration.lambda_delete_nodes_batch,
+    aws_api_gateway_integration.lambda_lookup_nodes,
+    aws_api_gateway_integration.lambda_get_all_nodes,
+    aws_api_gateway_integration.lambda_get_all_nodegroups,
+    aws_api_gateway_integration.lambda_get_all_environments,
     # aws_api_gateway_integration.lambda_get_healthcheck,
-    # aws_api_gateway_integration.lambda_get_nodes_by_puppet_cluster,
-    # aws_api_gateway_integration.lambda_get_nodes_by_hostgroup,
-    # aws_api_gateway_integration.lambda_get_nodes_by_environment,
+    aws_api_gateway_integration.lambda_get_nodes_by_puppet_cluster,
+    aws_api_gateway_integration.lambda_get_nodes_by_hostgroup,
+    aws_api_gateway_integration.lambda_get_nodes_by_environment,
     aws_api_gateway_integration.lambda_get_nodegroup,
     aws_api_gateway_integration.lambda_create_nodegroup,
     aws_api_gateway_integration.lambda_update_nodegroup,
     aws_api_gateway_integration.lambda_delete_nodegroup,
+    aws_api_gateway_integration.lambda_patch_nodegroup_parameters,
+    aws_api_gateway_integration.lambda_get_nodegroup_nodes,
+    aws_api_gateway_integration.lambda_reassign_nodegroup,
     aws_api_gateway_integration.lambda_get_environment,
     aws_api_gateway_integration.lambda_create_environment,
-    aws_api_gateway_integration.lambda_delete_environment
+    aws_api_gateway_integration.lambda_delete_environment,
+    aws_api_gateway_integration.lambda_classify_node,
+    aws_api_gateway_integration.lambda_get_changes
   ]
 }
 
@@ -457,6 +699,33 @@ resource "aws_lambda_permission" "apigw_lambda_environment" {
   depends_on    = [aws_lambda_function.environment_handler]
 }
 
+resource "aws_lambda_permission" "apigw_lambda_classify" {
+  statement_id  = "AllowAPIGatewayInvokeClassify"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.classify_handler.function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "${aws_api_gateway_rest_api.api.execution_arn}/*/*"
+  depends_on    = [aws_lambda_function.classify_handler]
+}
+
+resource "aws_lambda_permission" "apigw_lambda_changes" {
+  statement_id  = "AllowAPIGatewayInvokeChanges"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.changes_handler.function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "${aws_api_gateway_rest_api.api.execution_arn}/*/*"
+  depends_on    = [aws_lambda_function.changes_handler]
+}
+
+resource "aws_lambda_permission" "apigw_lambda_enc" {
+  count         = var.unified_enc ? 1 : 0
+  statement_id  = "AllowAPIGatewayInvokeEnc"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.enc_handler[0].function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "${aws_api_gateway_rest_api.api.execution_arn}/*/*"
+}
+
 # resource "aws_lambda_permission" "apigw_lambda_healthcheck" {
 #   statement_id  = "AllowAPIGatewayInvokeHealthCheck"
 #   action        = "lambda:InvokeFunction"
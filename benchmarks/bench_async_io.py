@@ -0,0 +1,61 @@
+"""Concurrent read throughput of the node handler against a local moto server.
+
+Compares the shared thread-pool offload in dynamo.run with the previous
+behaviour of calling boto3 inline on the event loop. --latency adds a fixed
+delay to every DynamoDB request to stand in for the network round trip:
+
+    python -m benchmarks.bench_async_io --requests 400 --concurrency 32 --latency 10
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks import common
+
+import httpx
+
+from lambdas.src.handlers import dynamo, node
+
+async def inline_run(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+async def drive(requests, concurrency, nodes):
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=node.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://enc') as client:
+        async def one(i):
+            async with semaphore:
+                unique_name = common.synthetic_node(i % nodes)['UniqueName']
+                response = await client.get('/nodes/{}'.format(unique_name))
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--nodes', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=10.0, help='simulated round trip in ms')
+    parser.add_argument('--port', type=int, default=5005)
+    args = parser.parse_args()
+
+    server = common.start_moto_server(args.port)
+    try:
+        resource = common.moto_resource(args.port)
+        node.node_table = common.create_node_table(resource, args.nodes)
+        common.add_latency(resource, args.latency)
+        offload_run = dynamo.run
+        for label, run in (('inline', inline_run), ('offload', offload_run)):
+            dynamo.run = run
+            elapsed = asyncio.run(drive(args.requests, args.concurrency, args.nodes))
+            print('{:<8} {:>6} requests in {:6.2f}s  {:8.1f} req/s'.format(
+                label, args.requests, elapsed, args.requests / elapsed))
+        dynamo.run = offload_run
+    finally:
+        server.kill()
+
+if __name__ == '__main__':
+    main()
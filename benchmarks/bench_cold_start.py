@@ -0,0 +1,111 @@
+"""Cold-start cost of each handler: import time breakdown and first request latency.
+
+Every handler is loaded in a fresh interpreter run with -X importtime, the
+way a new Lambda execution environment loads it, and then sent the same
+request twice through its Mangum handler against a local moto server:
+
+    python -m benchmarks.bench_cold_start --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from benchmarks import common
+
+HANDLERS = {
+    'node': '/nodes/node000000.saas-n.com',
+    'node_group': '/nodegroup/BT Group 000',
+    'environment': '/environment/master/ny2-saas-n0',
+    'classify': '/classify/node000000.saas-n.com',
+    'enc': '/classify/node000000.saas-n.com',
+    'changes': '/changes',
+}
+
+# Runs in the child interpreter. Reports import and request timings and
+# whether the DynamoDB client or boto3's resource layer got loaded.
+PROBE = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+result = {"import_ms": (imported - start) * 1000}
+if len(sys.argv) > 2:
+    event = {
+        "resource": "/{proxy+}", "path": sys.argv[2], "httpMethod": "GET",
+        "headers": {"Host": "enc"}, "multiValueHeaders": {},
+        "queryStringParameters": None, "multiValueQueryStringParameters": None,
+        "pathParameters": None, "stageVariables": None,
+        "requestContext": {"resourcePath": "/{proxy+}", "httpMethod": "GET", "path": sys.argv[2], "stage": "prod"},
+        "body": None, "isBase64Encoded": False,
+    }
+    for label in ("first_request_ms", "warm_request_ms"):
+        begin = time.perf_counter()
+        response = module.handler(event, None)
+        result[label] = (time.perf_counter() - begin) * 1000
+        result["status"] = response["statusCode"]
+from lambdas.src.handlers import dynamo
+result["client_built"] = dynamo._client is not None
+result["resource_layer_loaded"] = "boto3.dynamodb.table" in sys.modules
+print(json.dumps(result))
+'''
+
+def import_breakdown(importtime_output):
+    # Sum the self time reported by -X importtime per top-level package
+    totals = defaultdict(int)
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(self_us)
+    return {package: us / 1000 for package, us in totals.items()}
+
+def profile(module, path=None, env=None):
+    # One cold start of `module`; with `path`, also time two GET requests
+    args = [sys.executable, '-X', 'importtime', '-c', PROBE, module] + ([path] if path else [])
+    completed = subprocess.run(args, capture_output=True, text=True, env=env, check=True)
+    result = json.loads(completed.stdout)
+    result['packages'] = import_breakdown(completed.stderr)
+    return result
+
+def seed(resource):
+    common.create_tables(resource)
+    with resource.Table('Node').batch_writer() as batch:
+        for i in range(10):
+            batch.put_item(Item=common.synthetic_node(i))
+    resource.Table('NodeGroup').put_item(Item={'Name': 'BT Group 000', 'Class': 'roles::base_server', 'ParameterSet': {}})
+    resource.Table('Environment').put_item(Item={'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n0'})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per handler')
+    parser.add_argument('--top', type=int, default=6, help='packages listed in the import breakdown')
+    parser.add_argument('--port', type=int, default=5007)
+    args = parser.parse_args()
+
+    server = common.start_moto_server(args.port)
+    try:
+        endpoint = 'http://127.0.0.1:{}'.format(args.port)
+        seed(common.moto_resource(args.port))
+        # EMF lines would mix with the probe's JSON on stdout
+        env = dict(os.environ, AWS_ENDPOINT_URL_DYNAMODB=endpoint, METRICS_EMF='false')
+        for name, path in HANDLERS.items():
+            runs = [profile('lambdas.src.handlers.' + name, path, env) for _ in range(args.runs)]
+            assert all(run['status'] == 200 for run in runs), runs
+            print('{:<12} import {:7.1f}ms  first request {:7.1f}ms  warm request {:6.1f}ms'.format(
+                name, *(statistics.median(run[key] for run in runs)
+                        for key in ('import_ms', 'first_request_ms', 'warm_request_ms'))))
+            packages = defaultdict(list)
+            for run in runs:
+                for package, ms in run['packages'].items():
+                    packages[package].append(ms)
+            medians = sorted(((statistics.median(ms), package) for package, ms in packages.items()), reverse=True)
+            print('             ' + '  '.join('{} {:.1f}ms'.format(package, ms) for ms, package in medians[:args.top]))
+    finally:
+        server.kill()
+
+if __name__ == '__main__':
+    main()
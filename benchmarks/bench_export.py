@@ -0,0 +1,46 @@
+"""Node inventory export throughput, single scan vs parallel segmented scan.
+
+Seeds a moto server with synthetic nodes and exports them with
+tools.export_nodes at several segment counts:
+
+    python -m benchmarks.bench_export --nodes 100000 --segments 1 4 8 16 --latency 10
+
+moto answers every segment from a single process, so the speedup measured
+here is a lower bound of what the segments achieve against DynamoDB, where
+they are served by separate partitions.
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks import common
+
+from tools.export_nodes import export_nodes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--page-size', type=int, default=1000, help='Limit for each Scan call')
+    parser.add_argument('--latency', type=float, default=10.0, help='simulated round trip in ms')
+    parser.add_argument('--port', type=int, default=5006)
+    args = parser.parse_args()
+
+    server = common.start_moto_server(args.port)
+    try:
+        resource = common.moto_resource(args.port)
+        print('Seeding {} nodes...'.format(args.nodes))
+        table = common.create_node_table(resource, args.nodes)
+        common.add_latency(resource, args.latency)
+        with tempfile.TemporaryDirectory() as workdir:
+            for segments in args.segments:
+                output = os.path.join(workdir, 'nodes-{}.ndjson.gz'.format(segments))
+                count, elapsed = export_nodes(table, output, segments, page_size=args.page_size)
+                assert count == args.nodes, 'exported {} of {} nodes'.format(count, args.nodes)
+                print('{:>3} segments: {:>7} nodes in {:6.2f}s  {:9.0f} nodes/s  {:6.1f} KiB'.format(
+                    segments, count, elapsed, count / elapsed, os.path.getsize(output) / 1024))
+    finally:
+        server.kill()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""Latency and throughput of the ENC routes under concurrent load.
+
+Seeds a local moto server (or DynamoDB Local, with --endpoint-url) with a
+synthetic fleet and drives the handler apps concurrently, either in process
+through ASGI or through their Mangum Lambda handlers with one worker process
+per concurrent Lambda instance:
+
+    python -m benchmarks.bench_load --nodes 10000 --groups 1000 --requests 2000 --concurrency 32
+    python -m benchmarks.bench_load --paths mangum --scenarios read_node classify --latency 5
+    python -m benchmarks.bench_load --compare benchmarks/results/bench_load-1a2b3c4.json
+
+Reports p50/p95/p99 latency, requests per second and the DynamoDB calls and
+consumed capacity per request (read from the Server-Timing header), and
+saves them to benchmarks/results/bench_load-<commit>.json so later runs can
+be compared against them with --compare.
+"""
+import argparse
+import asyncio
+import datetime
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import re
+import statistics
+import subprocess
+import time
+
+from benchmarks import common
+
+import httpx
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+ENVIRONMENTS = [(environment, 'ny2-saas-n{}'.format(cluster))
+                for environment in ('master', 'production', 'staging') for cluster in range(8)]
+
+def create_node(i, args):
+    node = common.synthetic_node(args.nodes + i, args.groups)
+    return 'POST', '/nodes/', {
+        'unique_name': 'load-{}-{:07d}.saas-n.com'.format(args.run_id, i),
+        'node_group_name': node['NodeGroupName'],
+        'environment_name': node['EnvironmentName'],
+        'puppet_cluster_name': node['PuppetClusterName'],
+    }
+
+def read_node(i, args):
+    return 'GET', '/nodes/{}'.format(common.synthetic_node(i * 7919 % args.nodes)['UniqueName']), None
+
+def update_node_group(i, args):
+    # Each request updates its own group, so concurrent requests do not
+    # conflict on the version check
+    name = common.synthetic_node_group_name(i % args.groups)
+    return 'PUT', '/nodegroup/{}'.format(name), {
+        'name': name,
+        'class_': 'roles::group_{}'.format(i % args.groups),
+        'parameters': synthetic_parameters(i),
+    }
+
+def read_environment(i, args):
+    return 'GET', '/environment/{}/{}'.format(*ENVIRONMENTS[i % len(ENVIRONMENTS)]), None
+
+def classify(i, args):
+    return 'GET', '/classify/{}?format=json'.format(common.synthetic_node(i * 7919 % args.nodes)['UniqueName']), None
+
+# Scenario: (handler module, request of the i-th call)
+SCENARIOS = {
+    'create_node': ('node', create_node),
+    'read_node': ('node', read_node),
+    'update_node_group': ('node_group', update_node_group),
+    'read_environment': ('environment', read_environment),
+    'classify': ('classify', classify),
+}
+
+SERVER_TIMING_CALLS = re.compile(r'dynamodb;[^,]*desc="(\d+) calls ([0-9.e+-]+) capacity units"')
+
+def synthetic_parameters(i):
+    return {'bt_product': 'cea', 'bt_tier': 'tier{}'.format(i % 4), 'ntp_servers': ['ntp1', 'ntp2'],
+            'revision': i}
+
+def seed(args):
+    # Write the fleet with the handlers' own concurrent BatchWriteItem
+    # helper, in chunks so memory stays flat at 500k nodes
+    from lambdas.src.handlers import dynamo
+
+    def write(table_name, items):
+        table = dynamo.Table(table_name)
+        for i in range(0, len(items), 5000):
+            errors = asyncio.run(dynamo.batch_write(table, [{'PutRequest': {'Item': item}} for item in items[i:i + 5000]]))
+            assert not any(errors), errors
+
+    write('NodeGroup', [{'Name': common.synthetic_node_group_name(i), 'Class': 'roles::group_{}'.format(i),
+                         'ParameterSet': synthetic_parameters(i), 'Version': 1} for i in range(args.groups)])
+    write('Environment', [{'EnvironmentName': environment, 'PuppetClusterName': cluster}
+                          for environment, cluster in ENVIRONMENTS])
+    for start in range(0, args.nodes, 50000):
+        write('Node', [dict(common.synthetic_node(i, args.groups), Version=1)
+                       for i in range(start, min(start + 50000, args.nodes))])
+
+def add_handler_latency(latency):
+    # Delay every request of the handlers' shared client, like
+    # common.add_latency does for a resource
+    if latency:
+        from lambdas.src.handlers import dynamo
+        dynamo.client().meta.events.register('before-send.dynamodb', lambda **kwargs: time.sleep(latency / 1000.0))
+
+def dynamodb_usage(server_timing):
+    match = SERVER_TIMING_CALLS.search(server_timing or '')
+    return (int(match.group(1)), float(match.group(2))) if match else (0, 0.0)
+
+async def drive_asgi(module, requests, concurrency):
+    # Every request through the app in this process, `concurrency` at a time
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=module.app)
+    samples = []
+    async with httpx.AsyncClient(transport=transport, base_url='http://enc') as client:
+        async def one(method, path, body):
+            async with semaphore:
+                begin = time.perf_counter()
+                response = await client.request(method, path, json=body)
+                elapsed = time.perf_counter() - begin
+                samples.append((elapsed, response.status_code) + dynamodb_usage(response.headers.get('server-timing')))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(*request) for request in requests))
+        return samples, time.perf_counter() - start
+
+def api_gateway_event(method, path, body):
+    path, _, query = path.partition('?')
+    parameters = dict(pair.split('=', 1) for pair in query.split('&')) if query else None
+    return {
+        'resource': '/{proxy+}', 'path': path, 'httpMethod': method,
+        'headers': {'Host': 'enc', 'Content-Type': 'application/json'}, 'multiValueHeaders': {},
+        'queryStringParameters': parameters, 'multiValueQueryStringParameters': None,
+        'pathParameters': None, 'stageVariables': None,
+        'requestContext': {'resourcePath': '/{proxy+}', 'httpMethod': method, 'path': path, 'stage': 'prod'},
+        'body': json.dumps(body) if body is not None else None, 'isBase64Encoded': False,
+    }
+
+def mangum_worker(module_name, requests, latency):
+    # One Lambda execution environment: a fresh interpreter invoking the
+    # Mangum handler for one event at a time
+    module = importlib.import_module('lambdas.src.handlers.' + module_name)
+    add_handler_latency(latency)
+    samples = []
+    start = time.perf_counter()
+    for method, path, body in requests:
+        begin = time.perf_counter()
+        response = module.handler(api_gateway_event(method, path, body), None)
+        elapsed = time.perf_counter() - begin
+        headers = {name.lower(): value for name, value in response.get('headers', {}).items()}
+        samples.append((elapsed, response['statusCode']) + dynamodb_usage(headers.get('server-timing')))
+    return samples, time.perf_counter() - start
+
+def drive_mangum(pool, module_name, requests, concurrency, latency):
+    shares = [requests[i::concurrency] for i in range(concurrency)]
+    results = pool.starmap(mangum_worker, [(module_name, share, latency) for share in shares if share])
+    return [sample for samples, _ in results for sample in samples], max(elapsed for _, elapsed in results)
+
+def summarize(samples, elapsed):
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample[1])] = statuses.get(str(sample[1]), 0) + 1
+    return {
+        'requests': len(samples),
+        'rps': len(samples) / elapsed,
+        'p50_ms': percentiles[49],
+        'p95_ms': percentiles[94],
+        'p99_ms': percentiles[98],
+        'dynamodb_calls_per_request': sum(sample[2] for sample in samples) / len(samples),
+        'capacity_per_request': sum(sample[3] for sample in samples) / len(samples),
+        'statuses': statuses,
+    }
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+def print_results(results, baseline=None):
+    for path, scenarios in results.items():
+        for name, result in scenarios.items():
+            line = '{:<7} {:<18} {:>6} req {:8.1f} req/s  p50 {:7.1f}ms  p95 {:7.1f}ms  p99 {:7.1f}ms  {:4.1f} calls {:5.1f} RCU/WCU  {}'.format(
+                path, name, result['requests'], result['rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['dynamodb_calls_per_request'], result['capacity_per_request'], result['statuses'])
+            before = (baseline or {}).get(path, {}).get(name)
+            if before:
+                line += '  vs baseline: req/s {:+.1f}%  p95 {:+.1f}%'.format(
+                    (result['rps'] / before['rps'] - 1) * 100, (result['p95_ms'] / before['p95_ms'] - 1) * 100)
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=10000, help='nodes seeded, e.g. 10000 to 500000')
+    parser.add_argument('--groups', type=int, default=1000, help='node groups seeded')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario and path')
+    parser.add_argument('--concurrency', type=int, default=32, help='requests in flight (Lambda instances for mangum)')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--paths', nargs='+', choices=['asgi', 'mangum'], default=['asgi', 'mangum'])
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated DynamoDB round trip in ms')
+    parser.add_argument('--endpoint-url', help='use this DynamoDB endpoint (e.g. DynamoDB Local) instead of moto')
+    parser.add_argument('--port', type=int, default=5008)
+    parser.add_argument('--output', help='results file (default benchmarks/results/bench_load-<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+    args.run_id = int(time.time())
+
+    server = None
+    if args.endpoint_url is None:
+        server = common.start_moto_server(args.port)
+        args.endpoint_url = 'http://127.0.0.1:{}'.format(args.port)
+    # The handlers build their client from the environment, in this process
+    # and in the mangum workers alike; EMF lines would only add noise here
+    os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = args.endpoint_url
+    os.environ['METRICS_EMF'] = 'false'
+    try:
+        import boto3
+        common.create_tables(boto3.resource('dynamodb', endpoint_url=args.endpoint_url))
+        print('Seeding {} nodes, {} node groups...'.format(args.nodes, args.groups))
+        seed(args)
+
+        add_handler_latency(args.latency)
+        results = {}
+        pool = None
+        if 'mangum' in args.paths:
+            pool = multiprocessing.get_context('spawn').Pool(args.concurrency)
+        try:
+            for path in args.paths:
+                for name in args.scenarios:
+                    module_name, request = SCENARIOS[name]
+                    requests = [request(i, args) for i in range(args.requests)]
+                    if path == 'asgi':
+                        module = importlib.import_module('lambdas.src.handlers.' + module_name)
+                        samples, elapsed = asyncio.run(drive_asgi(module, requests, args.concurrency))
+                    else:
+                        samples, elapsed = drive_mangum(pool, module_name, requests, args.concurrency, args.latency)
+                    results.setdefault(path, {})[name] = summarize(samples, elapsed)
+                    # Later runs of create_node must not collide with this one
+                    args.run_id += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    finally:
+        if server is not None:
+            server.kill()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    commit, dirty = git_revision()
+    output = args.output or os.path.join(RESULTS_DIR, 'bench_load-{}{}.json'.format(commit, '-dirty' if dirty else ''))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'dirty': dirty,
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('run_id', 'output', 'compare')},
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print('Results written to {}'.format(output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Stored size, read capacity and decode time of node group parameters.
+
+Builds Hiera-style parameter sets of increasing size and compares storing
+them as a DynamoDB map with the zlib-compressed Binary that node_group.py
+writes above NODE_GROUP_COMPRESS_THRESHOLD. Decode time covers what a read
+pays: deserializing the wire format and decode_parameters.
+
+    python -m benchmarks.bench_parameters --sizes 10 100 500 2000
+"""
+import argparse
+import json
+import math
+import time
+import zlib
+from decimal import Decimal
+
+from benchmarks import common  # noqa: F401  sets the AWS defaults
+
+from boto3.dynamodb.types import Binary, TypeDeserializer, TypeSerializer
+
+from lambdas.src.handlers import dynamo
+from lambdas.src.handlers.node_group import decode_parameters
+
+def hiera_parameters(count):
+    parameters = {}
+    for i in range(count):
+        prefix = 'profile::service_{:04d}'.format(i)
+        kind = i % 3
+        if kind == 0:
+            parameters[prefix + '::package_ensure'] = 'present'
+        elif kind == 1:
+            parameters[prefix + '::port'] = 8000 + i
+        else:
+            parameters[prefix + '::allowed_hosts'] = ['10.0.{}.{}'.format(i % 256, n) for n in range(3)]
+    return parameters
+
+def value_size(value):
+    # DynamoDB's item size rules: UTF-8 bytes for strings, about one byte per
+    # two significant digits for numbers, 3 bytes plus one per element for
+    # maps and lists
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, Binary):
+        return len(value.value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, Decimal)):
+        digits = len(str(value).lstrip('-').replace('.', '').strip('0')) or 1
+        return math.ceil(digits / 2) + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(key.encode()) + value_size(item) + 1 for key, item in value.items())
+    if isinstance(value, list):
+        return 3 + sum(value_size(item) + 1 for item in value)
+    raise TypeError(type(value).__name__)
+
+def item_size(item):
+    return sum(len(name.encode()) + value_size(value) for name, value in item.items())
+
+def decode_ms(item, rounds):
+    # Median time to turn the wire format of `item` into plain parameters
+    wire = {name: TypeSerializer().serialize(value) for name, value in item.items()}
+    deserializer = TypeDeserializer()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        decoded = {name: deserializer.deserialize(value) for name, value in wire.items()}
+        dynamo.from_item_value(decode_parameters(decoded)['Parameters'])
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500, 2000], help='parameters per node group')
+    parser.add_argument('--rounds', type=int, default=200, help='decode timings per item')
+    args = parser.parse_args()
+
+    print('{:>6}  {:<10} {:>9} {:>5} {:>10}'.format('params', 'storage', 'bytes', 'RCU', 'decode ms'))
+    for count in args.sizes:
+        parameters = hiera_parameters(count)
+        raw = json.dumps(parameters, separators=(',', ':')).encode()
+        for label, stored in (('map', dynamo.to_item_value(parameters)), ('zlib', Binary(zlib.compress(raw)))):
+            item = {'Name': 'BT Group {}'.format(count), 'Class': 'roles::base_server', 'ParameterSet': stored}
+            size = item_size(item)
+            # A strongly consistent read costs one RCU per 4 KB, rounded up
+            print('{:>6}  {:<10} {:>9} {:>5} {:>10.3f}'.format(
+                count, label, size, math.ceil(size / 4096), decode_ms(item, args.rounds)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Serialization time per response: FastAPI's default path versus dynamo.dumps.
+
+Read routes return items as the DynamoDB client deserializes them, with
+every number a Decimal. Returned as a dict, FastAPI walks them with
+jsonable_encoder and renders its JSONResponse; dynamo.ItemsResponse and
+etag.represent encode them in one dynamo.dumps call instead. Measured on
+list pages of synthetic nodes and on node groups with large Parameters:
+
+    python -m benchmarks.bench_serialize --nodes 100 1000 10000 --parameters 100 2000
+
+orjson is used when installed; the "json" column is what dumps falls back to.
+"""
+import argparse
+import json
+import time
+from decimal import Decimal
+
+from benchmarks import common
+from benchmarks.bench_parameters import hiera_parameters
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from lambdas.src.handlers import dynamo
+
+def as_read(item):
+    # An item as it comes back from DynamoDB: numbers as Decimal
+    serializer, deserializer = TypeSerializer(), TypeDeserializer()
+    return {name: deserializer.deserialize(serializer.serialize(dynamo.to_item_value(value)))
+            for name, value in item.items()}
+
+def node_page(count):
+    items = [as_read(dict(common.synthetic_node(i), Version=Decimal(i % 7 + 1))) for i in range(count)]
+    return {'items': items, 'next_cursor': None}
+
+def node_group(count):
+    return [as_read({
+        'Name': common.synthetic_node_group_name(0),
+        'Class': 'roles::base_server',
+        'Parameters': hiera_parameters(count),
+        'Version': 4,
+    })]
+
+def fastapi_default(content):
+    # What a route returning `content` as a dict costs
+    return JSONResponse(jsonable_encoder(content)).body
+
+def json_only(content):
+    return json.dumps(content, default=dynamo.json_default, separators=(',', ':'), ensure_ascii=False).encode()
+
+ENCODERS = [('fastapi', fastapi_default), ('json', json_only), ('dumps', dynamo.dumps)]
+
+def median_ms(encode, content, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        encode(content)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2] * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, nargs='+', default=[100, 1000, 10000], help='nodes per list page')
+    parser.add_argument('--parameters', type=int, nargs='+', default=[100, 2000, 10000],
+                        help='parameters per node group')
+    parser.add_argument('--rounds', type=int, default=50, help='timings per body')
+    args = parser.parse_args()
+
+    print('encoder: {}'.format('orjson' if dynamo.orjson is not None else 'json (orjson not installed)'))
+    print('{:<20} {:>9} {:>11} {:>8} {:>9} {:>9}'.format('body', 'bytes', 'fastapi ms', 'json ms', 'dumps ms',
+                                                         'saved ms'))
+    bodies = [('{} nodes'.format(count), node_page(count)) for count in args.nodes]
+    bodies += [('{} parameters'.format(count), node_group(count)) for count in args.parameters]
+    for label, content in bodies:
+        assert json.loads(dynamo.dumps(content)) == json.loads(fastapi_default(content))
+        fastapi_ms, json_ms, dumps_ms = (median_ms(encode, content, args.rounds) for _, encode in ENCODERS)
+        print('{:<20} {:>9} {:>11.3f} {:>8.3f} {:>9.3f} {:>9.3f}'.format(
+            label, len(dynamo.dumps(content)), fastapi_ms, json_ms, dumps_ms, fastapi_ms - dumps_ms))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Helpers shared by the benchmark scripts."""
+import os
+import subprocess
+import sys
+import time
+
+# The handler modules build their boto3 resources at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+import boto3
+
+NODE_KEY_SCHEMA = dict(
+    KeySchema=[
+        {'AttributeName': 'UniqueName', 'KeyType': 'HASH'},
+        {'AttributeName': 'NodeGroupName', 'KeyType': 'RANGE'}
+    ],
+    AttributeDefinitions=[
+        {'AttributeName': 'UniqueName', 'AttributeType': 'S'},
+        {'AttributeName': 'NodeGroupName', 'AttributeType': 'S'}
+    ],
+)
+
+def start_moto_server(port):
+    # moto in its own process, so it does not compete with the code under
+    # test for the GIL
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'moto.server', '-p', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    client = boto3.client('dynamodb', endpoint_url='http://127.0.0.1:{}'.format(port))
+    for _ in range(100):
+        try:
+            client.list_tables()
+            return server
+        except Exception:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('moto server did not start on port {}'.format(port))
+
+def moto_resource(port):
+    return boto3.resource('dynamodb', endpoint_url='http://127.0.0.1:{}'.format(port))
+
+def add_latency(resource, latency):
+    # moto answers in well under a millisecond; sleep `latency` ms before
+    # every request to stand in for the network round trip to DynamoDB
+    if latency:
+        resource.meta.client.meta.events.register(
+            'before-send.dynamodb', lambda **kwargs: time.sleep(latency / 1000.0)
+        )
+
+def synthetic_node(i, groups=500):
+    return {
+        'UniqueName': 'node{:06d}.saas-n.com'.format(i),
+        'NodeGroupName': synthetic_node_group_name(i % groups),
+        'EnvironmentName': ('master', 'production', 'staging')[i % 3],
+        'PuppetClusterName': 'ny2-saas-n{}'.format(i % 8),
+    }
+
+def create_node_table(resource, nodes, table_name='Node'):
+    table = resource.create_table(TableName=table_name, BillingMode='PAY_PER_REQUEST', **NODE_KEY_SCHEMA)
+    with table.batch_writer() as batch:
+        for i in range(nodes):
+            batch.put_item(Item=synthetic_node(i))
+    return table
+
+def synthetic_node_group_name(i):
+    return 'BT Group {:03d}'.format(i)
+
+def create_tables(resource):
+    # Empty Node, NodeGroup, Environment, Classification, ChangeLog and
+    # NameGuard tables with the key schemas of dynamodb.tf
+    def create(name, hash_key, range_key=None):
+        keys = [(hash_key, 'HASH')] + ([(range_key, 'RANGE')] if range_key else [])
+        return resource.create_table(
+            TableName=name, BillingMode='PAY_PER_REQUEST',
+            KeySchema=[{'AttributeName': key, 'KeyType': key_type} for key, key_type in keys],
+            AttributeDefinitions=[{'AttributeName': key, 'AttributeType': 'S'} for key, _ in keys]
+        )
+    create('Node', 'UniqueName', 'NodeGroupName')
+    create('NodeGroup', 'Name', 'Class')
+    create('Environment', 'EnvironmentName', 'PuppetClusterName')
+    create('Classification', 'UniqueName')
+    create('ChangeLog', 'Feed', 'Position')
+    create('NameGuard', 'Name')
@@ -20,6 +20,10 @@ resource "aws_dynamodb_table" "environments" {
     Environment = "Production"
   }
 
+  # Changes feed the change log (changes.py)
+  stream_enabled   = true
+  stream_view_type = "NEW_AND_OLD_IMAGES"
+
   read_capacity  = 5
   write_capacity = 5
 }
@@ -96,6 +100,10 @@ resource "aws_dynamodb_table" "node_group" {
     type = "S"
   }
 
+  # Only rows written before parameters moved to the ParameterSet map still
+  # have the Parameters string; tools/migrate_node_group_parameters.py moves
+  # them over and the index then empties. Removing an LSI replaces the table,
+  # so it stays defined.
   local_secondary_index {
     name               = "ParametersIndex"
     range_key          = "Parameters"
@@ -108,6 +116,10 @@ resource "aws_dynamodb_table" "node_group" {
     Environment = "Production"
   }
 
+  # Changes feed the change log (changes.py)
+  stream_enabled   = true
+  stream_view_type = "NEW_AND_OLD_IMAGES"
+
   read_capacity  = 5
   write_capacity = 5
 }
@@ -203,11 +215,44 @@ resource "aws_dynamodb_table" "node" {
     non_key_attributes = ["NodeGroupID"]
   }
 
+  # Fleet-wide lookups ("which nodes are in cluster X"). The LSIs above are
+  # scoped to a single UniqueName partition and cannot answer these.
+  global_secondary_index {
+    name            = "EnvironmentNameIndex"
+    hash_key        = "EnvironmentName"
+    range_key       = "UniqueName"
+    projection_type = "ALL"
+    read_capacity   = 5
+    write_capacity  = 5
+  }
+
+  global_secondary_index {
+    name            = "PuppetClusterNameIndex"
+    hash_key        = "PuppetClusterName"
+    range_key       = "UniqueName"
+    projection_type = "ALL"
+    read_capacity   = 5
+    write_capacity  = 5
+  }
+
+  global_secondary_index {
+    name            = "NodeGroupNameIndex"
+    hash_key        = "NodeGroupName"
+    range_key       = "UniqueName"
+    projection_type = "ALL"
+    read_capacity   = 5
+    write_capacity  = 5
+  }
+
   tags = {
     Name        = "Node"
     Environment = "Production"
   }
 
+  # Changes feed the change log (changes.py)
+  stream_enabled   = true
+  stream_view_type = "NEW_AND_OLD_IMAGES"
+
   read_capacity  = 5
   write_capacity = 5
 }
@@ -260,4 +305,139 @@ resource "aws_appautoscaling_policy" "dynamodb_node_write_policy" {
 
     target_value = 70.0
   }
-}
\ No newline at end of file
+}
+
+# Auto Scaling for the node table's global secondary indexes
+locals {
+  node_gsi_names = ["EnvironmentNameIndex", "PuppetClusterNameIndex", "NodeGroupNameIndex"]
+}
+
+resource "aws_appautoscaling_target" "dynamodb_node_gsi_read_target" {
+  for_each           = toset(local.node_gsi_names)
+  max_capacity       = 40
+  min_capacity       = 5
+  resource_id        = "table/Node/index/${each.value}"
+  scalable_dimension = "dynamodb:index:ReadCapacityUnits"
+  service_namespace  = "dynamodb"
+  depends_on         = [aws_dynamodb_table.node]
+}
+
+resource "aws_appautoscaling_policy" "dynamodb_node_gsi_read_policy" {
+  for_each           = aws_appautoscaling_target.dynamodb_node_gsi_read_target
+  name               = "DynamoDBNode${each.key}ReadScalingPolicy"
+  policy_type        = "TargetTrackingScaling"
+  resource_id        = each.value.resource_id
+  scalable_dimension = each.value.scalable_dimension
+  service_namespace  = each.value.service_namespace
+
+  target_tracking_scaling_policy_configuration {
+    predefined_metric_specification {
+      predefined_metric_type = "DynamoDBReadCapacityUtilization"
+    }
+
+    target_value = 70.0
+  }
+}
+
+# Index writes follow table writes, so they scale to the same ceiling
+resource "aws_appautoscaling_target" "dynamodb_node_gsi_write_target" {
+  for_each           = toset(local.node_gsi_names)
+  max_capacity       = 20
+  min_capacity       = 5
+  resource_id        = "table/Node/index/${each.value}"
+  scalable_dimension = "dynamodb:index:WriteCapacityUnits"
+  service_namespace  = "dynamodb"
+  depends_on         = [aws_dynamodb_table.node]
+}
+
+resource "aws_appautoscaling_policy" "dynamodb_node_gsi_write_policy" {
+  for_each           = aws_appautoscaling_target.dynamodb_node_gsi_write_target
+  name               = "DynamoDBNode${each.key}WriteScalingPolicy"
+  policy_type        = "TargetTrackingScaling"
+  resource_id        = each.value.resource_id
+  scalable_dimension = each.value.scalable_dimension
+  service_namespace  = each.value.service_namespace
+
+  target_tracking_scaling_policy_configuration {
+    predefined_metric_specification {
+      predefined_metric_type = "DynamoDBWriteCapacityUtilization"
+    }
+
+    target_value = 70.0
+  }
+}
+
+# DynamoDB Table: change log, written by the stream consumer in changes.py.
+# Changes are spread over CHANGE_LOG_SHARDS partitions, changes#0 to
+# changes#<n-1>, by a hash of their item, so bursts are not throttled at the
+# write limit of one partition key. Each is sorted by Position and readers
+# merge them; entries expire after CHANGE_LOG_RETENTION_DAYS. Writes follow
+# bursts of inventory changes, so the table is billed on demand.
+resource "aws_dynamodb_table" "change_log" {
+  name         = "ChangeLog"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "Feed"
+  range_key    = "Position"
+
+  attribute {
+    name = "Feed"
+    type = "S"
+  }
+
+  attribute {
+    name = "Position"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "ExpiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "ChangeLog"
+    Environment = "Production"
+  }
+}
+
+# DynamoDB Table: materialized classification documents, one per node, kept
+# current by the stream consumer in classification.py and read by classify
+# with a single GetItem. Writes fan out from node group changes, so the table
+# is billed on demand.
+resource "aws_dynamodb_table" "classification" {
+  name         = "Classification"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "UniqueName"
+
+  attribute {
+    name = "UniqueName"
+    type = "S"
+  }
+
+  tags = {
+    Name        = "Classification"
+    Environment = "Production"
+  }
+}
+
+# One claim per node name and node group name. Node and NodeGroup items are
+# keyed on the name plus a range key, so every create writes its claim here
+# in the same transaction to keep a name from being created twice under
+# different node groups or classes, and every delete or rename releases it
+# in the same transaction (dynamo.claim_name). Claims of items written
+# before this table existed come from tools/backfill_name_guard.py.
+resource "aws_dynamodb_table" "name_guard" {
+  name         = "NameGuard"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "Name"
+
+  attribute {
+    name = "Name"
+    type = "S"
+  }
+
+  tags = {
+    Name        = "NameGuard"
+    Environment = "Production"
+  }
+}
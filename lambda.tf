@@ -2,32 +2,59 @@ data "aws_iam_role" "lambda_exec" {
   name = "LambdaDdbPost"
 }
 
+# Serve every route from the single encHandler function (enc.py) instead of
+# the per-resource functions
+variable "unified_enc" {
+  description = "Route all API Gateway methods to the unified ENC Lambda"
+  type        = bool
+  default     = false
+}
+
 locals {
   python_version = "python3.9"
   type           = "zip" 
 }
 
+# All handlers are shipped in one archive so they can import the shared
+# modules in lambdas/src/handlers (e.g. dynamo.py)
+data "archive_file" "lambda_zip_handlers" {
+  type        = local.type
+  output_path = "${path.module}/handlers_lambda_function_src.zip"
+
+  dynamic "source" {
+    for_each = fileset("${path.module}/lambdas/src/handlers", "*.py")
+    content {
+      content  = file("${path.module}/lambdas/src/handlers/${source.value}")
+      filename = "lambdas/src/handlers/${source.value}"
+    }
+  }
+}
+
 # Node handler
 resource "local_file" "lambda_python_code_node" {
   content  = file("${path.module}/lambdas/src/handlers/node.py")
   filename = "${path.module}/lambdas/src/handlers/node.py"
 }
 
-data "archive_file" "lambda_zip_node" {
-  type        = local.type
-  source_file = "${path.module}/lambdas/src/handlers/node.py"
-  output_path = "${path.module}/node_lambda_function_src.zip"
-}
-
 resource "aws_lambda_function" "node_handler" {
   function_name    = "nodeHandler"
-  filename         = data.archive_file.lambda_zip_node.output_path
+  filename         = data.archive_file.lambda_zip_handlers.output_path
   description      = "Handle CRUD operations on Node data in DynamoDB using FastAPI"
   runtime          = local.python_version
-  handler          = "node.handler"
-  source_code_hash = data.archive_file.lambda_zip_node.output_base64sha256
+  handler          = "lambdas/src/handlers/node.handler"
+  source_code_hash = data.archive_file.lambda_zip_handlers.output_base64sha256
   role             = data.aws_iam_role.lambda_exec.arn
   depends_on       = [local_file.lambda_python_code_node]
+
+  # The batch routes write up to hundreds of nodes per request. Just under
+  # API Gateway's 29 second integration timeout.
+  timeout = 28
+
+  environment {
+    variables = {
+      NAME_GUARD_TABLE_NAME = aws_dynamodb_table.name_guard.name
+    }
+  }
 }
 
 # Node group handler
@@ -36,21 +63,29 @@ resource "local_file" "lambda_python_code_node_group" {
   filename = "${path.module}/lambdas/src/handlers/node_group.py"
 }
 
-data "archive_file" "lambda_zip_node_group" {
-  type        = local.type
-  source_file = "${path.module}/lambdas/src/handlers/node_group.py"
-  output_path = "${path.module}/node_group_lambda_function_src.zip"
-}
-
 resource "aws_lambda_function" "node_group_handler" {
   function_name    = "nodeGroupHandler"
-  filename         = data.archive_file.lambda_zip_node_group.output_path
+  filename         = data.archive_file.lambda_zip_handlers.output_path
   description      = "Handle CRUD operations on Node Group data in DynamoDB using FastAPI"
   runtime          = local.python_version
-  handler          = "node_group.handler"
-  source_code_hash = data.archive_file.lambda_zip_node_group.output_base64sha256
+  handler          = "lambdas/src/handlers/node_group.handler"
+  source_code_hash = data.archive_file.lambda_zip_handlers.output_base64sha256
   role             = data.aws_iam_role.lambda_exec.arn
   depends_on       = [local_file.lambda_python_code_node_group]
+
+  # Reassign and cascade delete walk every member node in one request. Just
+  # under API Gateway's 29 second integration timeout.
+  timeout = 28
+
+  environment {
+    variables = {
+      NODE_GROUP_TABLE_NAME    = aws_dynamodb_table.node_group.name
+      NODE_TABLE_NAME          = aws_dynamodb_table.node.name
+      NAME_GUARD_TABLE_NAME    = aws_dynamodb_table.name_guard.name
+      CHANGE_LOG_TABLE_NAME    = aws_dynamodb_table.change_log.name
+      CHANGE_LOG_POLL_INTERVAL = "5"
+    }
+  }
 }
 
 # Environment handler
@@ -59,19 +94,169 @@ resource "local_file" "lambda_python_code_environment" {
   filename = "${path.module}/lambdas/src/handlers/environment.py"
 }
 
-data "archive_file" "lambda_zip_environment" {
-  type        = local.type
-  source_file = "${path.module}/lambdas/src/handlers/environment.py"
-  output_path = "${path.module}/environment_lambda_function_src.zip"
-}
-
 resource "aws_lambda_function" "environment_handler" {
   function_name    = "environmentHandler"
-  filename         = data.archive_file.lambda_zip_environment.output_path
+  filename         = data.archive_file.lambda_zip_handlers.output_path
   description      = "Handle CRUD operations on Environment data in DynamoDB using FastAPI"
   runtime          = local.python_version
-  handler          = "environment.handler"
-  source_code_hash = data.archive_file.lambda_zip_environment.output_base64sha256
+  handler          = "lambdas/src/handlers/environment.handler"
+  source_code_hash = data.archive_file.lambda_zip_handlers.output_base64sha256
   role             = data.aws_iam_role.lambda_exec.arn
   depends_on       = [local_file.lambda_python_code_environment]
-}
\ No newline at end of file
+
+  environment {
+    variables = {
+      ENVIRONMENT_TABLE_NAME   = aws_dynamodb_table.environments.name
+      CHANGE_LOG_TABLE_NAME    = aws_dynamodb_table.change_log.name
+      CHANGE_LOG_POLL_INTERVAL = "5"
+    }
+  }
+}
+
+# Classify handler
+resource "local_file" "lambda_python_code_classify" {
+  content  = file("${path.module}/lambdas/src/handlers/classify.py")
+  filename = "${path.module}/lambdas/src/handlers/classify.py"
+}
+
+resource "aws_lambda_function" "classify_handler" {
+  function_name    = "classifyHandler"
+  filename         = data.archive_file.lambda_zip_handlers.output_path
+  description      = "Resolve the Puppet ENC classification of a node from Node, NodeGroup and Environment in DynamoDB"
+  runtime          = local.python_version
+  handler          = "lambdas/src/handlers/classify.handler"
+  source_code_hash = data.archive_file.lambda_zip_handlers.output_base64sha256
+  role             = data.aws_iam_role.lambda_exec.arn
+  depends_on       = [local_file.lambda_python_code_classify]
+
+  environment {
+    variables = {
+      NODE_TABLE_NAME           = aws_dynamodb_table.node.name
+      NODE_GROUP_TABLE_NAME     = aws_dynamodb_table.node_group.name
+      ENVIRONMENT_TABLE_NAME    = aws_dynamodb_table.environments.name
+      CLASSIFICATION_TABLE_NAME = aws_dynamodb_table.classification.name
+      CHANGE_LOG_TABLE_NAME     = aws_dynamodb_table.change_log.name
+      CHANGE_LOG_POLL_INTERVAL  = "5"
+    }
+  }
+}
+
+# Unified handler: node, node group, environment and classify routes in one
+# app sharing a DynamoDB client and lookup caches
+resource "aws_lambda_function" "enc_handler" {
+  count            = var.unified_enc ? 1 : 0
+  function_name    = "encHandler"
+  filename         = data.archive_file.lambda_zip_handlers.output_path
+  description      = "Serve every External Node Classifier route from one FastAPI app"
+  runtime          = local.python_version
+  handler          = "lambdas/src/handlers/enc.handler"
+  source_code_hash = data.archive_file.lambda_zip_handlers.output_base64sha256
+  role             = data.aws_iam_role.lambda_exec.arn
+  memory_size      = 512
+
+  # Serves the batch, reassign and cascade routes too
+  timeout = 28
+
+  environment {
+    variables = {
+      NODE_TABLE_NAME           = aws_dynamodb_table.node.name
+      NODE_GROUP_TABLE_NAME     = aws_dynamodb_table.node_group.name
+      ENVIRONMENT_TABLE_NAME    = aws_dynamodb_table.environments.name
+      CLASSIFICATION_TABLE_NAME = aws_dynamodb_table.classification.name
+      NAME_GUARD_TABLE_NAME     = aws_dynamodb_table.name_guard.name
+      CHANGE_LOG_TABLE_NAME     = aws_dynamodb_table.change_log.name
+      CHANGE_LOG_POLL_INTERVAL  = "5"
+    }
+  }
+}
+
+# Change log API (GET /changes)
+resource "aws_lambda_function" "changes_handler" {
+  function_name    = "changesHandler"
+  filename         = data.archive_file.lambda_zip_handlers.output_path
+  description      = "Serve the change log of the Node, NodeGroup and Environment tables"
+  runtime          = local.python_version
+  handler          = "lambdas/src/handlers/changes.handler"
+  source_code_hash = data.archive_file.lambda_zip_handlers.output_base64sha256
+  role             = data.aws_iam_role.lambda_exec.arn
+
+  environment {
+    variables = {
+      CHANGE_LOG_TABLE_NAME = aws_dynamodb_table.change_log.name
+    }
+  }
+}
+
+# Stream consumer appending every Node, NodeGroup and Environment change to
+# the change log. The execution role needs dynamodb:GetRecords,
+# GetShardIterator, DescribeStream and ListStreams on the table streams.
+resource "aws_lambda_function" "change_stream_handler" {
+  function_name    = "changeStreamHandler"
+  filename         = data.archive_file.lambda_zip_handlers.output_path
+  description      = "Append DynamoDB stream records of the ENC tables to the change log"
+  runtime          = local.python_version
+  handler          = "lambdas/src/handlers/changes.stream_handler"
+  source_code_hash = data.archive_file.lambda_zip_handlers.output_base64sha256
+  role             = data.aws_iam_role.lambda_exec.arn
+  timeout          = 60
+
+  environment {
+    variables = {
+      CHANGE_LOG_TABLE_NAME = aws_dynamodb_table.change_log.name
+    }
+  }
+}
+
+resource "aws_lambda_event_source_mapping" "change_stream" {
+  for_each = {
+    node        = aws_dynamodb_table.node.stream_arn
+    node_group  = aws_dynamodb_table.node_group.stream_arn
+    environment = aws_dynamodb_table.environments.stream_arn
+  }
+  event_source_arn                   = each.value
+  function_name                      = aws_lambda_function.change_stream_handler.arn
+  starting_position                  = "LATEST"
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 1
+  # A failing batch is split in half on every retry, so one bad record
+  # cannot hold up the shard, and given up after ten retries
+  bisect_batch_on_function_error = true
+  maximum_retry_attempts         = 10
+}
+
+# Stream consumer keeping the Classification documents current. A node
+# group change rewrites the document of every member node.
+resource "aws_lambda_function" "classification_stream_handler" {
+  function_name    = "classificationStreamHandler"
+  filename         = data.archive_file.lambda_zip_handlers.output_path
+  description      = "Rebuild the classification documents of changed nodes and node groups"
+  runtime          = local.python_version
+  handler          = "lambdas/src/handlers/classification.stream_handler"
+  source_code_hash = data.archive_file.lambda_zip_handlers.output_base64sha256
+  role             = data.aws_iam_role.lambda_exec.arn
+  timeout          = 60
+
+  environment {
+    variables = {
+      NODE_TABLE_NAME           = aws_dynamodb_table.node.name
+      NODE_GROUP_TABLE_NAME     = aws_dynamodb_table.node_group.name
+      CLASSIFICATION_TABLE_NAME = aws_dynamodb_table.classification.name
+    }
+  }
+}
+
+resource "aws_lambda_event_source_mapping" "classification_stream" {
+  for_each = {
+    node       = aws_dynamodb_table.node.stream_arn
+    node_group = aws_dynamodb_table.node_group.stream_arn
+  }
+  event_source_arn                   = each.value
+  function_name                      = aws_lambda_function.classification_stream_handler.arn
+  starting_position                  = "LATEST"
+  batch_size                         = 100
+  maximum_batching_window_in_seconds = 1
+  # A failing batch is split in half on every retry, so one bad record
+  # cannot hold up the shard, and given up after ten retries
+  bisect_batch_on_function_error = true
+  maximum_retry_attempts         = 10
+}
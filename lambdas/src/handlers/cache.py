@@ -0,0 +1,125 @@
+# lambdas/src/handlers/cache.py
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from lambdas.src.handlers import metrics
+
+class SingleFlight:
+    # Concurrent do() calls for the same key share one call of `load` and
+    # its result or error, so a burst of identical cache misses costs one
+    # DynamoDB read. Calls are shared within one event loop.
+    def __init__(self):
+        self.collapsed = 0
+        self._calls = {}
+
+    async def do(self, key, load):
+        call = (id(asyncio.get_running_loop()), key)
+        future = self._calls.get(call)
+        if future is not None:
+            self.collapsed += 1
+            metrics.increment('coalesced')
+            # A waiter that gets cancelled must not cancel the shared call
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call] = future
+        try:
+            result = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Mark the error retrieved in case no other caller was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[call]
+
+class TTLCache:
+    # Bounded LRU cache whose entries expire after `ttl` seconds. Instances are
+    # kept at module scope so they survive across warm Lambda invocations.
+    # Expired entries are kept `stale_ttl` seconds longer for get_stale(),
+    # which serves them while DynamoDB is throttling.
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, stale_ttl: float = 0.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # Loads of missing entries in progress, see dynamo.run_or_stale()
+        self.flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Bumped by invalidate() per key and by clear() for all keys, so a
+        # load that started before a write does not cache what it read
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                if entry[0] + self.stale_ttl < time.monotonic():
+                    del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_stale(self, key):
+        # The entry of `key` even if it has expired, unless it is older than
+        # ttl + stale_ttl or was invalidated
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] + self.stale_ttl < time.monotonic():
+                return None
+            return entry[1]
+
+    def generation(self, key):
+        # Take this before reading `key` from DynamoDB and pass it to set()
+        with self._lock:
+            return (self._epoch, self._generations.get(key, 0))
+
+    def set(self, key, value, generation=None):
+        # With `generation`, the value is dropped if `key` was invalidated
+        # since generation() returned it: it may predate the write
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+            self.hits = 0
+            self.misses = 0
+            self.flights.collapsed = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.flights.collapsed,
+            }
@@ -0,0 +1,259 @@
+# lambdas/src/handlers/changes.py
+import contextvars
+import heapq
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from fastapi import APIRouter, FastAPI, HTTPException, Query
+from mangum import Mangum
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import TypeDeserializer
+from lambdas.src.handlers import dynamo, metrics
+
+# Change log of the Node, NodeGroup and Environment tables. stream_handler
+# consumes their DynamoDB Streams and appends one ChangeLog item per change;
+# GET /changes serves the log to downstream consumers, and the read routes
+# call sync() to drop cache entries other functions changed.
+app = FastAPI()
+router = APIRouter()
+
+# Use the table name from CHANGE_LOG_TABLE_NAME or default to 'ChangeLog'
+table_name = os.getenv('CHANGE_LOG_TABLE_NAME', 'ChangeLog')
+
+change_log_table = dynamo.Table(table_name)
+
+# Changes are spread over `shards` partitions, changes#0 to changes#<n-1>,
+# by a hash of their table and keys, since one partition key takes only
+# about 1000 writes per second. Each partition is sorted by Position:
+# <milliseconds written>-<stream sequence number>-<table>
+# Positions compare across partitions, so readers merge them in order.
+# Writers and readers must agree on the count; raise it, never lower it,
+# or the entries of the dropped partitions are no longer read.
+FEED = 'changes'
+shards = int(os.getenv('CHANGE_LOG_SHARDS', '10'))
+TOKEN = re.compile(r'^\d{13}(-\d{40}-[\w.-]+)?$')
+
+# Changes expire from the log after this many days (DynamoDB TTL)
+retention_days = float(os.getenv('CHANGE_LOG_RETENTION_DAYS', '7'))
+
+# Readers stay this far behind the clock, so a change that a concurrent
+# stream batch writes a moment late is still read in order
+settle_ms = int(os.getenv('CHANGE_LOG_SETTLE_MS', '2000'))
+
+# Seconds between cache syncs of a warm handler; 0 leaves the caches to
+# their TTL alone
+poll_interval = float(os.getenv('CHANGE_LOG_POLL_INTERVAL', '0'))
+
+# A sync replays at most this many changes; with more behind it, the
+# subscribed caches are cleared instead
+sync_limit = int(os.getenv('CHANGE_LOG_SYNC_LIMIT', '1000'))
+
+deserializer = TypeDeserializer()
+
+# Reads query every partition concurrently
+shard_pool = ThreadPoolExecutor(max_workers=shards, thread_name_prefix='changes')
+
+# Health check endpoint
+@app.get("/healthcheck")
+async def healthcheck():
+    return {"status": "ok"}
+
+def now_ms():
+    return int(time.time() * 1000)
+
+def horizon():
+    # Token of the newest position readers may see yet
+    return '{:013d}'.format(now_ms() - settle_ms)
+
+def feed(table: str, keys: dict):
+    # Partition of the changes of one item; crc32 rather than hash(), which
+    # differs between processes
+    key = '{}/{}'.format(table, '/'.join('{}={}'.format(name, keys[name]) for name in sorted(keys)))
+    return '{}#{}'.format(FEED, zlib.crc32(key.encode()) % shards)
+
+def change_item(record: dict, written_ms: int):
+    # The ChangeLog item of one stream record. Only keys and the new Version
+    # are kept; consumers read the records themselves, e.g. POST /nodes/lookup.
+    table = record['eventSourceARN'].split('/')[1]
+    change = record['dynamodb']
+    keys = {name: deserializer.deserialize(value) for name, value in change['Keys'].items()}
+    item = {
+        'Feed': feed(table, keys),
+        'Position': '{:013d}-{:0>40}-{}'.format(written_ms, change['SequenceNumber'], table),
+        'Table': table,
+        'Event': record['eventName'],
+        'Keys': keys,
+        'ExpiresAt': written_ms // 1000 + int(retention_days * 86400),
+    }
+    if 'Version' in change.get('NewImage', {}):
+        item['Version'] = deserializer.deserialize(change['NewImage']['Version'])
+    return item
+
+# Writes of a chunk that end more than settle_ms after its timestamp are
+# repeated this many times before the batch fails
+late_writes = int(os.getenv('CHANGE_LOG_LATE_WRITES', '3'))
+
+def write_changes(records: list):
+    # Write one chunk of changes, stamped right before the write. Readers stay
+    # settle_ms behind the clock, so a write that ends later than that may
+    # land behind a reader that has moved on; it is written again under a
+    # fresh position, and the reader sees it there.
+    for _ in range(late_writes):
+        written_ms = now_ms()
+        errors = dynamo.write_batch(change_log_table, [{'PutRequest': {'Item': change_item(record, written_ms)}}
+                                                       for record in records])
+        failed = [error for error in errors if error is not None]
+        if failed:
+            raise RuntimeError("Could not write {} changes: {}".format(len(failed), failed[0]))
+        if now_ms() <= written_ms + settle_ms:
+            return
+        metrics.increment('late_changes', len(records))
+    raise RuntimeError("Writing {} changes took longer than {} ms".format(len(records), settle_ms))
+
+def stream_handler(event, context):
+    # Entry point of the stream consumer Lambda. A failed write raises, so
+    # Lambda retries the batch; consumers may therefore see a change twice.
+    records = event.get('Records', [])
+    for i in range(0, len(records), dynamo.BATCH_WRITE_SIZE):
+        write_changes(records[i:i + dynamo.BATCH_WRITE_SIZE])
+    return {"changes": len(records)}
+
+def read_shard(table, shard: int, since: Optional[str], until: str, limit: Optional[int],
+               tables: Optional[List[str]] = None):
+    # Changes of one partition after `since` up to `until`, oldest first,
+    # and whether more remain; only those of `tables` when given
+    position = Key('Position').between(since, until) if since else Key('Position').lt(until)
+    args = {'KeyConditionExpression': Key('Feed').eq('{}#{}'.format(FEED, shard)) & position}
+    if tables is not None:
+        args['FilterExpression'] = Attr('Table').is_in(tables)
+    changes = []
+    while True:
+        if limit is not None:
+            args['Limit'] = limit - len(changes) + 1
+        response = table.query(**args)
+        changes.extend(item for item in response.get('Items', []) if item['Position'] != since)
+        if 'LastEvaluatedKey' not in response:
+            return changes[:limit], limit is not None and len(changes) > limit
+        if limit is not None and len(changes) >= limit:
+            return changes[:limit], True
+        args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def read_changes(table, since: Optional[str], until: str, limit: Optional[int] = None,
+                 tables: Optional[List[str]] = None):
+    # Changes after `since` up to `until`, oldest first, and whether more
+    # remain. `since` itself is excluded. Every partition is read up to
+    # `limit`, which holds all of its changes among the first `limit` of the
+    # merge.
+    if since is not None and since >= until:
+        return [], False
+    # Each read runs in a copy of this context, so the metric hooks still
+    # count it against the route
+    futures = [shard_pool.submit(contextvars.copy_context().run, read_shard, table, shard, since, until, limit, tables)
+               for shard in range(shards)]
+    results = [future.result() for future in futures]
+    changes = list(heapq.merge(*(shard_changes for shard_changes, _ in results), key=lambda item: item['Position']))
+    more = any(shard_more for _, shard_more in results)
+    if limit is not None and len(changes) > limit:
+        return changes[:limit], True
+    return changes, more
+
+# (cache, key) pairs per table name: `key` maps the keys of a changed item
+# to the entry of `cache` to drop
+subscribers = {}
+
+def subscribe(table: str, cache, key):
+    subscribers.setdefault(table, []).append((cache, key))
+
+def clear_subscribers():
+    for subscriptions in subscribers.values():
+        for cache, _ in subscriptions:
+            cache.clear()
+
+_synced_to = None
+_synced_at = 0.0
+_sync_lock = threading.Lock()
+
+def sync_due():
+    return bool(poll_interval) and time.monotonic() - _synced_at >= poll_interval
+
+def sync_caches(table):
+    # Hand every change since the last sync to the subscribers, so entries
+    # another function changed are dropped instead of served until their TTL.
+    # Errors reach run(), so the change log's breaker sees throttling.
+    global _synced_to, _synced_at
+    if not _sync_lock.acquire(blocking=False):
+        return
+    try:
+        if not sync_due():
+            return
+        until = horizon()
+        if _synced_to is not None and subscribers:
+            # An entry cached before the last sync has expired once the gap
+            # exceeds the TTL, but any entry may have changed since; a long
+            # gap or backlog costs the caches their entries rather than a
+            # replay of every change
+            ttl = min(cache.ttl for subscriptions in subscribers.values() for cache, _ in subscriptions)
+            if int(until[:13]) - int(_synced_to[:13]) > ttl * 1000:
+                clear_subscribers()
+            else:
+                changes, more = read_changes(table, _synced_to, until, sync_limit, sorted(subscribers))
+                if more:
+                    clear_subscribers()
+                else:
+                    for change in changes:
+                        for cache, key in subscribers[change['Table']]:
+                            cache.invalidate(key(change['Keys']))
+        # Nothing is cached before the first sync, so it has nothing to replay
+        _synced_to = until
+        _synced_at = time.monotonic()
+    finally:
+        _sync_lock.release()
+
+async def sync():
+    # Called at the start of cached read routes; costs one query per
+    # poll_interval and nothing in between. The read never fails because of
+    # it: while the change log's breaker is open the sync is skipped, and a
+    # failed sync keeps serving the caches, whose TTL still bounds staleness.
+    if not sync_due() or dynamo.breaker_for(table_name).is_open():
+        return
+    try:
+        await dynamo.run(sync_caches, change_log_table)
+    except Exception:
+        metrics.increment('sync_failed')
+
+@router.get("/changes")
+async def get_changes(
+    since: Optional[str] = Query(None, description="next_token of the previous call; omit to read the whole log"),
+    limit: int = Query(500, ge=1, le=1000, description="Maximum number of changes per call"),
+):
+    if since is not None:
+        if not TOKEN.match(since):
+            raise HTTPException(status_code=400, detail="Invalid token")
+        if int(since[:13]) < now_ms() - retention_days * 86400 * 1000:
+            raise HTTPException(status_code=410, detail="Changes since this token have expired; re-read the inventory")
+    until = horizon()
+    changes, more = await dynamo.run(read_changes, change_log_table, since, until, limit)
+    if more:
+        next_token = changes[-1]['Position']
+    else:
+        next_token = max(since or until, until)
+    return {
+        "changes": [{
+            "token": change['Position'],
+            "table": change['Table'],
+            "event": change['Event'],
+            "keys": change['Keys'],
+            "version": change.get('Version'),
+        } for change in changes],
+        "next_token": next_token,
+        "more": more,
+    }
+
+app.include_router(router)
+app.include_router(metrics.router)
+app.add_middleware(metrics.RequestTiming)
+handler = Mangum(app)
@@ -0,0 +1,125 @@
+# lambdas/src/handlers/classification.py
+import asyncio
+import json
+import os
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
+from lambdas.src.handlers import dynamo
+from lambdas.src.handlers.node_group import encode_parameters, stored_parameters
+
+# Materialized classification documents: one Classification item per node
+# holding the node's environment together with the Class and Parameters of
+# its node group, so classify answers with a single GetItem instead of
+# joining Node and NodeGroup. stream_handler keeps the documents current from
+# the Node and NodeGroup streams; tools.rebuild_classifications regenerates
+# them from scratch.
+
+node_table_name = os.getenv('NODE_TABLE_NAME', 'Node')
+node_group_table_name = os.getenv('NODE_GROUP_TABLE_NAME', 'NodeGroup')
+classification_table_name = os.getenv('CLASSIFICATION_TABLE_NAME', 'Classification')
+
+node_table = dynamo.Table(node_table_name)
+node_group_table = dynamo.Table(node_group_table_name)
+classification_table = dynamo.Table(classification_table_name)
+
+deserializer = TypeDeserializer()
+
+def node_environment(node: dict):
+    # Nodes written before the attributes were renamed use lowercase names
+    return (
+        node.get('EnvironmentName', node.get('environment_name')),
+        node.get('PuppetClusterName', node.get('puppet_cluster_name')),
+    )
+
+def classification_item(node: dict, node_group: dict):
+    # The document of `node` as a member of `node_group`. Parameters are
+    # copied as stored, so large sets stay compressed.
+    environment_name, puppet_cluster_name = node_environment(node)
+    parameters = stored_parameters(node_group)
+    if isinstance(parameters, str):
+        parameters = encode_parameters(json.loads(parameters))
+    item = {
+        'UniqueName': node['UniqueName'],
+        'NodeGroupName': node['NodeGroupName'],
+        'EnvironmentName': environment_name,
+        'PuppetClusterName': puppet_cluster_name,
+        'Class': node_group['Class'],
+        'Parameters': parameters if parameters is not None else {},
+    }
+    # The versions the document was built from, for tracing a stale document
+    if 'Version' in node:
+        item['NodeVersion'] = node['Version']
+    if 'Version' in node_group:
+        item['NodeGroupVersion'] = node_group['Version']
+    return item
+
+def fetch_node_group(node_group_name: str, node_groups: dict):
+    # Node group items read during one stream batch, None when missing
+    if node_group_name not in node_groups:
+        items = node_group_table.query(KeyConditionExpression=Key('Name').eq(node_group_name)).get('Items', [])
+        node_groups[node_group_name] = items[0] if items else None
+    return node_groups[node_group_name]
+
+def document_request(node: dict, node_group):
+    # Write the node's document, or delete it when its group is gone
+    if node_group is None:
+        return {'DeleteRequest': {'Key': {'UniqueName': node['UniqueName']}}}
+    return {'PutRequest': {'Item': classification_item(node, node_group)}}
+
+def node_requests(unique_name: str, node_groups: dict):
+    # Rebuilt from the current Node item rather than the stream image, so
+    # records handled out of order (e.g. the delete and put of a node moved
+    # to another group) still leave the right document
+    items = node_table.query(KeyConditionExpression=Key('UniqueName').eq(unique_name)).get('Items', [])
+    if not items:
+        return [{'DeleteRequest': {'Key': {'UniqueName': unique_name}}}]
+    return [document_request(items[0], fetch_node_group(items[0]['NodeGroupName'], node_groups))]
+
+def node_group_requests(node_group_name: str, node_groups: dict):
+    # Fan a node group change out to the documents of all its member nodes
+    node_group = fetch_node_group(node_group_name, node_groups)
+    requests = []
+    args = {'IndexName': 'NodeGroupNameIndex', 'KeyConditionExpression': Key('NodeGroupName').eq(node_group_name)}
+    while True:
+        response = node_table.query(**args)
+        requests.extend(document_request(node, node_group) for node in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return requests
+        args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def request_key(request):
+    if 'PutRequest' in request:
+        return request['PutRequest']['Item']['UniqueName']
+    return request['DeleteRequest']['Key']['UniqueName']
+
+def write_documents(requests):
+    # Chunks are written concurrently. BatchWriteItem rejects a batch naming
+    # a key twice, so only the last request for each node is sent.
+    unique = list({request_key(request): request for request in requests}.values())
+    errors = asyncio.run(dynamo.batch_write(classification_table, unique))
+    failed = [error for error in errors if error is not None]
+    if failed:
+        raise RuntimeError("Could not write {} classifications: {}".format(len(failed), failed[0]))
+    return len(unique)
+
+def stream_handler(event, context):
+    # Entry point of the Lambda consuming the Node and NodeGroup streams. A
+    # failed write raises, so Lambda retries the batch; rebuilding a document
+    # twice is harmless.
+    unique_names = set()
+    node_group_names = set()
+    for record in event.get('Records', []):
+        table = record['eventSourceARN'].split('/')[1]
+        keys = {name: deserializer.deserialize(value) for name, value in record['dynamodb']['Keys'].items()}
+        if table == node_table_name:
+            unique_names.add(keys['UniqueName'])
+        elif table == node_group_table_name:
+            node_group_names.add(keys['Name'])
+
+    node_groups = {}
+    requests = []
+    for node_group_name in sorted(node_group_names):
+        requests.extend(node_group_requests(node_group_name, node_groups))
+    for unique_name in sorted(unique_names):
+        requests.extend(node_requests(unique_name, node_groups))
+    return {"classifications": write_documents(requests) if requests else 0}
@@ -0,0 +1,114 @@
+# lambdas/src/handlers/classify.py
+import asyncio
+from fastapi import APIRouter, FastAPI, HTTPException, Path, Query
+from fastapi.responses import PlainTextResponse
+import os
+import yaml
+from mangum import Mangum
+from boto3.dynamodb.conditions import Key
+from lambdas.src.handlers import changes, dynamo, etag, metrics
+from lambdas.src.handlers.classification import node_environment
+from lambdas.src.handlers.environment import environment_cache
+from lambdas.src.handlers.node_group import decode_parameters, node_group_cache
+
+# Initialize FastAPI app
+app = FastAPI()
+router = APIRouter()
+
+node_table_name = os.getenv('NODE_TABLE_NAME', 'Node')
+node_group_table_name = os.getenv('NODE_GROUP_TABLE_NAME', 'NodeGroup')
+environment_table_name = os.getenv('ENVIRONMENT_TABLE_NAME', 'Environment')
+classification_table_name = os.getenv('CLASSIFICATION_TABLE_NAME', 'Classification')
+
+node_table = dynamo.Table(node_table_name)
+node_group_table = dynamo.Table(node_group_table_name)
+environment_table = dynamo.Table(environment_table_name)
+classification_table = dynamo.Table(classification_table_name)
+
+# Health check endpoint
+@app.get("/healthcheck")
+async def healthcheck():
+    return {"status": "ok"}
+
+def fetch_node_group(node_group_name: str):
+    # Cached in node_group.py's cache, so in the unified app a node group
+    # update invalidates the entry classify reads
+    response = node_group_table.query(
+        KeyConditionExpression=Key('Name').eq(node_group_name)
+    )
+    items = [decode_parameters(item) for item in response.get('Items', [])]
+    return etag.represent(items) if items else None
+
+def fetch_environment(environment_name: str, puppet_cluster_name: str):
+    response = environment_table.get_item(
+        Key={'EnvironmentName': environment_name, 'PuppetClusterName': puppet_cluster_name}
+    )
+    return etag.represent([response['Item']]) if 'Item' in response else None
+
+async def lookup(cache, key, fetch, *args):
+    # The cached item, read through fetch() on a miss; while DynamoDB is
+    # throttling an expired entry is served rather than failing the agent run
+    representation = cache.get(key)
+    if representation is None:
+        representation = await dynamo.run_or_stale(cache, key, fetch, *args)
+    return representation.items[0] if representation is not None else None
+
+def fetch_classification(unique_name: str):
+    # The node's materialized document (classification.py), None until the
+    # stream consumer or tools.rebuild_classifications has written it
+    response = classification_table.get_item(Key={'UniqueName': unique_name})
+    item = response.get('Item')
+    return decode_parameters(item) if item is not None else None
+
+def build_classification(node_group: dict, environment: dict):
+    parameters = dynamo.from_item_value(node_group.get('Parameters') or {})
+    parameters['puppet_cluster'] = environment['PuppetClusterName']
+    return {
+        "classes": {node_group['Class']: {}},
+        "parameters": parameters,
+        "environment": environment['EnvironmentName'],
+    }
+
+@router.get("/classify/{unique_name}")
+async def classify_node(
+    unique_name: str = Path(..., description="The certname of the node to classify"),
+    format: str = Query("yaml", pattern="^(yaml|json)$", description="Output format"),
+):
+    await changes.sync()
+    # The materialized document already joins the node and its node group;
+    # only the environment check is left, and it is usually cached
+    node_group = await dynamo.run(fetch_classification, unique_name)
+    if node_group is not None:
+        environment_key = node_environment(node_group)
+        environment = await lookup(environment_cache, environment_key, fetch_environment, *environment_key)
+    else:
+        response = await dynamo.run(node_table.query,
+            KeyConditionExpression=Key('UniqueName').eq(unique_name)
+        )
+        items = response.get('Items', [])
+        if not items:
+            raise HTTPException(status_code=404, detail="Node not found")
+        node = items[0]
+
+        # The node group and environment lookups only depend on the node
+        # item, so they are issued side by side once the node is known
+        node_group, environment = await asyncio.gather(
+            lookup(node_group_cache, node['NodeGroupName'], fetch_node_group, node['NodeGroupName']),
+            lookup(environment_cache, node_environment(node), fetch_environment, *node_environment(node)),
+        )
+    if node_group is None:
+        raise HTTPException(status_code=404, detail="Node group not found")
+    if environment is None:
+        raise HTTPException(status_code=404, detail="Environment not found")
+
+    classification = build_classification(node_group, environment)
+    if format == "json":
+        return classification
+    with metrics.timed('serialize'):
+        body = yaml.safe_dump(classification, default_flow_style=False)
+    return PlainTextResponse(body, media_type="application/x-yaml")
+
+app.include_router(router)
+app.include_router(metrics.router)
+app.add_middleware(metrics.RequestTiming)
+handler = Mangum(app)
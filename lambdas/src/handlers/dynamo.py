@@ -0,0 +1,729 @@
+# lambdas/src/handlers/dynamo.py
+import asyncio
+import base64
+import binascii
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from lambdas.src.handlers import metrics
+
+try:
+    import orjson
+except ImportError:
+    # Optional: without it responses are encoded by json, byte for byte the same
+    orjson = None
+
+# boto3 calls are blocking, so every handler runs them on this bounded pool
+# instead of on the event loop. Size it with DYNAMODB_MAX_WORKERS.
+max_workers = int(os.getenv('DYNAMODB_MAX_WORKERS', '16'))
+executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dynamodb')
+
+# Client configuration. botocore's adaptive mode retries throttling and
+# transient errors with jittered exponential backoff and slows this process's
+# request rate while DynamoDB keeps throttling. One connection per worker
+# thread is enough, as each thread makes one call at a time. The defaults
+# keep a throttled call, retries included, within about 3 seconds, so a
+# request sees a 503 long before its Lambda or API Gateway times out.
+retry_mode = os.getenv('DYNAMODB_RETRY_MODE', 'adaptive')
+max_attempts = int(os.getenv('DYNAMODB_MAX_ATTEMPTS', '3'))
+max_pool_connections = int(os.getenv('DYNAMODB_MAX_POOL_CONNECTIONS', str(max_workers)))
+connect_timeout = float(os.getenv('DYNAMODB_CONNECT_TIMEOUT', '1'))
+read_timeout = float(os.getenv('DYNAMODB_READ_TIMEOUT', '1'))
+
+# Errors DynamoDB returns when a table or the account is over its throughput
+THROTTLING_ERRORS = {
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'ThrottlingException',
+}
+
+def throttled(error: ClientError):
+    return error.response.get('Error', {}).get('Code') in THROTTLING_ERRORS
+
+class Throttled(HTTPException):
+    # DynamoDB is throttling: raised by run() once the client's retries are
+    # used up, or straight away while the circuit breaker is open
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail="DynamoDB is throttling requests, retry later",
+            headers={'Retry-After': str(max(1, int(retry_after + 0.5)))},
+        )
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive throttled calls. While open, calls
+    # fail fast for `cooldown` seconds instead of adding to the throttling;
+    # then one call is let through and its outcome closes or reopens it.
+    def __init__(self, threshold: int = 5, cooldown: float = 5.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        with self._lock:
+            if self.opened_at is None:
+                return self.cooldown
+            return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing or time.monotonic() < self.opened_at + self.cooldown:
+                return False
+            self._probing = True
+            return True
+
+    def is_open(self):
+        # True while calls fail fast. Unlike allow(), asking never takes the
+        # one call let through after the cooldown.
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            return self._probing or time.monotonic() < self.opened_at + self.cooldown
+
+    def record(self, throttled: bool):
+        with self._lock:
+            self._probing = False
+            if not throttled:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    metrics.increment('circuit_opened')
+                self.opened_at = time.monotonic()
+
+breaker_threshold = int(os.getenv('DYNAMODB_BREAKER_THRESHOLD', '5'))
+breaker_cooldown = float(os.getenv('DYNAMODB_BREAKER_COOLDOWN', '5'))
+
+# One breaker per table, so a table or index that throttles does not fail
+# the calls to the others. Calls whose table is unknown share the None entry.
+breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker_for(table_name):
+    with _breakers_lock:
+        if table_name not in breakers:
+            breakers[table_name] = CircuitBreaker(threshold=breaker_threshold, cooldown=breaker_cooldown)
+        return breakers[table_name]
+
+def table_name_of(func, args):
+    # The table a call goes to: the Table a method is bound to, or the first
+    # Table argument of a helper such as write_batch
+    for candidate in (getattr(func, '__self__', None),) + args:
+        if isinstance(candidate, Table):
+            return candidate.name
+    return None
+
+# Set by batch calls that absorb throttling instead of raising it, e.g.
+# write_batch reporting unprocessed items, so run() still counts the call
+# as throttled
+call_throttled = contextvars.ContextVar('call_throttled', default=False)
+
+def note_throttled():
+    call_throttled.set(True)
+
+async def run(func, *args, **kwargs):
+    # Await a blocking boto3 call, e.g. await run(table.query, KeyConditionExpression=...)
+    # Throttling that outlasts the client's retries raises Throttled (503).
+    breaker = breaker_for(table_name_of(func, args))
+    if not breaker.allow():
+        metrics.increment('short_circuited')
+        raise Throttled(breaker.retry_after())
+    loop = asyncio.get_running_loop()
+    # The copied context carries the route into the client's metric hooks
+    # and brings call_throttled back
+    context = contextvars.copy_context()
+    context.run(call_throttled.set, False)
+    throttling = False
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(executor, context.run, partial(func, *args, **kwargs))
+    except ClientError as error:
+        throttling = throttled(error)
+        if throttling:
+            raise Throttled(breaker.retry_after()) from error
+        raise
+    finally:
+        metrics.add_time('dynamodb', time.perf_counter() - start)
+        breaker.record(throttling or context.get(call_throttled))
+
+async def run_or_stale(cache, key, func, *args, **kwargs):
+    # run() a read of `key` and cache its result unless it is None.
+    # Concurrent misses of the same key share one read, but a miss after an
+    # invalidation starts a new one, and a read overlapping an invalidation
+    # is returned without being cached. While DynamoDB throttles, the
+    # expired entry of `key` is served instead of failing, if the cache still
+    # holds one.
+    generation = cache.generation(key)
+
+    async def load():
+        value = await run(func, *args, **kwargs)
+        if value is not None:
+            cache.set(key, value, generation)
+        return value
+
+    try:
+        return await cache.flights.do((key, generation), load)
+    except Throttled:
+        stale = cache.get_stale(key)
+        if stale is None:
+            raise
+        metrics.increment('stale_served')
+        return stale
+
+def count_throttle(response=None, **kwargs):
+    # needs-retry hook: called after every attempt of a call
+    if response is not None and response[1].get('Error', {}).get('Code') in THROTTLING_ERRORS:
+        metrics.increment('throttles')
+
+def request_capacity(params, model, **kwargs):
+    # before-parameter-build hook: ask every call that can report it for the
+    # capacity it consumed
+    if 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+def consumed_capacity(parsed: dict):
+    # ConsumedCapacity is one entry for single-table calls and a list for
+    # batch and transaction calls
+    consumed = parsed.get('ConsumedCapacity', [])
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return sum(float(entry.get('CapacityUnits', 0)) for entry in consumed)
+
+def record_call(parsed=None, **kwargs):
+    # after-call hook: called once per call with the attempts it took and
+    # the capacity it consumed
+    parsed = parsed or {}
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    if retries:
+        metrics.increment('retries', retries)
+    metrics.add_call(consumed_capacity(parsed))
+
+_client = None
+_client_lock = threading.Lock()
+
+def client():
+    # The low-level DynamoDB client shared by every table. It is built on the
+    # first request instead of at import, and skips boto3's resource layer:
+    # only the handlers that translate Python values and Key/Attr conditions
+    # are registered on it, so it accepts the same arguments as Table methods.
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import boto3
+                from boto3.dynamodb.transform import TransformationInjector, copy_dynamodb_params
+                from botocore.config import Config
+                dynamodb = boto3.client('dynamodb', config=Config(
+                    retries={'mode': retry_mode, 'max_attempts': max_attempts},
+                    max_pool_connections=max_pool_connections,
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout,
+                ))
+                injector = TransformationInjector()
+                events = dynamodb.meta.events
+                events.register('provide-client-params.dynamodb', copy_dynamodb_params,
+                                unique_id='dynamodb-create-params-copy')
+                events.register('before-parameter-build.dynamodb', injector.inject_condition_expressions,
+                                unique_id='dynamodb-condition-expression')
+                events.register('before-parameter-build.dynamodb', injector.inject_attribute_value_input,
+                                unique_id='dynamodb-attr-value-input')
+                events.register('after-call.dynamodb', injector.inject_attribute_value_output,
+                                unique_id='dynamodb-attr-value-output')
+                events.register('needs-retry.dynamodb', count_throttle, unique_id='dynamodb-count-throttle')
+                events.register('after-call.dynamodb', record_call, unique_id='dynamodb-record-call')
+                events.register('before-parameter-build.dynamodb', request_capacity,
+                                unique_id='dynamodb-request-capacity')
+                _client = dynamodb
+    return _client
+
+class TableMeta:
+    @property
+    def client(self):
+        return client()
+
+class Table:
+    # Stand-in for boto3's dynamodb.Table(name) covering the calls the
+    # handlers make. Creating one costs nothing: the shared client is only
+    # built by the first call, so handlers create their tables at import,
+    # under names read from the environment.
+    meta = TableMeta()
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def query(self, **kwargs):
+        return client().query(TableName=self.name, **kwargs)
+
+    def scan(self, **kwargs):
+        return client().scan(TableName=self.name, **kwargs)
+
+    def get_item(self, **kwargs):
+        return client().get_item(TableName=self.name, **kwargs)
+
+    def put_item(self, **kwargs):
+        return client().put_item(TableName=self.name, **kwargs)
+
+    def update_item(self, **kwargs):
+        return client().update_item(TableName=self.name, **kwargs)
+
+    def delete_item(self, **kwargs):
+        return client().delete_item(TableName=self.name, **kwargs)
+
+def condition_failed(error: ClientError):
+    # True when a write, or any write of a transaction, was rejected by its
+    # ConditionExpression
+    code = error.response.get('Error', {}).get('Code')
+    if code == 'TransactionCanceledException':
+        reasons = error.response.get('CancellationReasons', [])
+        return any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons)
+    return code == 'ConditionalCheckFailedException'
+
+def failed_actions(error: ClientError):
+    # Indexes of the actions of a cancelled transaction whose condition failed
+    reasons = error.response.get('CancellationReasons', [])
+    return [i for i, reason in enumerate(reasons) if reason.get('Code') == 'ConditionalCheckFailed']
+
+def initial_version():
+    # Versions start from the clock in milliseconds and go up by one on every
+    # write, so a re-created item never reuses a version of an earlier one
+    return int(time.time() * 1000)
+
+def next_version(version):
+    return int(version) + 1 if version is not None else initial_version()
+
+def version_is(version):
+    # Condition that the stored Version is still `version`; None matches items
+    # written before records were versioned
+    return Attr('Version').eq(version) if version is not None else Attr('Version').not_exists()
+
+def claim_name(guard_table, name):
+    # TransactWriteItems action claiming `name` in guard_table. Every item
+    # whose name must be unique is written together with its claim and
+    # deleted together with release_name(), so the claim exists exactly while
+    # the item does.
+    return {'Put': {
+        'TableName': guard_table.name,
+        'Item': {'Name': name},
+        'ConditionExpression': 'attribute_not_exists(#name)',
+        'ExpressionAttributeNames': {'#name': 'Name'},
+    }}
+
+def release_name(guard_table, name):
+    return {'Delete': {'TableName': guard_table.name, 'Key': {'Name': name}}}
+
+def put_new(table, item, hash_key):
+    # Put action for an item that must not exist yet
+    return {'Put': {
+        'TableName': table.name,
+        'Item': item,
+        'ConditionExpression': 'attribute_not_exists(#key)',
+        'ExpressionAttributeNames': {'#key': hash_key},
+    }}
+
+def delete_existing(table, key, hash_key):
+    # Delete action for an item that must still exist; a claim released in
+    # the same transaction is then never one held by another item
+    return {'Delete': {
+        'TableName': table.name,
+        'Key': key,
+        'ConditionExpression': 'attribute_exists(#key)',
+        'ExpressionAttributeNames': {'#key': hash_key},
+    }}
+
+def put_unique(table, item, hash_key, guard_table, guard_name):
+    # Put a new item unless an item with the same hash key exists under any
+    # range key. A put's condition only covers its own full key, so the item
+    # is written together with the claim on `guard_name`: of two creates of
+    # a name, whatever their range keys, only one claim succeeds. One
+    # TransactWriteItems call, no reads. Returns False when the name is taken.
+    try:
+        table.meta.client.transact_write_items(TransactItems=[
+            claim_name(guard_table, guard_name),
+            put_new(table, item, hash_key),
+        ])
+    except ClientError as error:
+        if condition_failed(error):
+            return False
+        raise
+    return True
+
+def delete_unique(table, key, hash_key, guard_table, guard_name):
+    # Delete an item and release its claim in one transaction. Returns False
+    # when the item does not exist.
+    try:
+        table.meta.client.transact_write_items(TransactItems=[
+            delete_existing(table, key, hash_key),
+            release_name(guard_table, guard_name),
+        ])
+    except ClientError as error:
+        if condition_failed(error):
+            return False
+        raise
+    return True
+
+def replace_item(table, old_key, item, hash_key, version=None, guard_table=None, claims=None):
+    # Move an item to a new primary key with one TransactWriteItems call. The
+    # delete only applies if the old item still exists at `version` and the
+    # put is part of the same transaction, so a failure can never leave the
+    # record missing or duplicated, and the put only if no item has the new
+    # key yet, so the move never overwrites another record. When the move
+    # renames the item, `claims` is (old name, new name): the old claim is
+    # released and the new one taken in guard_table within the same
+    # transaction. The delete is the first action, so a failure of any other
+    # (see failed_actions) means the new key or name is taken.
+    delete = {
+        'TableName': table.name,
+        'Key': old_key,
+        'ExpressionAttributeNames': {'#key': hash_key, '#version': 'Version'},
+    }
+    if version is None:
+        delete['ConditionExpression'] = 'attribute_exists(#key) AND attribute_not_exists(#version)'
+    else:
+        delete['ConditionExpression'] = 'attribute_exists(#key) AND #version = :version'
+        delete['ExpressionAttributeValues'] = {':version': version}
+    actions = [{'Delete': delete}, {'Put': {
+        'TableName': table.name,
+        'Item': item,
+        'ConditionExpression': 'attribute_not_exists(#key)',
+        'ExpressionAttributeNames': {'#key': hash_key},
+    }}]
+    if claims is not None and claims[0] != claims[1]:
+        actions += [release_name(guard_table, claims[0]), claim_name(guard_table, claims[1])]
+    return table.meta.client.transact_write_items(TransactItems=actions)
+
+# TransactWriteItems accepts at most 100 actions per call
+TRANSACT_WRITE_SIZE = 100
+TRANSACT_WRITE_ATTEMPTS = int(os.getenv('DYNAMODB_TRANSACT_WRITE_ATTEMPTS', '5'))
+
+def transaction_chunks(units):
+    # Group units (lists of actions that must apply together) into chunks of
+    # at most TRANSACT_WRITE_SIZE actions. Returns lists of unit indexes.
+    chunks, chunk, size = [], [], 0
+    for i, unit in enumerate(units):
+        if chunk and size + len(unit) > TRANSACT_WRITE_SIZE:
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(i)
+        size += len(unit)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def write_transaction(table, units, conflict, max_attempts=TRANSACT_WRITE_ATTEMPTS, base_delay=0.05):
+    # Write up to TRANSACT_WRITE_SIZE actions of several units in one
+    # transaction. A transaction applies all or nothing, so units whose
+    # conditions fail are reported with `conflict` and the others written
+    # again without them; conflicts with concurrent transactions are retried
+    # with jittered exponential backoff. Returns one error per unit, None when
+    # the unit was written.
+    errors = [None] * len(units)
+    pending = list(range(len(units)))
+    attempt = 0
+    while pending:
+        try:
+            table.meta.client.transact_write_items(
+                TransactItems=[action for i in pending for action in units[i]]
+            )
+            return errors
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') != 'TransactionCanceledException':
+                if throttled(error):
+                    note_throttled()
+                for i in pending:
+                    errors[i] = error.response['Error']['Message']
+                return errors
+            reasons = iter(error.response.get('CancellationReasons', []))
+            codes = {i: [next(reasons, {}).get('Code') for _ in units[i]] for i in pending}
+        failed = [i for i in pending if 'ConditionalCheckFailed' in codes[i]]
+        if failed:
+            # Every failed condition is reported at once, so the rest can be
+            # sent again straight away
+            for i in failed:
+                errors[i] = conflict
+            pending = [i for i in pending if i not in failed]
+            continue
+        if any(code in THROTTLING_ERRORS or code == 'ThrottlingError' for i in pending for code in codes[i]):
+            note_throttled()
+        attempt += 1
+        if attempt >= max_attempts:
+            break
+        time.sleep(base_delay * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+    for i in pending:
+        errors[i] = "Transaction not applied after {} attempts".format(max_attempts)
+    return errors
+
+async def transact_write(table, units, conflict):
+    # Write any number of units in transactions of at most 100 actions, sent
+    # concurrently on the shared pool. Returns one error per unit.
+    chunks = transaction_chunks(units)
+    results = await asyncio.gather(*(
+        run(write_transaction, table, [units[i] for i in chunk], conflict) for chunk in chunks
+    ))
+    errors = [None] * len(units)
+    for chunk, chunk_errors in zip(chunks, results):
+        for i, error in zip(chunk, chunk_errors):
+            errors[i] = error
+    return errors
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_ATTEMPTS = int(os.getenv('DYNAMODB_BATCH_WRITE_ATTEMPTS', '5'))
+
+def write_batch(table, requests, max_attempts=BATCH_WRITE_ATTEMPTS, base_delay=0.05):
+    # Send up to 25 PutRequest/DeleteRequest entries, resending UnprocessedItems
+    # with jittered exponential backoff. Returns one error per request, None
+    # when the request was written. Throttling is reported per request and
+    # noted for run()'s breaker.
+    errors = [None] * len(requests)
+    pending = list(range(len(requests)))
+    for attempt in range(max_attempts):
+        try:
+            response = table.meta.client.batch_write_item(
+                RequestItems={table.name: [requests[i] for i in pending]}
+            )
+        except ClientError as error:
+            if throttled(error):
+                note_throttled()
+            for i in pending:
+                errors[i] = error.response['Error']['Message']
+            return errors
+        unprocessed = response.get('UnprocessedItems', {}).get(table.name, [])
+        pending = [i for i in pending if requests[i] in unprocessed]
+        if not pending:
+            return errors
+        if attempt + 1 < max_attempts:
+            time.sleep(base_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+    # Items stay unprocessed while their partitions are throttled
+    note_throttled()
+    for i in pending:
+        errors[i] = "Unprocessed after {} attempts".format(max_attempts)
+    return errors
+
+async def batch_write(table, requests):
+    # Split any number of write requests into BatchWriteItem-sized chunks and
+    # send the chunks concurrently on the shared pool
+    chunks = [requests[i:i + BATCH_WRITE_SIZE] for i in range(0, len(requests), BATCH_WRITE_SIZE)]
+    results = await asyncio.gather(*(run(write_batch, table, chunk) for chunk in chunks))
+    return [error for errors in results for error in errors]
+
+# BatchGetItem accepts at most 100 keys per call
+BATCH_GET_SIZE = 100
+BATCH_GET_ATTEMPTS = int(os.getenv('DYNAMODB_BATCH_GET_ATTEMPTS', '5'))
+
+def get_batch(table, keys, max_attempts=BATCH_GET_ATTEMPTS, base_delay=0.05):
+    # Fetch up to 100 distinct keys, resending UnprocessedKeys with jittered
+    # exponential backoff. Keys that are still unprocessed fail the call: an
+    # unread item must not be reported as missing.
+    items = []
+    pending = keys
+    for attempt in range(max_attempts):
+        response = table.meta.client.batch_get_item(RequestItems={table.name: {'Keys': pending}})
+        items.extend(response.get('Responses', {}).get(table.name, []))
+        pending = response.get('UnprocessedKeys', {}).get(table.name, {}).get('Keys', [])
+        if not pending:
+            return items
+        if attempt + 1 < max_attempts:
+            time.sleep(base_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+    note_throttled()
+    raise HTTPException(status_code=503, detail="Unprocessed keys after {} attempts".format(max_attempts))
+
+async def batch_get(table, keys):
+    # Fetch any number of distinct keys in BatchGetItem-sized chunks sent
+    # concurrently on the shared pool. Items come back in no particular order.
+    chunks = [keys[i:i + BATCH_GET_SIZE] for i in range(0, len(keys), BATCH_GET_SIZE)]
+    results = await asyncio.gather(*(run(get_batch, table, chunk) for chunk in chunks))
+    return [item for items in results for item in items]
+
+def json_default(value):
+    # The resource layer returns every number as Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+def dumps(value, sort_keys=False) -> bytes:
+    # Compact UTF-8 JSON of items as they come back from DynamoDB. orjson
+    # encodes the containers and strings in C and only calls json_default for
+    # Decimals and sets; it rejects integers beyond 64 bits, which json takes.
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=json_default, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(value, default=json_default, sort_keys=sort_keys, separators=(',', ':'),
+                      ensure_ascii=False).encode()
+
+class ItemsResponse(Response):
+    # JSON response encoded by dumps(). Routes returning DynamoDB items use it
+    # so FastAPI hands the body over as is instead of walking it with
+    # jsonable_encoder, which copies every item and converts each Decimal.
+    media_type = 'application/json'
+
+    def render(self, content) -> bytes:
+        with metrics.timed('serialize'):
+            return dumps(content)
+
+def to_item_value(value):
+    # DynamoDB numbers must be Decimal; floats from a JSON body are rejected
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {key: to_item_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_item_value(item) for item in value]
+    return value
+
+def from_item_value(value):
+    # Inverse of to_item_value for serializers that only take plain Python
+    # types, e.g. yaml.safe_dump
+    if isinstance(value, dict):
+        return {key: from_item_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_item_value(item) for item in value]
+    if isinstance(value, (Decimal, set, frozenset)):
+        return json_default(value)
+    return value
+
+def encode_cursor(last_evaluated_key):
+    # Opaque continuation token for a LastEvaluatedKey
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, default=json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    # Key attributes are strings or numbers; anything else cannot have come
+    # from encode_cursor
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, dict) or not all(
+        isinstance(value, (str, int)) and not isinstance(value, bool) for value in key.values()
+    ):
+        raise ValueError("Invalid cursor")
+    return key
+
+async def read_page(method, limit, start_key=None, **kwargs):
+    # One call of a scan or query from start_key. A well-formed cursor can
+    # still name attributes that are not the key of the table or index, which
+    # DynamoDB rejects with a ValidationException: that is a bad cursor (400),
+    # not a server error.
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    try:
+        return await run(method, Limit=limit, **kwargs)
+    except ClientError as error:
+        if start_key and error.response.get('Error', {}).get('Code') == 'ValidationException':
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        raise
+
+async def paginate(method, limit, start_key=None, map_item=None, **kwargs):
+    # One page of a scan or query, e.g. paginate(table.scan, 100). map_item
+    # turns each stored item into the one returned.
+    response = await read_page(method, limit, start_key, **kwargs)
+    items = response.get('Items', [])
+    return {
+        "items": [map_item(item) for item in items] if map_item else items,
+        "next_cursor": encode_cursor(response.get('LastEvaluatedKey')),
+    }
+
+async def stream_ndjson(method, page_size, response, map_item=None, **kwargs):
+    # Walk every page of a scan or query from its first `response`, yielding
+    # one JSON line per item so only a single page is held in memory at a time
+    while True:
+        with metrics.timed('serialize'):
+            lines = [dumps(map_item(item) if map_item else item) + b"\n" for item in response.get('Items', [])]
+        for line in lines:
+            yield line
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key:
+            return
+        response = await read_page(method, page_size, start_key, **kwargs)
+
+def cursor_start_key(cursor):
+    # The ExclusiveStartKey of a cursor a route was given; 400 when invalid
+    try:
+        return decode_cursor(cursor)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+async def list_response(method, limit, cursor=None, stream=False, map_item=None, **kwargs):
+    # Shared body of the list routes: one page with a continuation cursor, or
+    # every remaining page as NDJSON when stream is set. The first page is
+    # read before the stream starts, so a bad cursor still gets its 400.
+    start_key = cursor_start_key(cursor)
+    if stream:
+        first = await read_page(method, limit, start_key, **kwargs)
+        return StreamingResponse(
+            stream_ndjson(method, limit, first, map_item, **kwargs),
+            media_type="application/x-ndjson"
+        )
+    return ItemsResponse(await paginate(method, limit, start_key, map_item, **kwargs))
+
+def parallel_scan(table, total_segments, max_workers=None, **kwargs):
+    # Yield every item of a table from `total_segments` Scan segments read
+    # concurrently. Pages are handed over through a bounded queue, so memory
+    # stays at a few pages however large the table is.
+    pages = queue.Queue(maxsize=total_segments * 2)
+    stop = threading.Event()
+    done = object()
+
+    def hand_over(page):
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def scan_segment(segment):
+        args = dict(kwargs, Segment=segment, TotalSegments=total_segments)
+        try:
+            while not stop.is_set():
+                response = table.scan(**args)
+                hand_over(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as error:
+            hand_over(error)
+        hand_over(done)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers or total_segments, thread_name_prefix='scan')
+    try:
+        for segment in range(total_segments):
+            pool.submit(scan_segment, segment)
+        remaining = total_segments
+        while remaining:
+            page = pages.get()
+            if page is done:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        stop.set()
+        pool.shutdown(wait=True)
@@ -0,0 +1,49 @@
+# lambdas/src/handlers/enc.py
+import argparse
+import os
+from fastapi import FastAPI
+from mangum import Mangum
+from lambdas.src.handlers import changes, classify, environment, metrics, node, node_group
+
+# One app serving the node, node group, environment, classify and change log
+# routes. The routers share the process-wide DynamoDB client and the node
+# group and environment caches, so one warm function (or server worker)
+# answers every lookup. It runs as a single Lambda (enc.handler) or as a long-lived server:
+#
+#     python -m lambdas.src.handlers.enc --workers 4
+#     gunicorn -k uvicorn.workers.UvicornWorker -w 4 lambdas.src.handlers.enc:app
+app = FastAPI()
+
+# Health check endpoint, also used by the ALB target group
+@app.get("/healthcheck")
+async def healthcheck():
+    return {"status": "ok"}
+
+for module in (node, node_group, environment, classify, changes, metrics):
+    app.include_router(module.router)
+app.add_middleware(metrics.RequestTiming)
+
+handler = Mangum(app)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the unified ENC app under uvicorn")
+    parser.add_argument('--host', default=os.getenv('ENC_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('ENC_PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('ENC_WORKERS', '1')))
+    parser.add_argument('--ssl-keyfile', default=os.getenv('ENC_SSL_KEYFILE'))
+    parser.add_argument('--ssl-certfile', default=os.getenv('ENC_SSL_CERTFILE'))
+    args = parser.parse_args(argv)
+
+    # uvicorn is only needed in server mode, not in the Lambda package
+    import uvicorn
+    uvicorn.run(
+        "lambdas.src.handlers.enc:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        ssl_keyfile=args.ssl_keyfile,
+        ssl_certfile=args.ssl_certfile,
+    )
+
+if __name__ == '__main__':
+    main()
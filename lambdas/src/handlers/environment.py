@@ -1,54 +1,97 @@
 # lambdas/src/handlers/environment.py
-from fastapi import FastAPI, HTTPException, Path
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Path, Query
 from pydantic import BaseModel
-import boto3
+from typing import Optional
 import os
 from mangum import Mangum
 from boto3.dynamodb.conditions import Key
+from lambdas.src.handlers import changes, dynamo, etag, metrics
+from lambdas.src.handlers.cache import TTLCache
 
 app = FastAPI()
+router = APIRouter()
 
-# Use the table name from the environment variable or default to 'Environment'
-table_name = os.getenv('DYNAMODB_TABLE_NAME', 'Environment')
+# Use the table name from ENVIRONMENT_TABLE_NAME (or DYNAMODB_TABLE_NAME) or default to 'Environment'
+table_name = os.getenv('ENVIRONMENT_TABLE_NAME', os.getenv('DYNAMODB_TABLE_NAME', 'Environment'))
 
-dynamodb = boto3.resource('dynamodb')
-environment_table = dynamodb.Table(table_name)
+environment_table = dynamo.Table(table_name)
+
+# Cache environment lookups across warm invocations as etag.Representation
+# entries; write routes invalidate them
+environment_cache = TTLCache(
+    maxsize=int(os.getenv('ENVIRONMENT_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('ENVIRONMENT_CACHE_TTL', '60')),
+    stale_ttl=float(os.getenv('ENVIRONMENT_CACHE_STALE_TTL', '900')),
+)
+# Changes made through other functions reach the cache via the change log
+changes.subscribe(table_name, environment_cache, lambda keys: (keys['EnvironmentName'], keys['PuppetClusterName']))
 
 # Health check endpoint
 @app.get("/healthcheck")
 async def healthcheck():
     return {"status": "ok"}
 
+@router.get("/cache/environment")
+async def environment_cache_stats():
+    return environment_cache.stats()
+
 # Define Pydantic model for Environment
 class Environment(BaseModel):
     environment_name: str
     puppet_cluster_name: str
 
-@app.post("/environment/")
-async def create_environment(environment: Environment):
-    item = {
+def environment_item(environment: Environment):
+    return {
         'EnvironmentName': environment.environment_name,
         'PuppetClusterName': environment.puppet_cluster_name,
     }
-    environment_table.put_item(Item=item)
+
+@router.post("/environment/")
+async def create_environment(environment: Environment):
+    await dynamo.run(environment_table.put_item, Item=environment_item(environment))
+    environment_cache.invalidate((environment.environment_name, environment.puppet_cluster_name))
     return {"message": "Environment created successfully"}
 
-@app.get("/environment/{environment_name}/{puppet_cluster_name}")
-async def read_environment(environment_name: str, puppet_cluster_name: str):
+@router.get("/environment/")
+async def get_all_environments(
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of environments per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    stream: bool = Query(False, description="Stream every environment as NDJSON instead of one page"),
+):
+    return await dynamo.list_response(environment_table.scan, limit, cursor, stream)
+
+def load_environment(environment_name: str, puppet_cluster_name: str):
+    # Read an environment for dynamo.run_or_stale(), which caches it; None
+    # when it does not exist
     response = environment_table.query(
         KeyConditionExpression=Key('EnvironmentName').eq(environment_name) & Key('PuppetClusterName').eq(puppet_cluster_name)
     )
     items = response.get('Items', [])
     if not items:
-        raise HTTPException(status_code=404, detail="Environment not found")
-    return items
+        return None
+    return etag.represent(items)
+
+@router.get("/environment/{environment_name}/{puppet_cluster_name}")
+async def read_environment(environment_name: str, puppet_cluster_name: str, if_none_match: Optional[str] = Header(None)):
+    await changes.sync()
+    key = (environment_name, puppet_cluster_name)
+    representation = environment_cache.get(key)
+    if representation is None:
+        representation = await dynamo.run_or_stale(environment_cache, key, load_environment, *key)
+        if representation is None:
+            raise HTTPException(status_code=404, detail="Environment not found")
+    return etag.respond(representation, if_none_match)
 
-@app.delete("/environment/{environment_name}/{puppet_cluster_name}")
+@router.delete("/environment/{environment_name}/{puppet_cluster_name}")
 async def delete_environment(environment_name: str, puppet_cluster_name: str):
-    environment_table.delete_item(
+    await dynamo.run(environment_table.delete_item,
         Key={'EnvironmentName': environment_name, 'PuppetClusterName': puppet_cluster_name}
     )
+    environment_cache.invalidate((environment_name, puppet_cluster_name))
     return {"message": "Environment deleted successfully"}
 
+app.include_router(router)
+app.include_router(metrics.router)
+app.add_middleware(metrics.RequestTiming)
 handler = Mangum(app)
 
@@ -0,0 +1,72 @@
+# lambdas/src/handlers/etag.py
+import hashlib
+from typing import NamedTuple, Optional
+from fastapi import HTTPException, Response
+from lambdas.src.handlers import metrics
+from lambdas.src.handlers.dynamo import dumps
+
+class Representation(NamedTuple):
+    # A read result serialized once, together with its ETag.
+    # Caches keep these, so a hit needs neither a DynamoDB read nor a
+    # serialization.
+    items: list
+    body: bytes
+    etag: str
+
+def version_etag(version):
+    return '"v{}"'.format(int(version))
+
+def versions_etag(items) -> Optional[str]:
+    # The ETag of versioned records, known without serializing them; None
+    # when a record predates versioning
+    if items and all('Version' in item for item in items):
+        return '"v{}"'.format('-'.join(str(int(item['Version'])) for item in items))
+    return None
+
+def represent(items) -> Representation:
+    # Versioned records use their Version as the ETag. Older ones fall back
+    # to a content hash, with keys sorted so equal content hashes the same.
+    with metrics.timed('serialize'):
+        body = dumps(items, sort_keys=True)
+    return Representation(items, body, versions_etag(items) or '"{}"'.format(hashlib.sha256(body).hexdigest()[:32]))
+
+def etag_matches(if_none_match: Optional[str], etag: str):
+    # If-None-Match uses weak comparison and may list several tags or '*'
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == etag:
+            return True
+    return False
+
+def respond(representation: Representation, if_none_match: Optional[str]):
+    # 304 with just the ETag when the client's copy is current
+    headers = {'ETag': representation.etag}
+    if etag_matches(if_none_match, representation.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=representation.body, media_type='application/json', headers=headers)
+
+def respond_items(items, if_none_match: Optional[str]):
+    # respond() for records read just now: a current client copy of
+    # versioned records gets its 304 before the body is serialized
+    etag = versions_etag(items)
+    if etag is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    return respond(represent(items), if_none_match)
+
+def expected_version(if_match: Optional[str], item: dict):
+    # The Version a write must still find: the one the client read (If-Match)
+    # or, without If-Match, the one the route just read. A stale If-Match
+    # fails right away with 409.
+    current = item.get('Version')
+    if if_match is None or if_match.strip() == '*':
+        return current
+    tag = if_match.strip()
+    tag = tag[2:] if tag.startswith('W/') else tag
+    tag = tag.strip('"')
+    if not tag.startswith('v') or not tag[1:].isdigit():
+        raise HTTPException(status_code=400, detail="If-Match must be a version ETag such as \"v3\"")
+    if current is None or int(current) != int(tag[1:]):
+        raise HTTPException(status_code=409, detail="Version mismatch: the record has changed since it was read")
+    return current
@@ -0,0 +1,167 @@
+# lambdas/src/handlers/metrics.py
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from fastapi import APIRouter
+
+# Request instrumentation shared by every handler app.
+#
+# Counters: the DynamoDB client's event hooks (dynamo.py) count retries and
+# throttled attempts, the circuit breaker counts the calls it fails fast and
+# the read routes count stale cache entries served while DynamoDB throttles.
+# GET /metrics reports them per route for the warm function or server worker
+# that answers.
+#
+# Timings: the RequestTiming middleware times each request by stage (the
+# DynamoDB calls awaited through dynamo.run() and serialization), sums the
+# capacity DynamoDB reports as consumed, returns them in a Server-Timing
+# header and writes one CloudWatch Embedded Metric Format line per request.
+router = APIRouter()
+
+# Namespace of the EMF metrics; METRICS_EMF=false stops writing them
+namespace = os.getenv('METRICS_NAMESPACE', 'NodeClassifier')
+emf_enabled = os.getenv('METRICS_EMF', 'true').lower() == 'true'
+
+class RequestMetrics:
+    # Timings of one request. dynamo.run() copies the context onto worker
+    # threads, so concurrent calls add to the same object under its lock.
+    __slots__ = ('scope', 'start', 'stages', 'calls', 'capacity', 'counters', 'lock')
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.calls = 0
+        self.capacity = 0.0
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def route(self):
+        # Routing adds the matched route to the scope; its path template
+        # (e.g. "/nodes/{unique_name}") keeps metrics per route, not per node
+        return getattr(self.scope.get('route'), 'path', None) or 'none'
+
+    def server_timing(self):
+        # Stage durations are summed over calls, so DynamoDB calls made side
+        # by side can add up to more than the total
+        parts = []
+        for name, seconds in self.stages.items():
+            part = '{};dur={:.1f}'.format(name, seconds * 1000)
+            if name == 'dynamodb':
+                part += ';desc="{} calls {:g} capacity units"'.format(self.calls, self.capacity)
+            parts.append(part)
+        parts.append('total;dur={:.1f}'.format((time.perf_counter() - self.start) * 1000))
+        return ', '.join(parts)
+
+    def emf(self, status: int):
+        # One log line that CloudWatch turns into metrics with a Route
+        # dimension; Method and Status stay searchable properties
+        values = {'Latency': (time.perf_counter() - self.start) * 1000}
+        for name, seconds in self.stages.items():
+            values['{}Time'.format(name.capitalize())] = seconds * 1000
+        units = dict.fromkeys(values, 'Milliseconds')
+        values['DynamodbCalls'] = self.calls
+        values['ConsumedCapacity'] = self.capacity
+        values.update(self.counters)
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [['Route']],
+                    'Metrics': [{'Name': name, 'Unit': units.get(name, 'Count')} for name in values],
+                }],
+            },
+            'Route': self.route(),
+            'Method': self.scope.get('method'),
+            'Status': status,
+        }
+        record.update(values)
+        return json.dumps(record, separators=(',', ':'))
+
+# The request being served; None outside one (tools, stream handlers)
+current_request = contextvars.ContextVar('current_request', default=None)
+
+def add_time(stage: str, seconds: float):
+    request = current_request.get()
+    if request is not None:
+        with request.lock:
+            request.stages[stage] = request.stages.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage: str):
+    # Add the time spent in the block to `stage` of the current request
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(stage, time.perf_counter() - start)
+
+def add_call(capacity: float):
+    request = current_request.get()
+    if request is not None:
+        with request.lock:
+            request.calls += 1
+            request.capacity += capacity
+
+_counters = Counter()
+_lock = threading.Lock()
+
+def increment(name: str, value: int = 1):
+    request = current_request.get()
+    key = (request.route() if request is not None else 'none', name)
+    with _lock:
+        _counters[key] += value
+    if request is not None:
+        with request.lock:
+            request.counters[name] = request.counters.get(name, 0) + value
+
+def snapshot():
+    # {route: {counter: value}}
+    with _lock:
+        counters = dict(_counters)
+    routes = {}
+    for (route, name), value in sorted(counters.items()):
+        routes.setdefault(route, {})[name] = value
+    return routes
+
+def reset():
+    with _lock:
+        _counters.clear()
+
+class RequestTiming:
+    # ASGI middleware timing every HTTP request. It costs a few clock reads,
+    # one header and one log line per request, so it stays on in production.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        request = RequestMetrics(scope)
+        token = current_request.set(request)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', request.server_timing().encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            if emf_enabled:
+                print(request.emf(status))
+
+@router.get("/metrics")
+async def get_metrics():
+    return {"counters": snapshot()}
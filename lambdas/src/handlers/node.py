@@ -1,20 +1,27 @@
 # lambdas/src/handlers/node.py
-from fastapi import FastAPI, HTTPException, Path
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Path, Query, Response
 from pydantic import BaseModel
-import boto3
+from typing import List, Optional
+import asyncio
 import os
 from mangum import Mangum
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from lambdas.src.handlers import dynamo, etag, metrics
 
-# Initialize FastAPI app
+# Routes live on a router so enc.py can mount them on the unified app;
+# app wraps the router for this module's own Lambda function
 app = FastAPI()
+router = APIRouter()
 
-# Use the table name from the environment variable or default to 'Node'
-table_name = os.getenv('DYNAMODB_TABLE_NAME', 'Node')
+# Use the table name from NODE_TABLE_NAME (or DYNAMODB_TABLE_NAME) or default to 'Node'
+table_name = os.getenv('NODE_TABLE_NAME', os.getenv('DYNAMODB_TABLE_NAME', 'Node'))
 
-# Initialize DynamoDB resource
-dynamodb = boto3.resource('dynamodb')
-node_table = dynamodb.Table(table_name)
+# NameGuard holds one claim per node name, so a name cannot be created under
+# two node groups. Every write that creates, renames or deletes a node takes
+# or releases its claim in the same transaction (see dynamo.claim_name).
+node_table = dynamo.Table(table_name)
+guard_table = dynamo.Table(os.getenv('NAME_GUARD_TABLE_NAME', 'NameGuard'))
 
 # Health check endpoint
 @app.get("/healthcheck")
@@ -28,59 +35,199 @@ class Node(BaseModel):
     environment_name: str
     puppet_cluster_name: str
 
-@app.post("/nodes/")
-async def create_node(node: Node):
-    response = node_table.query(
-        KeyConditionExpression=Key('UniqueName').eq(node.unique_name)
-    )
-    if response['Items']:
-        raise HTTPException(status_code=400, detail="Node with this UniqueName already exists")
-    
-    item = {
+# Key of a node item, used when deleting nodes in bulk
+class NodeKey(BaseModel):
+    unique_name: str
+    node_group_name: str
+
+# Body of POST /nodes/lookup. Nodes given with their node group are read
+# with BatchGetItem; bare unique names need a query each.
+class NodeLookup(BaseModel):
+    nodes: List[NodeKey] = []
+    unique_names: List[str] = []
+
+# Most names a single lookup may ask for
+lookup_limit = int(os.getenv('NODE_LOOKUP_LIMIT', '5000'))
+
+def node_key(node):
+    return {"UniqueName": node.unique_name, "NodeGroupName": node.node_group_name}
+
+def node_claim(unique_name: str):
+    # Name of a node's claim in NameGuard
+    return 'node#' + unique_name
+
+def node_item(node: Node, version=None):
+    # A new record starts at dynamo.initial_version(); updates pass the next one
+    return {
         "UniqueName": node.unique_name,
         "NodeGroupName": node.node_group_name,
-        "environment_name": node.environment_name,
-        "puppet_cluster_name": node.puppet_cluster_name,
+        "EnvironmentName": node.environment_name,
+        "PuppetClusterName": node.puppet_cluster_name,
+        "Version": version if version is not None else dynamo.initial_version(),
     }
-    
-    node_table.put_item(Item=item)
+
+async def write_nodes(nodes, unit_for, status, conflict):
+    # Write each node as a unit of transaction actions together with its name
+    # claim (dynamo.transact_write) and report the outcome per node. A
+    # transaction may touch a claim only once, so repeated names fail up
+    # front; nodes whose conditions fail are reported with `conflict`.
+    results = []
+    units = []
+    seen = set()
+    for node in nodes:
+        result = {"unique_name": node.unique_name, "node_group_name": node.node_group_name}
+        if node.unique_name in seen:
+            result.update(status="failed", detail="Duplicate node in request")
+        else:
+            seen.add(node.unique_name)
+            units.append((result, unit_for(node)))
+        results.append(result)
+
+    errors = await dynamo.transact_write(node_table, [unit for _, unit in units], conflict)
+    for (result, _), error in zip(units, errors):
+        if error is None:
+            result["status"] = status
+        else:
+            result.update(status="failed", detail=error)
+
+    failed = sum(1 for result in results if result["status"] == "failed")
+    return {"succeeded": len(results) - failed, "failed": failed, "results": results}
+
+def create_unit(node):
+    return [
+        dynamo.claim_name(guard_table, node_claim(node.unique_name)),
+        dynamo.put_new(node_table, node_item(node), 'UniqueName'),
+    ]
+
+def delete_unit(node):
+    # The node is only deleted if it exists, so the claim released with it
+    # is never that of the same name under another node group
+    return [
+        dynamo.delete_existing(node_table, node_key(node), 'UniqueName'),
+        dynamo.release_name(guard_table, node_claim(node.unique_name)),
+    ]
+
+@router.post("/nodes/")
+async def create_node(node: Node):
+    # The node and the claim on its name are written in one transaction, so
+    # concurrent creates of a name cannot both succeed, whatever their group
+    created = await dynamo.run(dynamo.put_unique, node_table, node_item(node), 'UniqueName',
+                               guard_table, node_claim(node.unique_name))
+    if not created:
+        raise HTTPException(status_code=400, detail="Node with this UniqueName already exists")
     return {"message": "Node created successfully"}
 
-@app.get("/nodes/{unique_name}")
-async def read_node(unique_name: str = Path(..., description="The unique name of the node to retrieve")):
-    response = node_table.query(
+@router.post("/nodes/batch")
+async def create_nodes(nodes: List[Node]):
+    return await write_nodes(nodes, create_unit, "created", "Node with this UniqueName already exists")
+
+@router.delete("/nodes/batch")
+async def delete_nodes(nodes: List[NodeKey]):
+    return await write_nodes(nodes, delete_unit, "deleted", "Node not found")
+
+@router.post("/nodes/lookup")
+async def lookup_nodes(lookup: NodeLookup):
+    # Read many nodes in one request. Every requested unique name is in the
+    # result, with its items or null when there is no such node.
+    if len(lookup.nodes) + len(lookup.unique_names) > lookup_limit:
+        raise HTTPException(status_code=400, detail="At most {} nodes per lookup".format(lookup_limit))
+
+    # BatchGetItem rejects a request that names the same key twice
+    keys = list({(node.unique_name, node.node_group_name): node_key(node) for node in lookup.nodes}.values())
+    unique_names = list(dict.fromkeys(lookup.unique_names))
+
+    async def query(unique_name):
+        response = await dynamo.run(node_table.query,
+            KeyConditionExpression=Key('UniqueName').eq(unique_name)
+        )
+        return response.get('Items', [])
+
+    fetched, queried = await asyncio.gather(
+        dynamo.batch_get(node_table, keys),
+        asyncio.gather(*(query(unique_name) for unique_name in unique_names)),
+    )
+
+    nodes = {key['UniqueName']: None for key in keys}
+    nodes.update((unique_name, None) for unique_name in unique_names)
+    for item in fetched + [item for items in queried for item in items]:
+        found = nodes.get(item['UniqueName']) or []
+        if item not in found:
+            found.append(item)
+        nodes[item['UniqueName']] = found
+    not_found = [unique_name for unique_name, items in nodes.items() if items is None]
+    return dynamo.ItemsResponse({"nodes": nodes, "found": len(nodes) - len(not_found), "not_found": not_found})
+
+@router.get("/nodes/{unique_name}")
+async def read_node(
+    unique_name: str = Path(..., description="The unique name of the node to retrieve"),
+    if_none_match: Optional[str] = Header(None),
+):
+    response = await dynamo.run(node_table.query,
         KeyConditionExpression=Key('UniqueName').eq(unique_name)
     )
     items = response.get('Items', [])
     if not items:
         raise HTTPException(status_code=404, detail="Node not found")
-    return items
+    return etag.respond_items(items, if_none_match)
 
-@app.put("/nodes/{unique_name}")
-async def update_node(unique_name: str, node: Node):
-    response = node_table.query(
+@router.put("/nodes/{unique_name}")
+async def update_node(
+    unique_name: str,
+    node: Node,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+):
+    result = await dynamo.run(node_table.query,
         KeyConditionExpression=Key('UniqueName').eq(unique_name)
     )
-    items = response.get('Items', [])
+    items = result.get('Items', [])
     if not items:
         raise HTTPException(status_code=404, detail="Node not found")
     
     existing_item = items[0]
-    node_table.delete_item(Key={
+    old_key = {
         'UniqueName': existing_item['UniqueName'],
         'NodeGroupName': existing_item['NodeGroupName']
-    })
-    node_table.put_item(Item={
-        "UniqueName": node.unique_name,
-        "NodeGroupName": node.node_group_name,
-        "environment_name": node.environment_name,
-        "puppet_cluster_name": node.puppet_cluster_name,
-    })
+    }
+    # Every write is conditioned on the Version read above (or sent as
+    # If-Match), so of two concurrent updates the later one gets a 409
+    # instead of silently overwriting the first
+    version = etag.expected_version(if_match, existing_item)
+    new_version = dynamo.next_version(version)
+    try:
+        if node_key(node) == old_key:
+            # Only non-key attributes change, so update the item in place
+            await dynamo.run(node_table.update_item,
+                Key=old_key,
+                # Also drops the lowercase attributes written by older versions
+                UpdateExpression="SET EnvironmentName = :environment_name, PuppetClusterName = :puppet_cluster_name, "
+                                 "Version = :version "
+                                 "REMOVE environment_name, puppet_cluster_name",
+                ExpressionAttributeValues={
+                    ':environment_name': node.environment_name,
+                    ':puppet_cluster_name': node.puppet_cluster_name,
+                    ':version': new_version
+                },
+                ConditionExpression=Attr('UniqueName').exists() & dynamo.version_is(version)
+            )
+        else:
+            # A new name is claimed and the old one released with the move
+            await dynamo.run(dynamo.replace_item, node_table, old_key, node_item(node, new_version),
+                             'UniqueName', version, guard_table,
+                             (node_claim(existing_item['UniqueName']), node_claim(node.unique_name)))
+    except ClientError as error:
+        if any(i > 0 for i in dynamo.failed_actions(error)):
+            # Anything but the delete failed: the new name is taken
+            raise HTTPException(status_code=400, detail="Node with this UniqueName already exists")
+        if dynamo.condition_failed(error):
+            raise HTTPException(status_code=409, detail="Node was modified or deleted by another request")
+        raise
+    response.headers['ETag'] = etag.version_etag(new_version)
     return {"message": "Node updated successfully"}
 
-@app.delete("/nodes/{unique_name}")
+@router.delete("/nodes/{unique_name}")
 async def delete_node(unique_name: str):
-    response = node_table.query(
+    response = await dynamo.run(node_table.query,
         KeyConditionExpression=Key('UniqueName').eq(unique_name)
     )
     items = response.get('Items', [])
@@ -88,51 +235,64 @@ async def delete_node(unique_name: str):
         raise HTTPException(status_code=404, detail="Node not found")
     
     item = items[0]
-    node_table.delete_item(
-        Key={'UniqueName': item['UniqueName'], 'NodeGroupName': item['NodeGroupName']}
+    deleted = await dynamo.run(dynamo.delete_unique, node_table,
+        {'UniqueName': item['UniqueName'], 'NodeGroupName': item['NodeGroupName']},
+        'UniqueName', guard_table, node_claim(item['UniqueName'])
     )
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Node not found")
     return {"message": "Node deleted successfully"}
 
-# @app.get("/nodes/")
-# async def get_all_nodes():
-#     response = node_table.scan()
-#     items = response.get('Items', [])
-#     return items
-
-# @app.get("/nodes/puppet_cluster/{puppet_cluster_name}")
-# async def get_nodes_by_puppet_cluster(puppet_cluster_name: str):
-#     response = node_table.query(
-#         IndexName="PuppetClusterIndex",  # Assuming there is a secondary index for PuppetClusterName
-#         KeyConditionExpression=Key('PuppetClusterName').eq(puppet_cluster_name)
-#     )
-#     items = response.get('Items', [])
-#     if not items:
-#         raise HTTPException(status_code=404, detail="No nodes found for this Puppet Cluster")
-#     return items
-
-# @app.get("/nodes/hostgroup/{node_group_name}")
-# async def get_nodes_by_hostgroup(node_group_name: str):
-#     response = node_table.query(
-#         IndexName="NodeGroupNameIndex",  # Assuming there is a secondary index for NodeGroupName
-#         KeyConditionExpression=Key('NodeGroupName').eq(node_group_name)
-#     )
-#     items = response.get('Items', [])
-#     if not items:
-#         raise HTTPException(status_code=404, detail="No nodes found for this Hostgroup")
-#     return items
-
-# @app.get("/nodes/environment/{environment_name}")
-# async def get_nodes_by_environment(environment_name: str):
-#     response = node_table.query(
-#         IndexName="EnvironmentIndex",  # Assuming there is a secondary index for EnvironmentName
-#         KeyConditionExpression=Key('EnvironmentName').eq(environment_name)
-#     )
-#     items = response.get('Items', [])
-#     if not items:
-#         raise HTTPException(status_code=404, detail="No nodes found for this Environment")
-#     return items
+@router.get("/nodes/")
+async def get_all_nodes(
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of nodes per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    stream: bool = Query(False, description="Stream every node as NDJSON instead of one page"),
+):
+    return await dynamo.list_response(node_table.scan, limit, cursor, stream)
+
+# The routes below query the fleet-wide global secondary indexes declared in
+# dynamodb.tf; each index is sorted by UniqueName
+@router.get("/nodes/puppet_cluster/{puppet_cluster_name}")
+async def get_nodes_by_puppet_cluster(
+    puppet_cluster_name: str,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of nodes per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    stream: bool = Query(False, description="Stream every node as NDJSON instead of one page"),
+):
+    return await dynamo.list_response(node_table.query, limit, cursor, stream,
+        IndexName="PuppetClusterNameIndex",
+        KeyConditionExpression=Key('PuppetClusterName').eq(puppet_cluster_name)
+    )
+
+@router.get("/nodes/hostgroup/{node_group_name}")
+async def get_nodes_by_hostgroup(
+    node_group_name: str,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of nodes per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    stream: bool = Query(False, description="Stream every node as NDJSON instead of one page"),
+):
+    return await dynamo.list_response(node_table.query, limit, cursor, stream,
+        IndexName="NodeGroupNameIndex",
+        KeyConditionExpression=Key('NodeGroupName').eq(node_group_name)
+    )
+
+@router.get("/nodes/environment/{environment_name}")
+async def get_nodes_by_environment(
+    environment_name: str,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of nodes per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    stream: bool = Query(False, description="Stream every node as NDJSON instead of one page"),
+):
+    return await dynamo.list_response(node_table.query, limit, cursor, stream,
+        IndexName="EnvironmentNameIndex",
+        KeyConditionExpression=Key('EnvironmentName').eq(environment_name)
+    )
 
 
 #  Mangum handler to run FastAPI app on AWS Lambda
+app.include_router(router)
+app.include_router(metrics.router)
+app.add_middleware(metrics.RequestTiming)
 handler = Mangum(app)
 
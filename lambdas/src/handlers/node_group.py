@@ -1,93 +1,457 @@
 # lambdas/src/handlers/node_group.py
-from fastapi import FastAPI, HTTPException, Path
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Path, Query, Response
 from pydantic import BaseModel
-import boto3
+from typing import List, Optional
+import asyncio
 import json
 import os
+import zlib
 from mangum import Mangum
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+from lambdas.src.handlers import changes, dynamo, etag, metrics
+from lambdas.src.handlers.cache import TTLCache
+from lambdas.src.handlers.node import node_claim
 
 # Initialize FastAPI app
 app = FastAPI()
+router = APIRouter()
 
-# Use the table name from the environment variable or default to 'NodeGroup'
-table_name = os.getenv('DYNAMODB_TABLE_NAME', 'NodeGroup')
+# Use the table name from NODE_GROUP_TABLE_NAME (or DYNAMODB_TABLE_NAME) or default to 'NodeGroup'
+table_name = os.getenv('NODE_GROUP_TABLE_NAME', os.getenv('DYNAMODB_TABLE_NAME', 'NodeGroup'))
 
-# Initialize DynamoDB resource
-dynamodb = boto3.resource('dynamodb')
-node_group_table = dynamodb.Table(table_name)
+node_group_table = dynamo.Table(table_name)
+node_table = dynamo.Table(os.getenv('NODE_TABLE_NAME', 'Node'))
+# One claim per node group name, taken and released together with the
+# group; cascade deletes also release the claims of the member nodes
+guard_table = dynamo.Table(os.getenv('NAME_GUARD_TABLE_NAME', 'NameGuard'))
+
+# Membership of a node group is read from the Node table's
+# NodeGroupNameIndex (NodeGroupName, UniqueName), which DynamoDB keeps current
+# on every node write, so listing, moving or deleting the members of a group
+# queries just that group's partition instead of scanning every node.
+# Members are rewritten this many at a time.
+member_page_size = int(os.getenv('NODE_GROUP_MEMBER_PAGE_SIZE', '100'))
+
+# Cache node group lookups across warm invocations as etag.Representation
+# entries; write routes invalidate them
+node_group_cache = TTLCache(
+    maxsize=int(os.getenv('NODE_GROUP_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('NODE_GROUP_CACHE_TTL', '60')),
+    stale_ttl=float(os.getenv('NODE_GROUP_CACHE_STALE_TTL', '900')),
+)
+# Changes made through other functions reach the cache via the change log
+changes.subscribe(table_name, node_group_cache, lambda keys: keys['Name'])
+
+# Parameters are stored under ParameterSet. Rows written before maps were
+# used hold a JSON string in Parameters instead, the sort key of the
+# ParametersIndex LSI; an LSI cannot be dropped without replacing the table,
+# so it stays and stops indexing a row once its Parameters is removed.
+# Parameter sets whose JSON is larger than this many bytes are stored
+# zlib-compressed in a Binary attribute; 0 turns compression off
+compress_threshold = int(os.getenv('NODE_GROUP_COMPRESS_THRESHOLD', '4096'))
 
 # Define Pydantic model for NodeGroup
 class NodeGroup(BaseModel):
     name: str
     class_: str  # 'class' is a reserved keyword in Python, using 'class_' instead
     parameters: dict
-    
+
+# Body of POST /nodegroup/{name}/reassign
+class Reassign(BaseModel):
+    target: str
+
+# Body of PATCH /nodegroup/{name}/parameters
+class ParametersPatch(BaseModel):
+    set: dict = {}
+    remove: List[str] = []
+
+def encode_parameters(parameters: dict):
+    # The value stored in ParameterSet: a map, or compressed JSON for large sets
+    if compress_threshold:
+        raw = dynamo.dumps(parameters)
+        if len(raw) > compress_threshold:
+            return Binary(zlib.compress(raw))
+    return dynamo.to_item_value(parameters)
+
+def stored_parameters(item: dict):
+    # The stored value of an item's parameters, wherever it is kept
+    return item['ParameterSet'] if 'ParameterSet' in item else item.get('Parameters')
+
+def decode_parameters(item: dict):
+    # The item with its parameters as a plain map under Parameters, however
+    # they are stored: as a map, as compressed JSON (Binary) for large sets,
+    # or as a JSON string on rows written before maps were used
+    parameters = stored_parameters(item)
+    if isinstance(parameters, Binary):
+        parameters = json.loads(zlib.decompress(parameters.value))
+    elif isinstance(parameters, str):
+        parameters = json.loads(parameters)
+    elif 'ParameterSet' not in item:
+        return item
+    decoded = {key: value for key, value in item.items() if key != 'ParameterSet'}
+    decoded['Parameters'] = parameters
+    return decoded
+
+def node_group_claim(name: str):
+    # Name of a node group's claim in NameGuard
+    return 'nodegroup#' + name
+
+def node_group_item(node_group: NodeGroup):
+    # A new record, starting at dynamo.initial_version()
+    return {
+        "Name": node_group.name,
+        "Class": node_group.class_,
+        "ParameterSet": encode_parameters(node_group.parameters),
+        "Version": dynamo.initial_version(),
+    }
+
+def patch_expression(patch: ParametersPatch, version: dict):
+    # update_item arguments that set or remove single keys of a map and set
+    # Version through `version`, a {'Version': expression} assignment plus its
+    # values. Parameter names go through placeholders, as they may be
+    # reserved words.
+    names = {'#parameters': 'ParameterSet'}
+    values = dict(version['values'])
+    assignments = ['Version = ' + version['expression']]
+    for i, (key, value) in enumerate(patch.set.items()):
+        names['#s{}'.format(i)] = key
+        values[':s{}'.format(i)] = dynamo.to_item_value(value)
+        assignments.append('#parameters.#s{0} = :s{0}'.format(i))
+    clauses = ['SET ' + ', '.join(assignments)]
+    if patch.remove:
+        paths = []
+        for i, key in enumerate(patch.remove):
+            names['#r{}'.format(i)] = key
+            paths.append('#parameters.#r{}'.format(i))
+        clauses.append('REMOVE ' + ', '.join(paths))
+    return {
+        'UpdateExpression': ' '.join(clauses),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+    }
+
+def membership(node_group_name: str):
+    # Query arguments selecting the member nodes of a group
+    return {'IndexName': 'NodeGroupNameIndex', 'KeyConditionExpression': Key('NodeGroupName').eq(node_group_name)}
+
+async def count_members(node_group_name: str):
+    # Select=COUNT returns no items, but still reads every index entry of the
+    # group, one 1 MB page per call
+    args = dict(membership(node_group_name), Select='COUNT')
+    count = 0
+    while True:
+        response = await dynamo.run(node_table.query, **args)
+        count += response.get('Count', 0)
+        if 'LastEvaluatedKey' not in response:
+            return count
+        args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+async def member_pages(node_group_name: str):
+    # Yield the member nodes of a group a page at a time. They are read in
+    # index key order, so moving or deleting the members of one page does
+    # not make the next query skip any.
+    args = dict(membership(node_group_name), Limit=member_page_size)
+    while True:
+        response = await dynamo.run(node_table.query, **args)
+        yield response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+async def move_member(node: dict, target: str):
+    # Move a node to the target group with dynamo.replace_item. The index is
+    # read eventually consistent, so the old item is only deleted if it still
+    # has the Version read, in the same transaction as the put of the moved
+    # copy: a node updated since is reported, not overwritten. Returns the
+    # error, None when the node was moved.
+    old_key = {'UniqueName': node['UniqueName'], 'NodeGroupName': node['NodeGroupName']}
+    version = node.get('Version')
+    moved = dict(node, NodeGroupName=target, Version=dynamo.next_version(version))
+    try:
+        await dynamo.run(dynamo.replace_item, node_table, old_key, moved, 'UniqueName', version)
+    except ClientError as error:
+        if dynamo.condition_failed(error):
+            return "Node was modified or deleted by another request"
+        return error.response['Error']['Message']
+    return None
+
+async def delete_members(node_group_name: str):
+    # Delete every member node together with its name claim, in transactions
+    # of up to 50 nodes. A member deleted or moved away meanwhile is no
+    # longer in the group and not a failure. Returns (nodes deleted,
+    # failures).
+    deleted, failures = 0, []
+    gone = "Node is no longer a member"
+    async for nodes in member_pages(node_group_name):
+        errors = await dynamo.transact_write(node_table, [[
+            dynamo.delete_existing(node_table, {'UniqueName': node['UniqueName'], 'NodeGroupName': node['NodeGroupName']},
+                                   'UniqueName'),
+            dynamo.release_name(guard_table, node_claim(node['UniqueName'])),
+        ] for node in nodes], gone)
+        for node, error in zip(nodes, errors):
+            if error is None:
+                deleted += 1
+            elif error != gone:
+                failures.append({"unique_name": node['UniqueName'], "detail": error})
+    return deleted, failures
+
 # Health check endpoint
 @app.get("/healthcheck")
 async def healthcheck():
     return {"status": "ok"}
 
-@app.post("/nodegroup/")
+@router.get("/cache/nodegroup")
+async def node_group_cache_stats():
+    return node_group_cache.stats()
+
+@router.post("/nodegroup/")
 async def create_node_group(node_group: NodeGroup):
-    response = node_group_table.query(
-        KeyConditionExpression=Key('Name').eq(node_group.name)
-    )
-    if response['Items']:
+    # The group and the claim on its name are written in one transaction, so
+    # concurrent creates of a name cannot both succeed, whatever their class
+    created = await dynamo.run(dynamo.put_unique, node_group_table, node_group_item(node_group), 'Name',
+                               guard_table, node_group_claim(node_group.name))
+    if not created:
         raise HTTPException(status_code=400, detail="Node group with this name already exists")
-    
-    node_group_table.put_item(Item={
-        "Name": node_group.name,
-        "Class": node_group.class_,
-        "Parameters": json.dumps(node_group.parameters)
-    })
+    node_group_cache.invalidate(node_group.name)
     return {"message": "Node Group created successfully"}
 
-@app.get("/nodegroup/{node_group_name}")
-async def read_node_group(node_group_name: str = Path(..., description="The name of the node group to retrieve")):
-    response = node_group_table.query(
-        KeyConditionExpression=Key('Name').eq(node_group_name)
-    )
-    items = response.get('Items', [])
+@router.get("/nodegroup/")
+async def get_all_node_groups(
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of node groups per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    stream: bool = Query(False, description="Stream every node group as NDJSON instead of one page"),
+):
+    # Parameters are returned decoded, as GET /nodegroup/{name} returns them
+    return await dynamo.list_response(node_group_table.scan, limit, cursor, stream, decode_parameters)
+
+def load_node_group(node_group_name: str):
+    # Read a node group for dynamo.run_or_stale(), which caches it; None when
+    # it does not exist
+    response = node_group_table.query(KeyConditionExpression=Key('Name').eq(node_group_name))
+    items = [decode_parameters(item) for item in response.get('Items', [])]
     if not items:
-        raise HTTPException(status_code=404, detail="Node group not found")
-    return items
+        return None
+    return etag.represent(items)
+
+@router.get("/nodegroup/{node_group_name}")
+async def read_node_group(
+    node_group_name: str = Path(..., description="The name of the node group to retrieve"),
+    if_none_match: Optional[str] = Header(None),
+):
+    # A cache hit answers If-None-Match without touching DynamoDB
+    await changes.sync()
+    representation = node_group_cache.get(node_group_name)
+    if representation is None:
+        representation = await dynamo.run_or_stale(node_group_cache, node_group_name, load_node_group, node_group_name)
+        if representation is None:
+            raise HTTPException(status_code=404, detail="Node group not found")
+    return etag.respond(representation, if_none_match)
+
+@router.get("/nodegroup/{node_group_name}/nodes")
+async def get_node_group_members(
+    node_group_name: str,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of nodes per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    stream: bool = Query(False, description="Stream every member node as NDJSON instead of one page"),
+    count: bool = Query(False, description="Add the number of member nodes to the page"),
+):
+    # Like /nodes/hostgroup/{name}, a group without members, or without an
+    # item of its own, has an empty page
+    if stream or not count:
+        return await dynamo.list_response(node_table.query, limit, cursor, stream, **membership(node_group_name))
+    start_key = dynamo.cursor_start_key(cursor)
+    page, members = await asyncio.gather(
+        dynamo.paginate(node_table.query, limit, start_key, **membership(node_group_name)),
+        count_members(node_group_name),
+    )
+    page["count"] = members
+    return dynamo.ItemsResponse(page)
 
-@app.put("/nodegroup/{node_group_name}")
-async def update_node_group(node_group_name: str, node_group: NodeGroup):
-    response = node_group_table.query(
+@router.post("/nodegroup/{node_group_name}/reassign")
+async def reassign_node_group_members(node_group_name: str, reassign: Reassign):
+    # Move every member node to another group, the nodes of a page side by
+    # side on the DynamoDB pool. Each moved node gets a new Version. Nodes
+    # that fail, including ones changed by another request meanwhile, stay
+    # where they were and are listed, so the request can be repeated to
+    # finish the move.
+    if reassign.target == node_group_name:
+        raise HTTPException(status_code=400, detail="Target must be another node group")
+    result = await dynamo.run(node_group_table.query, KeyConditionExpression=Key('Name').eq(reassign.target))
+    if not result.get('Items'):
+        raise HTTPException(status_code=404, detail="Target node group not found")
+
+    moved, failures = 0, []
+    async for nodes in member_pages(node_group_name):
+        errors = await asyncio.gather(*(move_member(node, reassign.target) for node in nodes))
+        for node, error in zip(nodes, errors):
+            if error is None:
+                moved += 1
+            else:
+                failures.append({"unique_name": node['UniqueName'], "detail": error})
+    return {"moved": moved, "failed": len(failures), "failures": failures}
+
+@router.put("/nodegroup/{node_group_name}")
+async def update_node_group(
+    node_group_name: str,
+    node_group: NodeGroup,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+):
+    result = await dynamo.run(node_group_table.query,
         KeyConditionExpression=Key('Name').eq(node_group_name)
     )
-    items = response.get('Items', [])
+    items = result.get('Items', [])
     if not items:
         raise HTTPException(status_code=404, detail="Node group not found")
     
     existing_item = items[0]
-    node_group_table.delete_item(Key={
-        'Name': existing_item['Name'],
-        'Class': existing_item['Class']
-    })
-    node_group_table.put_item(Item={
-        "Name": node_group_name,
-        "Class": node_group.class_,
-        "Parameters": json.dumps(node_group.parameters)
-    })
+    old_key = {'Name': existing_item['Name'], 'Class': existing_item['Class']}
+    # Writes only apply to the Version that was read (or sent as If-Match)
+    version = etag.expected_version(if_match, existing_item)
+    new_version = dynamo.next_version(version)
+    try:
+        if node_group.class_ == existing_item['Class']:
+            # Only the parameters change, so update the item in place; a
+            # legacy string leaves Parameters and with it ParametersIndex
+            await dynamo.run(node_group_table.update_item,
+                Key=old_key,
+                UpdateExpression="SET #parameters = :parameters, Version = :version REMOVE #legacy",
+                ExpressionAttributeNames={'#parameters': 'ParameterSet', '#legacy': 'Parameters'},
+                ExpressionAttributeValues={
+                    ':parameters': encode_parameters(node_group.parameters),
+                    ':version': new_version
+                },
+                ConditionExpression=Attr('Name').exists() & dynamo.version_is(version)
+            )
+        else:
+            await dynamo.run(dynamo.replace_item, node_group_table, old_key, {
+                "Name": node_group_name,
+                "Class": node_group.class_,
+                "ParameterSet": encode_parameters(node_group.parameters),
+                "Version": new_version
+            }, 'Name', version)
+    except ClientError as error:
+        if any(i > 0 for i in dynamo.failed_actions(error)):
+            raise HTTPException(status_code=400, detail="Node group with this name and class already exists")
+        if dynamo.condition_failed(error):
+            raise HTTPException(status_code=409, detail="Node group was modified or deleted by another request")
+        raise
+    node_group_cache.invalidate(node_group_name)
+    response.headers['ETag'] = etag.version_etag(new_version)
     return {"message": "Node Group updated successfully"}
 
-@app.delete("/nodegroup/{node_group_name}")
-async def delete_node_group(node_group_name: str):
-    response = node_group_table.query(
+@router.patch("/nodegroup/{node_group_name}/parameters")
+async def patch_node_group_parameters(
+    node_group_name: str,
+    patch: ParametersPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+):
+    # Set or remove individual parameters in place instead of rewriting the map
+    if not patch.set and not patch.remove:
+        raise HTTPException(status_code=400, detail="Nothing to set or remove")
+    if set(patch.set) & set(patch.remove):
+        raise HTTPException(status_code=400, detail="A parameter cannot be both set and removed")
+
+    result = await dynamo.run(node_group_table.query,
         KeyConditionExpression=Key('Name').eq(node_group_name)
     )
-    items = response.get('Items', [])
+    items = result.get('Items', [])
     if not items:
         raise HTTPException(status_code=404, detail="Node group not found")
-    
     item = items[0]
-    node_group_table.delete_item(
-        Key={'Name': item['Name'], 'Class': item['Class']}
+    if isinstance(stored_parameters(item), str):
+        raise HTTPException(status_code=409, detail="Node group parameters are stored as a JSON string; "
+                                                    "run tools.migrate_node_group_parameters first")
+
+    version = etag.expected_version(if_match, item)
+    new_version = dynamo.next_version(version)
+    stored = stored_parameters(item)
+    if isinstance(stored, Binary):
+        # Compressed parameters have no paths to update, so the set is
+        # rewritten whole, on condition nobody else wrote the item meanwhile
+        parameters = decode_parameters(item)['Parameters']
+        for key in patch.remove:
+            parameters.pop(key, None)
+        parameters.update(patch.set)
+        update = {
+            'UpdateExpression': "SET #parameters = :parameters, Version = :version",
+            'ExpressionAttributeNames': {'#parameters': 'ParameterSet'},
+            'ExpressionAttributeValues': {':parameters': encode_parameters(parameters), ':version': new_version},
+            'ConditionExpression': Attr('ParameterSet').eq(stored) & dynamo.version_is(version),
+        }
+        conflict = HTTPException(status_code=409, detail="Node group parameters changed during the update, retry")
+    elif if_match is not None:
+        update = patch_expression(patch, {'expression': ':version', 'values': {':version': new_version}})
+        update['ConditionExpression'] = Attr('ParameterSet').attribute_type('M') & dynamo.version_is(version)
+        conflict = HTTPException(status_code=409, detail="Node group was modified or deleted by another request")
+    else:
+        # Without If-Match, patches of different keys may apply concurrently;
+        # each one still moves the record to a Version of its own
+        update = patch_expression(patch, {
+            'expression': 'if_not_exists(Version, :first) + :one',
+            'values': {':first': dynamo.initial_version(), ':one': 1},
+        })
+        update['ConditionExpression'] = Attr('ParameterSet').attribute_type('M')
+        conflict = HTTPException(status_code=404, detail="Node group not found")
+
+    try:
+        result = await dynamo.run(node_group_table.update_item,
+            Key={'Name': item['Name'], 'Class': item['Class']},
+            ReturnValues='ALL_NEW',
+            **update
+        )
+    except ClientError as error:
+        if dynamo.condition_failed(error):
+            raise conflict
+        raise
+    node_group_cache.invalidate(node_group_name)
+    attributes = decode_parameters(result['Attributes'])
+    response.headers['ETag'] = etag.version_etag(attributes['Version'])
+    return {
+        "message": "Node Group parameters updated successfully",
+        "parameters": attributes['Parameters'],
+    }
+
+@router.delete("/nodegroup/{node_group_name}")
+async def delete_node_group(
+    node_group_name: str,
+    cascade: bool = Query(False, description="Also delete every member node"),
+):
+    # A group with member nodes is only deleted with cascade; otherwise its
+    # members would be left classifying against a missing group
+    response = await dynamo.run(node_group_table.query,
+        KeyConditionExpression=Key('Name').eq(node_group_name)
     )
-    return {"message": "Node group deleted successfully"}
+    items = response.get('Items', [])
+    if not items:
+        raise HTTPException(status_code=404, detail="Node group not found")
+
+    result = {"message": "Node group deleted successfully"}
+    if cascade:
+        nodes_deleted, failures = await delete_members(node_group_name)
+        if failures:
+            raise HTTPException(status_code=500, detail="Could not delete {} member nodes, the node group was "
+                                                        "kept: {}".format(len(failures), failures[0]["detail"]))
+        result["nodes_deleted"] = nodes_deleted
+    else:
+        members = await dynamo.run(node_table.query, Select='COUNT', Limit=1, **membership(node_group_name))
+        if members.get('Count', 0):
+            raise HTTPException(status_code=409, detail="Node group still has member nodes; reassign them or "
+                                                        "delete with cascade=true")
+
+    item = items[0]
+    deleted = await dynamo.run(dynamo.delete_unique, node_group_table, {'Name': item['Name'], 'Class': item['Class']},
+                               'Name', guard_table, node_group_claim(item['Name']))
+    node_group_cache.invalidate(node_group_name)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Node group not found")
+    return result
 
+app.include_router(router)
+app.include_router(metrics.router)
+app.add_middleware(metrics.RequestTiming)
 handler = Mangum(app)
 
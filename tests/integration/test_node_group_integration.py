@@ -1,8 +1,12 @@
 import boto3
 import pytest
 import json
+import time
+from decimal import Decimal
 from fastapi.testclient import TestClient
-from lambdas.src.handlers.node_group import app
+from moto import mock_aws
+from unittest.mock import patch
+from lambdas.src.handlers.node_group import app, node_group_cache
 import os
 
 client = TestClient(app)
@@ -112,7 +116,7 @@ def test_update_node_group(dynamodb, prepare_data):
     })
     assert 'Item' in result, "Expected item to be present in DynamoDB"
     assert result['Item']['Class'] == 'roles::apache_server'
-    assert result['Item']['Parameters'] == json.dumps({"bt_product": "cea", "bt_tier": "pr"})
+    assert result['Item']['ParameterSet'] == {"bt_product": "cea", "bt_tier": "pr"}
 
 def test_delete_node_group(dynamodb, prepare_data):
     # Arrange:
@@ -135,3 +139,191 @@ def test_delete_node_group(dynamodb, prepare_data):
         'Class': 'roles::base_server'
     })
     assert 'Item' not in result  # Ensure the item was deleted
+
+@pytest.fixture(scope="function")
+def moto_node_group_table():
+    # In-memory moto table swapped in for the handler's node_group_table
+    node_group_cache.clear()
+    with mock_aws():
+        table = boto3.resource('dynamodb', region_name='us-east-1').create_table(
+            TableName='NodeGroup',
+            KeySchema=[
+                {'AttributeName': 'Name', 'KeyType': 'HASH'},
+                {'AttributeName': 'Class', 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'Name', 'AttributeType': 'S'},
+                {'AttributeName': 'Class', 'AttributeType': 'S'},
+                {'AttributeName': 'Parameters', 'AttributeType': 'S'}
+            ],
+            # As in dynamodb.tf; only legacy rows have Parameters
+            LocalSecondaryIndexes=[{
+                'IndexName': 'ParametersIndex',
+                'KeySchema': [{'AttributeName': 'Name', 'KeyType': 'HASH'},
+                              {'AttributeName': 'Parameters', 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['Name']}
+            }],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        guards = boto3.resource('dynamodb', region_name='us-east-1').create_table(
+            TableName='NameGuard',
+            KeySchema=[{'AttributeName': 'Name', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'Name', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        with patch('lambdas.src.handlers.node_group.node_group_table', table), \
+                patch('lambdas.src.handlers.node_group.guard_table', guards):
+            yield table
+
+def test_create_node_group_conditional_put(moto_node_group_table):
+    node_group_data = {
+        "name": "BT Base Server",
+        "class_": "roles::base_server",
+        "parameters": {"bt_product": "cea"}
+    }
+
+    first = client.post("/nodegroup/", json=node_group_data)
+    second = client.post("/nodegroup/", json=dict(node_group_data, parameters={"bt_product": "other"}))
+
+    assert first.status_code == 200, f"Expected status code 200, got {first.status_code}"
+    assert second.status_code == 400, f"Expected status code 400, got {second.status_code}"
+    assert second.json()['detail'] == 'Node group with this name already exists'
+
+    result = moto_node_group_table.get_item(Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'})
+    assert result['Item']['ParameterSet'] == {"bt_product": "cea"}
+
+def test_create_node_group_name_is_unique_across_classes(moto_node_group_table):
+    node_group_data = {"name": "BT Base Server", "class_": "roles::base_server", "parameters": {}}
+
+    first = client.post("/nodegroup/", json=node_group_data)
+    second = client.post("/nodegroup/", json=dict(node_group_data, class_="roles::apache_server"))
+
+    assert first.status_code == 200, f"Expected status code 200, got {first.status_code}"
+    assert second.status_code == 400, f"Expected a second class for the name to be refused, got {second.status_code}"
+    items = moto_node_group_table.scan()['Items']
+    assert [item['Class'] for item in items] == ['roles::base_server'], f"Expected one item for the group, got {items}"
+
+def test_patch_node_group_parameters(moto_node_group_table):
+    moto_node_group_table.put_item(Item={
+        'Name': 'BT Base Server',
+        'Class': 'roles::base_server',
+        'ParameterSet': {'bt_product': 'cea', 'bt_tier': 'nonprod', 'bt_role': 'base'}
+    })
+
+    response = client.patch("/nodegroup/BT%20Base%20Server/parameters", json={
+        'set': {'bt_tier': 'prod', 'bt_workers': 4},
+        'remove': ['bt_role']
+    })
+
+    assert response.status_code == 200, f"Expected status code 200, got {response.status_code}"
+    result = moto_node_group_table.get_item(Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'})
+    assert result['Item']['ParameterSet'] == {'bt_product': 'cea', 'bt_tier': 'prod', 'bt_workers': 4}, \
+        f"Unexpected parameters {result['Item']['ParameterSet']}"
+
+def test_migrate_string_parameters(moto_node_group_table):
+    from tools.migrate_node_group_parameters import migrate_in_place
+    moto_node_group_table.put_item(Item={
+        'Name': 'BT Base Server',
+        'Class': 'roles::base_server',
+        'Parameters': json.dumps({'bt_product': 'cea', 'bt_weight': 0.5})
+    })
+    client.post("/nodegroup/", json={"name": "BT Apache Server", "class_": "roles::apache_server",
+                                     "parameters": {"bt_product": "lob"}})
+    legacy = client.get("/nodegroup/BT%20Base%20Server").json()[0]['Parameters']
+
+    count, _ = migrate_in_place(moto_node_group_table, total_segments=2)
+    node_group_cache.clear()
+
+    assert count == 1, f"Expected only the string row to be migrated, got {count}"
+    result = moto_node_group_table.get_item(Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'})
+    assert result['Item']['ParameterSet'] == {'bt_product': 'cea', 'bt_weight': Decimal('0.5')}, \
+        f"Unexpected parameters {result['Item']}"
+    assert 'Parameters' not in result['Item'], "Expected the legacy string to be removed"
+    indexed = moto_node_group_table.scan(IndexName='ParametersIndex')['Items']
+    assert indexed == [], f"Expected no row left in ParametersIndex, got {indexed}"
+    assert client.get("/nodegroup/BT%20Base%20Server").json()[0]['Parameters'] == legacy, \
+        "Expected the same parameters to be read before and after the migration"
+
+def test_update_migrates_legacy_parameters(moto_node_group_table):
+    moto_node_group_table.put_item(Item={
+        'Name': 'BT Base Server',
+        'Class': 'roles::base_server',
+        'Parameters': json.dumps({'bt_product': 'cea'})
+    })
+
+    rejected = client.patch("/nodegroup/BT%20Base%20Server/parameters", json={'set': {'bt_tier': 'prod'}})
+    updated = client.put("/nodegroup/BT%20Base%20Server", json={
+        "name": "BT Base Server", "class_": "roles::base_server", "parameters": {"bt_product": "lob"}
+    })
+    patched = client.patch("/nodegroup/BT%20Base%20Server/parameters", json={'set': {'bt_tier': 'prod'}})
+
+    assert rejected.status_code == 409, f"Expected PATCH of a legacy string to get 409, got {rejected.status_code}"
+    assert (updated.status_code, patched.status_code) == (200, 200), \
+        f"Expected PUT and then PATCH to succeed, got {updated.status_code} and {patched.status_code}"
+    item = moto_node_group_table.get_item(Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'})['Item']
+    assert 'Parameters' not in item, "Expected the update to remove the legacy string"
+    assert item['ParameterSet'] == {'bt_product': 'lob', 'bt_tier': 'prod'}, f"Unexpected parameters {item}"
+
+def test_compressed_parameters_round_trip(moto_node_group_table):
+    parameters = {'bt_param_{:04d}'.format(i): 'value {}'.format(i) for i in range(500)}
+    client.post("/nodegroup/", json={'name': 'BT Base Server', 'class_': 'roles::base_server', 'parameters': parameters})
+
+    response = client.patch("/nodegroup/BT%20Base%20Server/parameters", json={
+        'set': {'bt_product': 'cea'},
+        'remove': ['bt_param_0000']
+    })
+    node_group_cache.clear()
+    read = client.get("/nodegroup/BT%20Base%20Server")
+
+    assert response.status_code == 200, f"Expected status code 200, got {response.status_code}"
+    expected = dict(parameters, bt_product='cea')
+    del expected['bt_param_0000']
+    assert read.json()[0]['Parameters'] == expected
+    stored = moto_node_group_table.get_item(Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'})['Item']
+    assert len(stored['ParameterSet'].value) < len(json.dumps(expected)) / 2, \
+        "Expected the stored parameters to be compressed"
+
+def test_stream_changes_reach_log_and_cache(moto_node_group_table, monkeypatch):
+    from lambdas.src.handlers import changes
+    from lambdas.src.handlers.changes import app as changes_app
+    client.post("/nodegroup/", json={"name": "BT Base Server", "class_": "roles::base_server", "parameters": {}})
+    change_log = boto3.resource('dynamodb', region_name='us-east-1').create_table(
+        TableName='ChangeLog',
+        KeySchema=[{'AttributeName': 'Feed', 'KeyType': 'HASH'}, {'AttributeName': 'Position', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'Feed', 'AttributeType': 'S'}, {'AttributeName': 'Position', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    monkeypatch.setattr(changes, 'change_log_table', change_log)
+    # Long enough for a moto write to finish inside the window
+    monkeypatch.setattr(changes, 'settle_ms', 100)
+    monkeypatch.setattr(changes, 'poll_interval', 0.001)
+    monkeypatch.setattr(changes, '_synced_to', None)
+    client.get("/nodegroup/BT%20Base%20Server")
+
+    # Another function changes the node group; its stream record goes
+    # through the consumer into the change log
+    stream_arn = moto_node_group_table.meta.client.update_table(
+        TableName='NodeGroup', StreamSpecification={'StreamEnabled': True, 'StreamViewType': 'NEW_AND_OLD_IMAGES'}
+    )['TableDescription']['LatestStreamArn']
+    moto_node_group_table.update_item(
+        Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'},
+        UpdateExpression="SET Version = Version + :one", ExpressionAttributeValues={':one': 1}
+    )
+    streams = boto3.client('dynamodbstreams', region_name='us-east-1')
+    shard = streams.describe_stream(StreamArn=stream_arn)['StreamDescription']['Shards'][0]
+    iterator = streams.get_shard_iterator(StreamArn=stream_arn, ShardId=shard['ShardId'],
+                                          ShardIteratorType='TRIM_HORIZON')['ShardIterator']
+    records = [dict(record, eventSourceARN=stream_arn) for record in streams.get_records(ShardIterator=iterator)['Records']]
+    changes.stream_handler({'Records': records}, None)
+    time.sleep(0.15)
+
+    response = TestClient(changes_app).get("/changes")
+    fetched = client.get("/nodegroup/BT%20Base%20Server")
+
+    assert response.status_code == 200, f"Expected status code 200, got {response.status_code}"
+    logged = response.json()['changes']
+    assert [(change['table'], change['event'], change['keys']['Name']) for change in logged] == \
+        [('NodeGroup', 'MODIFY', 'BT Base Server')], f"Unexpected changes {logged}"
+    # The sync dropped the cached entry, so the read sees the new Version
+    assert fetched.headers['ETag'] == '"v{}"'.format(logged[0]['version']), \
+        f"Expected the ETag of the new version, got {fetched.headers['ETag']}"
@@ -1,7 +1,12 @@
+import asyncio
+import json
 import boto3
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from lambdas.src.handlers.node import app, node_table
+from moto import mock_aws
+from unittest.mock import patch
+from lambdas.src.handlers.node import app, node_table, create_node, Node
 import os
 
 # Create a TestClient for the FastAPI app
@@ -131,8 +136,8 @@ def test_update_node(dynamodb, prepare_data):
         'NodeGroupName': 'BT Apache Server'
     })
     assert 'Item' in result, "Expected item to be present in DynamoDB"
-    assert result['Item']['environment_name'] == 'production', f"Expected 'environment_name' to be 'production', got {result['Item']['environment_name']}"
-    assert result['Item']['puppet_cluster_name'] == 'ny2-saas-n', f"Expected 'puppet_cluster_name' to be 'ny2-saas-n', got {result['Item']['puppet_cluster_name']}"
+    assert result['Item']['EnvironmentName'] == 'production', f"Expected 'EnvironmentName' to be 'production', got {result['Item']['EnvironmentName']}"
+    assert result['Item']['PuppetClusterName'] == 'ny2-saas-n', f"Expected 'PuppetClusterName' to be 'ny2-saas-n', got {result['Item']['PuppetClusterName']}"
 
 def test_delete_node(dynamodb, prepare_data):
     # Arrange: create a node directly in DynamoDB with correct keys
@@ -157,3 +162,542 @@ def test_delete_node(dynamodb, prepare_data):
         'NodeGroupName': 'BT Apache Server'
     })
     assert 'Item' not in result
+
+@pytest.fixture(scope="function")
+def moto_node_table():
+    # In-memory moto table swapped in for the handler's node_table
+    with mock_aws():
+        table = boto3.resource('dynamodb', region_name='us-east-1').create_table(
+            TableName='Node',
+            KeySchema=[
+                {'AttributeName': 'UniqueName', 'KeyType': 'HASH'},
+                {'AttributeName': 'NodeGroupName', 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'UniqueName', 'AttributeType': 'S'},
+                {'AttributeName': 'NodeGroupName', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        guards = boto3.resource('dynamodb', region_name='us-east-1').create_table(
+            TableName='NameGuard',
+            KeySchema=[{'AttributeName': 'Name', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'Name', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        with patch('lambdas.src.handlers.node.node_table', table), \
+                patch('lambdas.src.handlers.node.guard_table', guards):
+            yield table
+
+def test_create_node_conditional_put(moto_node_table):
+    node_data = {
+        "unique_name": "us01vlbase01.saas-n.com",
+        "node_group_name": "BT Base Server",
+        "environment_name": "master",
+        "puppet_cluster_name": "ny2-saas-n"
+    }
+
+    first = client.post("/nodes/", json=node_data)
+    second = client.post("/nodes/", json=dict(node_data, environment_name="production"))
+
+    assert first.status_code == 200, f"Expected status code 200, got {first.status_code}"
+    assert second.status_code == 400, f"Expected status code 400, got {second.status_code}"
+    assert second.json()['detail'] == 'Node with this UniqueName already exists'
+
+    # The rejected create must not have overwritten the original item
+    result = moto_node_table.get_item(Key={
+        'UniqueName': 'us01vlbase01.saas-n.com',
+        'NodeGroupName': 'BT Base Server'
+    })
+    assert result['Item']['EnvironmentName'] == 'master', \
+        f"Expected 'EnvironmentName' to stay 'master', got {result['Item']['EnvironmentName']}"
+
+def test_create_node_name_is_unique_across_groups(moto_node_table):
+    node_data = {
+        "unique_name": "us01vlbase01.saas-n.com",
+        "node_group_name": "BT Base Server",
+        "environment_name": "master",
+        "puppet_cluster_name": "ny2-saas-n"
+    }
+
+    first = client.post("/nodes/", json=node_data)
+    second = client.post("/nodes/", json=dict(node_data, node_group_name="BT Web Server"))
+    client.delete("/nodes/us01vlbase01.saas-n.com")
+    recreated = client.post("/nodes/", json=dict(node_data, node_group_name="BT Web Server"))
+
+    assert first.status_code == 200, f"Expected status code 200, got {first.status_code}"
+    assert second.status_code == 400, f"Expected a second group for the name to be refused, got {second.status_code}"
+    # The delete released the claim, so the name can be created again
+    assert recreated.status_code == 200, f"Expected a deleted name to be reusable, got {recreated.status_code}"
+    items = moto_node_table.scan()['Items']
+    assert [item['NodeGroupName'] for item in items] == ['BT Web Server'], \
+        f"Expected one item for the node, got {items}"
+
+def test_delete_nodes_batch_keeps_claim_of_other_group(moto_node_table):
+    from lambdas.src.handlers import node
+    client.post("/nodes/", json={
+        "unique_name": "us01vlbase01.saas-n.com",
+        "node_group_name": "BT Base Server",
+        "environment_name": "master",
+        "puppet_cluster_name": "ny2-saas-n"
+    })
+
+    # The name exists, but not under the group named in the request
+    response = client.request("DELETE", "/nodes/batch", json=[
+        {"unique_name": "us01vlbase01.saas-n.com", "node_group_name": "BT Web Server"}
+    ])
+    refused = client.post("/nodes/", json={
+        "unique_name": "us01vlbase01.saas-n.com",
+        "node_group_name": "BT Web Server",
+        "environment_name": "master",
+        "puppet_cluster_name": "ny2-saas-n"
+    })
+
+    assert response.json()['results'][0] == {
+        "unique_name": "us01vlbase01.saas-n.com", "node_group_name": "BT Web Server",
+        "status": "failed", "detail": "Node not found"
+    }, f"Unexpected result {response.json()}"
+    assert node.guard_table.get_item(Key={'Name': 'node#us01vlbase01.saas-n.com'}).get('Item'), \
+        "Expected the claim of the existing node to be kept"
+    assert refused.status_code == 400, f"Expected the name to stay taken, got {refused.status_code}"
+
+def test_concurrent_creates_only_one_wins(moto_node_table, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from lambdas.src.handlers import dynamo
+    # moto does not lock around condition checks, so its calls go out one at
+    # a time. The creates still interleave on the event loop, which is what
+    # let a separate existence check and put both pass.
+    monkeypatch.setattr(dynamo, 'executor', ThreadPoolExecutor(max_workers=1))
+    node = Node(
+        unique_name="us01vlbase01.saas-n.com",
+        node_group_name="BT Base Server",
+        environment_name="master",
+        puppet_cluster_name="ny2-saas-n"
+    )
+
+    async def create_many():
+        return await asyncio.gather(*(create_node(node) for _ in range(8)), return_exceptions=True)
+
+    results = asyncio.run(create_many())
+
+    created = [result for result in results if not isinstance(result, Exception)]
+    rejected = [result for result in results if isinstance(result, HTTPException)]
+    assert len(created) == 1, f"Expected exactly one create to succeed, got {len(created)}"
+    assert len(rejected) == 7 and all(error.status_code == 400 for error in rejected)
+
+def test_update_node_group_change_is_transactional(moto_node_table):
+    moto_node_table.put_item(Item={
+        'UniqueName': 'us01vlbase01.saas-n.com',
+        'NodeGroupName': 'BT Base Server',
+        'environment_name': 'master',
+        'puppet_cluster_name': 'ny2-saas-n'
+    })
+
+    response = client.put("/nodes/us01vlbase01.saas-n.com", json={
+        'unique_name': 'us01vlbase01.saas-n.com',
+        'node_group_name': 'BT Apache Server',
+        'environment_name': 'production',
+        'puppet_cluster_name': 'ny2-saas-n'
+    })
+
+    assert response.status_code == 200, f"Expected status code 200, got {response.status_code}"
+    items = moto_node_table.scan()['Items']
+    assert len(items) == 1, f"Expected exactly one item after the move, got {items}"
+    assert items[0]['NodeGroupName'] == 'BT Apache Server'
+    assert items[0]['EnvironmentName'] == 'production'
+
+def test_update_node_cannot_overwrite_unique_name(moto_node_table):
+    node = {
+        'unique_name': 'us01vlbase01.saas-n.com',
+        'node_group_name': 'BT Base Server',
+        'environment_name': 'master',
+        'puppet_cluster_name': 'ny2-saas-n'
+    }
+    client.post("/nodes/", json=node)
+    client.post("/nodes/", json=dict(node, unique_name='us01vlbase02.saas-n.com'))
+    # Written before names were claimed, so only the put's condition guards it
+    moto_node_table.put_item(Item={
+        'UniqueName': 'us01vlbase03.saas-n.com',
+        'NodeGroupName': 'BT Base Server',
+        'EnvironmentName': 'master',
+        'PuppetClusterName': 'ny2-saas-n'
+    })
+
+    claimed = client.put("/nodes/us01vlbase01.saas-n.com",
+                         json=dict(node, unique_name='us01vlbase02.saas-n.com', environment_name='production'))
+    unclaimed = client.put("/nodes/us01vlbase01.saas-n.com",
+                           json=dict(node, unique_name='us01vlbase03.saas-n.com', environment_name='production'))
+
+    for response in (claimed, unclaimed):
+        assert response.status_code == 400, f"Expected status code 400, got {response.status_code}"
+        assert response.json()['detail'] == "Node with this UniqueName already exists"
+    items = {item['UniqueName']: item for item in moto_node_table.scan()['Items']}
+    assert sorted(items) == ['us01vlbase01.saas-n.com', 'us01vlbase02.saas-n.com', 'us01vlbase03.saas-n.com'], \
+        f"Expected all three nodes to remain, got {sorted(items)}"
+    assert all(item['EnvironmentName'] == 'master' for item in items.values()), "Expected no node to be overwritten"
+
+def test_stale_update_is_rejected(moto_node_table):
+    node = {
+        'unique_name': 'us01vlbase01.saas-n.com',
+        'node_group_name': 'BT Base Server',
+        'environment_name': 'master',
+        'puppet_cluster_name': 'ny2-saas-n'
+    }
+    client.post("/nodes/", json=node)
+    read_etag = client.get("/nodes/us01vlbase01.saas-n.com").headers['ETag']
+
+    first = client.put("/nodes/us01vlbase01.saas-n.com", json=dict(node, environment_name='production'),
+                       headers={'If-Match': read_etag})
+    second = client.put("/nodes/us01vlbase01.saas-n.com", json=dict(node, environment_name='staging'),
+                        headers={'If-Match': read_etag})
+
+    assert first.status_code == 200, f"Expected status code 200, got {first.status_code}"
+    assert second.status_code == 409, f"Expected the stale update to get 409, got {second.status_code}"
+    fetched = client.get("/nodes/us01vlbase01.saas-n.com")
+    assert fetched.headers['ETag'] == first.headers['ETag']
+    assert fetched.json()[0]['EnvironmentName'] == 'production'
+
+def test_lookup_nodes_in_batches(moto_node_table):
+    for i in range(0, 150, 3):
+        moto_node_table.put_item(Item={
+            'UniqueName': 'us01vlbase{:03d}.saas-n.com'.format(i),
+            'NodeGroupName': 'BT Base Server',
+            'EnvironmentName': 'master',
+            'PuppetClusterName': 'ny2-saas-n'
+        })
+
+    response = client.post("/nodes/lookup", json={
+        'nodes': [{'unique_name': 'us01vlbase{:03d}.saas-n.com'.format(i), 'node_group_name': 'BT Base Server'}
+                  for i in range(150)],
+        'unique_names': ['us01vlbase003.saas-n.com', 'us01vlmissing.saas-n.com']
+    })
+
+    assert response.status_code == 200, f"Expected status code 200, got {response.status_code}"
+    data = response.json()
+    assert data['found'] == 50, f"Expected 50 nodes found, got {data['found']}"
+    assert len(data['not_found']) == 101, f"Expected 101 nodes not found, got {len(data['not_found'])}"
+    assert len(data['nodes']['us01vlbase003.saas-n.com']) == 1
+    assert data['nodes']['us01vlbase003.saas-n.com'][0]['EnvironmentName'] == 'master'
+
+def test_bulk_import_resumes_from_checkpoint(moto_node_table, tmp_path):
+    from tools import bulk
+    rows = ['unique_name,node_group_name,environment_name,puppet_cluster_name']
+    rows += ['us01vlbase{:03d}.saas-n.com,BT Base Server,master,ny2-saas-n'.format(i) for i in range(120)]
+    rows[51] = 'us01vlbase050.saas-n.com,BT Base Server,master'
+    source = tmp_path / 'nodes.csv'
+    source.write_text('\n'.join(rows) + '\n')
+    checkpoint = str(tmp_path / 'nodes.ckpt')
+
+    def interrupted(records):
+        # Fail while reading the third batch, after two were written
+        for i, record in enumerate(records):
+            if i == 100:
+                raise KeyboardInterrupt
+            yield record
+
+    # Nodes are written in transactions, which moto does not run thread
+    # safely, so one worker writes them
+    with patch.object(bulk.KINDS['nodes'], 'table', moto_node_table):
+        with open(source) as f, pytest.raises(KeyboardInterrupt):
+            bulk.import_records('nodes', interrupted(bulk.read_records(f, 'csv')), str(source),
+                                batch_size=40, workers=1, checkpoint_path=checkpoint)
+        with open(checkpoint) as f:
+            saved = json.load(f)
+        with open(source) as f:
+            result = bulk.import_records('nodes', bulk.read_records(f, 'csv'), str(source),
+                                         batch_size=40, workers=1, checkpoint_path=checkpoint)
+
+    assert (saved['rows'], saved['written'], saved['rejected']) == (80, 79, 1), f"Unexpected checkpoint {saved}"
+    assert (result['rows'], result['written'], result['rejected']) == (120, 119, 1), f"Unexpected result {result}"
+    items = moto_node_table.scan()['Items']
+    assert len(items) == 119, f"Expected 119 nodes, got {len(items)}"
+    assert 'us01vlbase050.saas-n.com' not in {item['UniqueName'] for item in items}, "Expected the invalid row to be rejected"
+
+def test_bulk_import_claims_names(moto_node_table, tmp_path):
+    from lambdas.src.handlers import node
+    from tools import bulk
+    client.post("/nodes/", json={"unique_name": "us01vlbase01.saas-n.com", "node_group_name": "BT Base Server",
+                                 "environment_name": "master", "puppet_cluster_name": "ny2-saas-n"})
+    records = [
+        # Overwrites the existing node
+        {"unique_name": "us01vlbase01.saas-n.com", "node_group_name": "BT Base Server",
+         "environment_name": "production", "puppet_cluster_name": "ny2-saas-n"},
+        {"unique_name": "us01vlbase02.saas-n.com", "node_group_name": "BT Base Server",
+         "environment_name": "master", "puppet_cluster_name": "ny2-saas-n"},
+    ]
+    clash = [{"unique_name": "us01vlbase02.saas-n.com", "node_group_name": "BT Web Server",
+              "environment_name": "master", "puppet_cluster_name": "ny2-saas-n"}]
+
+    with patch.object(bulk.KINDS['nodes'], 'table', moto_node_table):
+        first = bulk.import_records('nodes', records, 'records', workers=1)
+        second = bulk.import_records('nodes', clash, 'clash', workers=1)
+
+    assert (first['written'], first['rejected']) == (2, 0), f"Unexpected first import {first}"
+    assert (second['written'], second['rejected']) == (0, 1), f"Expected the clashing name to be rejected, got {second}"
+    items = {(item['UniqueName'], item['NodeGroupName']): item for item in moto_node_table.scan()['Items']}
+    assert sorted(items) == [('us01vlbase01.saas-n.com', 'BT Base Server'), ('us01vlbase02.saas-n.com', 'BT Base Server')], \
+        f"Unexpected nodes {sorted(items)}"
+    assert items[('us01vlbase01.saas-n.com', 'BT Base Server')]['EnvironmentName'] == 'production'
+    assert len(node.guard_table.scan()['Items']) == 2, "Expected one claim per imported name"
+
+def test_bulk_export_imports_back(moto_node_table, tmp_path):
+    from tools import bulk
+    for i in range(30):
+        moto_node_table.put_item(Item={'UniqueName': 'us01vlbase{:02d}.saas-n.com'.format(i), 'NodeGroupName': 'BT Base Server',
+                                       'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n', 'Version': 1})
+    exported = {}
+    with patch.object(bulk.KINDS['nodes'], 'table', moto_node_table):
+        for fmt in ('csv', 'ndjson', 'yaml'):
+            with open(tmp_path / ('nodes.' + fmt), 'w', newline='') as out:
+                count, _ = bulk.export_records('nodes', out, fmt, total_segments=3)
+            assert count == 30, f"Expected 30 exported nodes, got {count}"
+            with open(tmp_path / ('nodes.' + fmt), newline='') as f:
+                exported[fmt] = sorted(bulk.read_records(f, fmt), key=lambda record: record['unique_name'])
+
+    assert exported['csv'] == exported['ndjson'] == exported['yaml'], "Expected every format to read back the same records"
+    assert exported['csv'][0] == {'unique_name': 'us01vlbase00.saas-n.com', 'node_group_name': 'BT Base Server',
+                                  'environment_name': 'master', 'puppet_cluster_name': 'ny2-saas-n'}, \
+        f"Unexpected record {exported['csv'][0]}"
+
+def test_migrate_legacy_node_attributes(moto_node_table):
+    from tools.migrate_node_attributes import migrate_nodes
+    moto_node_table.put_item(Item={
+        'UniqueName': 'us01vlbase01.saas-n.com',
+        'NodeGroupName': 'BT Base Server',
+        'environment_name': 'master',
+        'puppet_cluster_name': 'ny2-saas-n'
+    })
+    moto_node_table.put_item(Item={
+        'UniqueName': 'us01vlbase02.saas-n.com',
+        'NodeGroupName': 'BT Base Server',
+        'EnvironmentName': 'production',
+        'PuppetClusterName': 'ny2-saas-n'
+    })
+
+    count, _ = migrate_nodes(moto_node_table, total_segments=2)
+
+    assert count == 1, f"Expected only the legacy node to be migrated, got {count}"
+    items = {item['UniqueName']: item for item in moto_node_table.scan()['Items']}
+    assert items['us01vlbase01.saas-n.com'] == {
+        'UniqueName': 'us01vlbase01.saas-n.com',
+        'NodeGroupName': 'BT Base Server',
+        'EnvironmentName': 'master',
+        'PuppetClusterName': 'ny2-saas-n'
+    }
+    assert items['us01vlbase02.saas-n.com']['EnvironmentName'] == 'production'
+
+def test_backfill_name_guard(moto_node_table):
+    from lambdas.src.handlers import node
+    from tools.backfill_name_guard import backfill
+    for i in range(30):
+        moto_node_table.put_item(Item={'UniqueName': 'us01vlbase{:02d}.saas-n.com'.format(i), 'NodeGroupName': 'BT Base Server'})
+    # Written before names were claimed: the same name under two groups
+    moto_node_table.put_item(Item={'UniqueName': 'us01vlbase00.saas-n.com', 'NodeGroupName': 'BT Web Server'})
+
+    written, duplicates, _ = backfill(moto_node_table, 'UniqueName', node.node_claim, node.guard_table, total_segments=2)
+    again, _, _ = backfill(moto_node_table, 'UniqueName', node.node_claim, node.guard_table, total_segments=2)
+    refused = client.post("/nodes/", json={
+        "unique_name": "us01vlbase07.saas-n.com",
+        "node_group_name": "BT Web Server",
+        "environment_name": "master",
+        "puppet_cluster_name": "ny2-saas-n"
+    })
+
+    assert (written, again) == (30, 30), f"Expected one claim per name on every run, got {written} and {again}"
+    assert duplicates == ['us01vlbase00.saas-n.com'], f"Unexpected duplicates {duplicates}"
+    assert len(node.guard_table.scan()['Items']) == 30, "Expected one claim per name"
+    assert refused.status_code == 400, f"Expected a backfilled name to be taken, got {refused.status_code}"
+
+def test_lazy_table_matches_resource_table(moto_node_table, monkeypatch):
+    from lambdas.src.handlers import dynamo
+    # Build the shared low-level client inside the moto mock
+    monkeypatch.setattr(dynamo, '_client', None)
+    table = dynamo.Table('Node')
+
+    with patch('lambdas.src.handlers.node.node_table', table):
+        created = client.post("/nodes/", json={
+            "unique_name": "us01vlbase01.saas-n.com",
+            "node_group_name": "BT Base Server",
+            "environment_name": "master",
+            "puppet_cluster_name": "ny2-saas-n"
+        })
+        fetched = client.get("/nodes/us01vlbase01.saas-n.com")
+        moved = client.put("/nodes/us01vlbase01.saas-n.com", json={
+            "unique_name": "us01vlbase01.saas-n.com",
+            "node_group_name": "BT Apache Server",
+            "environment_name": "production",
+            "puppet_cluster_name": "ny2-saas-n"
+        })
+
+    assert created.status_code == 200, f"Expected status code 200, got {created.status_code}"
+    assert fetched.json()[0]['EnvironmentName'] == 'master', f"Unexpected node {fetched.json()}"
+    assert moved.status_code == 200, f"Expected status code 200, got {moved.status_code}"
+    # Items written through the low-level client read back the same way
+    # through the resource layer
+    items = moto_node_table.scan()['Items']
+    assert items == [{
+        'UniqueName': 'us01vlbase01.saas-n.com',
+        'NodeGroupName': 'BT Apache Server',
+        'EnvironmentName': 'production',
+        'PuppetClusterName': 'ny2-saas-n',
+        'Version': int(fetched.headers['ETag'].strip('"v')) + 1
+    }], f"Unexpected items {items}"
+
+def test_request_timing_reports_dynamodb_calls(moto_node_table, monkeypatch, capsys):
+    from lambdas.src.handlers import dynamo
+    monkeypatch.setattr(dynamo, '_client', None)
+    moto_node_table.put_item(Item={'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'})
+
+    with patch('lambdas.src.handlers.node.node_table', dynamo.Table('Node')):
+        response = client.get("/nodes/us01vlbase01.saas-n.com")
+
+    server_timing = response.headers['Server-Timing']
+    assert server_timing.startswith('dynamodb;dur=') and '1 calls' in server_timing, \
+        f"Unexpected Server-Timing {server_timing}"
+    record = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert (record['Route'], record['Status'], record['DynamodbCalls']) == ('/nodes/{unique_name}', 200, 1), \
+        f"Unexpected EMF record {record}"
+    assert record['ConsumedCapacity'] > 0, f"Expected the query's consumed capacity, got {record}"
+
+def test_classification_documents_rebuild_and_fan_out():
+    from lambdas.src.handlers import classification
+    from tools import rebuild_classifications
+    with mock_aws():
+        resource = boto3.resource('dynamodb', region_name='us-east-1')
+        nodes = resource.create_table(
+            TableName='Node',
+            KeySchema=[{'AttributeName': 'UniqueName', 'KeyType': 'HASH'},
+                       {'AttributeName': 'NodeGroupName', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'UniqueName', 'AttributeType': 'S'},
+                                  {'AttributeName': 'NodeGroupName', 'AttributeType': 'S'}],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'NodeGroupNameIndex',
+                'KeySchema': [{'AttributeName': 'NodeGroupName', 'KeyType': 'HASH'},
+                              {'AttributeName': 'UniqueName', 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            }],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        node_groups = resource.create_table(
+            TableName='NodeGroup',
+            KeySchema=[{'AttributeName': 'Name', 'KeyType': 'HASH'}, {'AttributeName': 'Class', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'Name', 'AttributeType': 'S'},
+                                  {'AttributeName': 'Class', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        documents = resource.create_table(
+            TableName='Classification',
+            KeySchema=[{'AttributeName': 'UniqueName', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'UniqueName', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        node_groups.put_item(Item={'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {'bt_product': 'cea'}})
+        for i in range(60):
+            nodes.put_item(Item={
+                'UniqueName': 'us01vlbase{:02d}.saas-n.com'.format(i),
+                'NodeGroupName': 'BT Base Server',
+                'EnvironmentName': 'master',
+                'PuppetClusterName': 'ny2-saas-n'
+            })
+        documents.put_item(Item={'UniqueName': 'us01vlgone.saas-n.com'})
+
+        with patch.object(classification, 'node_table', nodes), \
+                patch.object(classification, 'node_group_table', node_groups), \
+                patch.object(classification, 'classification_table', documents), \
+                patch.object(rebuild_classifications, 'node_table', nodes), \
+                patch.object(rebuild_classifications, 'node_group_table', node_groups), \
+                patch.object(rebuild_classifications, 'classification_table', documents):
+            written, deleted, _ = rebuild_classifications.rebuild(total_segments=2, prune=True)
+
+            node_groups.update_item(
+                Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'},
+                UpdateExpression="SET #parameters.bt_product = :product",
+                ExpressionAttributeNames={'#parameters': 'ParameterSet'},
+                ExpressionAttributeValues={':product': 'lob'}
+            )
+            classification.stream_handler({'Records': [{
+                'eventName': 'MODIFY',
+                'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789012:table/NodeGroup/stream/2024-01-01T00:00:00.000',
+                'dynamodb': {'Keys': {'Name': {'S': 'BT Base Server'}, 'Class': {'S': 'roles::base_server'}}}
+            }]}, None)
+
+        assert (written, deleted) == (60, 1), f"Expected 60 documents written and 1 pruned, got {(written, deleted)}"
+        items = documents.scan()['Items']
+        assert len(items) == 60, f"Expected 60 documents, got {len(items)}"
+        assert all(item['Parameters'] == {'bt_product': 'lob'} for item in items), \
+            "Expected the node group change to reach every member's document"
+
+def test_node_group_membership_reassign_and_cascade():
+    from concurrent.futures import ThreadPoolExecutor
+    from lambdas.src.handlers import dynamo, node_group
+    with mock_aws():
+        resource = boto3.resource('dynamodb', region_name='us-east-1')
+        nodes = resource.create_table(
+            TableName='Node',
+            KeySchema=[{'AttributeName': 'UniqueName', 'KeyType': 'HASH'},
+                       {'AttributeName': 'NodeGroupName', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'UniqueName', 'AttributeType': 'S'},
+                                  {'AttributeName': 'NodeGroupName', 'AttributeType': 'S'}],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'NodeGroupNameIndex',
+                'KeySchema': [{'AttributeName': 'NodeGroupName', 'KeyType': 'HASH'},
+                              {'AttributeName': 'UniqueName', 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'}
+            }],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        node_groups = resource.create_table(
+            TableName='NodeGroup',
+            KeySchema=[{'AttributeName': 'Name', 'KeyType': 'HASH'}, {'AttributeName': 'Class', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'Name', 'AttributeType': 'S'},
+                                  {'AttributeName': 'Class', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        guards = resource.create_table(
+            TableName='NameGuard',
+            KeySchema=[{'AttributeName': 'Name', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'Name', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        for name in ('BT Base Server', 'BT Web Server'):
+            node_groups.put_item(Item={'Name': name, 'Class': 'roles::base_server', 'ParameterSet': {}})
+            guards.put_item(Item={'Name': 'nodegroup#' + name})
+        with nodes.batch_writer() as batch, guards.batch_writer() as claims:
+            for i in range(150):
+                batch.put_item(Item={
+                    'UniqueName': 'us01vlbase{:03d}.saas-n.com'.format(i),
+                    'NodeGroupName': 'BT Base Server',
+                    'EnvironmentName': 'master',
+                    'PuppetClusterName': 'ny2-saas-n',
+                    'Version': 1
+                })
+                claims.put_item(Item={'Name': 'node#us01vlbase{:03d}.saas-n.com'.format(i)})
+        nodes.put_item(Item={'UniqueName': 'us01vlother.saas-n.com', 'NodeGroupName': 'BT Other Server'})
+        guards.put_item(Item={'Name': 'node#us01vlother.saas-n.com'})
+
+        client = TestClient(node_group.app)
+        # moto's transactions are not thread safe, so its calls go out one at
+        # a time
+        with patch.object(node_group, 'node_table', nodes), patch.object(node_group, 'node_group_table', node_groups), \
+                patch.object(node_group, 'guard_table', guards), patch.object(node_group, 'member_page_size', 40), \
+                patch.object(dynamo, 'executor', ThreadPoolExecutor(max_workers=1)):
+            page = client.get("/nodegroup/BT Base Server/nodes", params={'limit': 100, 'count': 'true'}).json()
+            refused = client.delete("/nodegroup/BT Base Server")
+            moved = client.post("/nodegroup/BT Base Server/reassign", json={'target': 'BT Web Server'}).json()
+            emptied = client.get("/nodegroup/BT Base Server/nodes", params={'count': 'true'}).json()
+            deleted = client.delete("/nodegroup/BT Base Server")
+            cascaded = client.delete("/nodegroup/BT Web Server", params={'cascade': 'true'}).json()
+
+        assert (len(page['items']), page['count']) == (100, 150), f"Unexpected first page of {page['count']} members"
+        assert page['next_cursor'], "Expected a cursor for the rest of the members"
+        assert refused.status_code == 409, f"Expected a group with members to be kept, got {refused.status_code}"
+        assert moved == {'moved': 150, 'failed': 0, 'failures': []}, f"Unexpected reassign result {moved}"
+        assert (emptied['items'], emptied['count']) == ([], 0), f"Expected no members left, got {emptied}"
+        assert deleted.status_code == 200, f"Expected the emptied group to be deleted, got {deleted.status_code}"
+        assert cascaded['nodes_deleted'] == 150, f"Unexpected cascade result {cascaded}"
+        remaining = nodes.scan()['Items']
+        assert [item['UniqueName'] for item in remaining] == ['us01vlother.saas-n.com'], \
+            f"Expected only the other group's node to remain, got {len(remaining)} nodes"
+        # Deletes release the claims of the deleted names, and only those
+        claims = [item['Name'] for item in guards.scan()['Items']]
+        assert claims == ['node#us01vlother.saas-n.com'], f"Unexpected claims left {claims}"
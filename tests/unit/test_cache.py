@@ -0,0 +1,127 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from lambdas.src.handlers.cache import SingleFlight, TTLCache
+
+def test_get_counts_hits_and_misses():
+    # Arrange
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('BT Base Server', ['item'])
+
+    # Act
+    hit = cache.get('BT Base Server')
+    miss = cache.get('BT Apache Server')
+
+    # Assert
+    assert hit == ['item'], "Cache: Expected cached value, got {}".format(hit)
+    assert miss is None, "Cache: Expected miss to return None, got {}".format(miss)
+    assert (cache.hits, cache.misses) == (1, 1), \
+        "Cache: Expected 1 hit and 1 miss, got {} and {}".format(cache.hits, cache.misses)
+
+def test_entries_expire_after_ttl():
+    # Arrange
+    cache = TTLCache(maxsize=2, ttl=60)
+    with patch('lambdas.src.handlers.cache.time.monotonic', return_value=1000.0):
+        cache.set('BT Base Server', ['item'])
+
+    # Act
+    with patch('lambdas.src.handlers.cache.time.monotonic', return_value=1061.0):
+        value = cache.get('BT Base Server')
+
+    # Assert
+    assert value is None, "Cache: Expected expired entry to miss, got {}".format(value)
+    assert cache.stats()['size'] == 0, "Cache: Expected expired entry to be dropped"
+
+def test_least_recently_used_entry_is_evicted():
+    # Arrange
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+
+    # Act
+    cache.set('c', 3)
+
+    # Assert
+    assert cache.get('b') is None, "Cache: Expected 'b' to be evicted"
+    assert cache.get('a') == 1 and cache.get('c') == 3, "Cache: Expected 'a' and 'c' to be kept"
+
+def test_get_stale_serves_expired_entries():
+    # Arrange
+    cache = TTLCache(maxsize=2, ttl=60, stale_ttl=300)
+    with patch('lambdas.src.handlers.cache.time.monotonic', return_value=1000.0):
+        cache.set('BT Base Server', ['item'])
+        cache.set('BT Apache Server', ['item'])
+    cache.invalidate('BT Apache Server')
+
+    # Act
+    with patch('lambdas.src.handlers.cache.time.monotonic', return_value=1100.0):
+        fresh = cache.get('BT Base Server')
+        stale = cache.get_stale('BT Base Server')
+        invalidated = cache.get_stale('BT Apache Server')
+    with patch('lambdas.src.handlers.cache.time.monotonic', return_value=1400.0):
+        too_old = cache.get_stale('BT Base Server')
+
+    # Assert
+    assert fresh is None, "Cache: Expected expired entry to miss, got {}".format(fresh)
+    assert stale == ['item'], "Cache: Expected expired entry to be served stale, got {}".format(stale)
+    assert invalidated is None and too_old is None, \
+        "Cache: Expected no stale value after invalidation or stale_ttl, got {} and {}".format(invalidated, too_old)
+
+def test_single_flight_shares_concurrent_calls():
+    # Arrange
+    flights = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ['item']
+
+    async def burst():
+        return await asyncio.gather(*(flights.do('BT Base Server', load) for _ in range(3)))
+
+    # Act
+    results = asyncio.run(burst())
+    later = asyncio.run(flights.do('BT Base Server', load))
+
+    # Assert
+    assert results == [['item']] * 3 and later == ['item'], "Single Flight: Unexpected results {}".format(results)
+    assert len(calls) == 2, "Single Flight: Expected one load per burst, got {}".format(len(calls))
+    assert flights.collapsed == 2, "Single Flight: Expected 2 collapsed calls, got {}".format(flights.collapsed)
+
+def test_single_flight_shares_errors():
+    # Arrange
+    flights = SingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.05)
+        raise RuntimeError('Rate exceeded')
+
+    async def burst():
+        return await asyncio.gather(*(flights.do('BT Base Server', load) for _ in range(2)), return_exceptions=True)
+
+    # Act
+    results = asyncio.run(burst())
+
+    # Assert
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError], \
+        "Single Flight: Expected every caller to get the error, got {}".format(results)
+    with pytest.raises(RuntimeError):
+        asyncio.run(flights.do('BT Base Server', load))
+
+def test_set_drops_value_read_before_invalidation():
+    # Arrange
+    cache = TTLCache(maxsize=2, ttl=60)
+    before_write = cache.generation('BT Base Server')
+    cache.invalidate('BT Base Server')
+    after_write = cache.generation('BT Base Server')
+
+    # Act
+    cache.set('BT Base Server', ['old item'], before_write)
+    dropped = cache.get('BT Base Server')
+    cache.set('BT Base Server', ['new item'], after_write)
+
+    # Assert
+    assert dropped is None, "Cache: Expected a value read before the write to be dropped, got {}".format(dropped)
+    assert cache.get('BT Base Server') == ['new item'], "Cache: Expected a value read after the write to be cached"
@@ -0,0 +1,315 @@
+import asyncio
+import pytest
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from lambdas.src.handlers import changes, dynamo
+from lambdas.src.handlers.changes import app
+
+# Initialize the TestClient with FastAPI app
+client = TestClient(app)
+
+NODE_GROUP_ARN = 'arn:aws:dynamodb:us-east-1:123456789012:table/NodeGroup/stream/2024-01-01T00:00:00.000'
+
+def stream_record(event_name, sequence_number, version=None):
+    record = {
+        'eventName': event_name,
+        'eventSourceARN': NODE_GROUP_ARN,
+        'dynamodb': {
+            'Keys': {'Name': {'S': 'BT Base Server'}, 'Class': {'S': 'roles::base_server'}},
+            'SequenceNumber': sequence_number,
+        }
+    }
+    if version is not None:
+        record['dynamodb']['NewImage'] = {'Name': {'S': 'BT Base Server'}, 'Version': {'N': str(version)}}
+    return record
+
+@pytest.fixture(scope='function')
+def mock_dynamodb():
+    # Patch the change log table, pin the clock at 1700000000000 ms and keep
+    # the log in one partition unless a test spreads it
+    with patch('lambdas.src.handlers.changes.change_log_table') as mock_table, \
+            patch('lambdas.src.handlers.changes.now_ms', return_value=1700000000000), \
+            patch('lambdas.src.handlers.changes.shards', 1):
+        yield mock_table
+
+def test_change_item(mock_dynamodb):
+    # Act
+    item = changes.change_item(stream_record('MODIFY', '4421584500000000017450439091', version=8), 1700000000000)
+
+    # Assert
+    assert item == {
+        'Feed': 'changes#0',
+        'Position': '1700000000000-0000000000004421584500000000017450439091-NodeGroup',
+        'Table': 'NodeGroup',
+        'Event': 'MODIFY',
+        'Keys': {'Name': 'BT Base Server', 'Class': 'roles::base_server'},
+        'ExpiresAt': 1700000000 + 7 * 86400,
+        'Version': Decimal(8),
+    }, "Change Item: Unexpected item {}".format(item)
+
+def test_stream_handler_writes_changes(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.name = 'ChangeLog'
+    mock_dynamodb.meta.client.batch_write_item.return_value = {'UnprocessedItems': {}}
+    records = [stream_record('INSERT', str(i)) for i in range(30)]
+
+    # Act
+    result = changes.stream_handler({'Records': records}, None)
+
+    # Assert
+    assert result == {"changes": 30}, "Stream Handler: Unexpected result {}".format(result)
+    calls = mock_dynamodb.meta.client.batch_write_item.call_args_list
+    assert [len(call.kwargs['RequestItems']['ChangeLog']) for call in calls] == [25, 5], \
+        "Stream Handler: Expected batches of 25 and 5, got {}".format(calls)
+
+def test_stream_handler_raises_when_a_write_fails(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.name = 'ChangeLog'
+    mock_dynamodb.meta.client.batch_write_item.side_effect = lambda RequestItems: {'UnprocessedItems': RequestItems}
+
+    # Act / Assert
+    # Raising makes Lambda retry the batch instead of dropping changes
+    with patch('lambdas.src.handlers.dynamo.time.sleep'), pytest.raises(RuntimeError):
+        changes.stream_handler({'Records': [stream_record('REMOVE', '1')]}, None)
+
+def test_stream_handler_rewrites_late_changes(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.name = 'ChangeLog'
+    mock_dynamodb.meta.client.batch_write_item.return_value = {'UnprocessedItems': {}}
+    # The first write ends 3 s after its timestamp, past the 2 s readers wait
+    clock = iter([1700000000000, 1700000003000, 1700000003000, 1700000003100])
+
+    # Act
+    with patch('lambdas.src.handlers.changes.now_ms', lambda: next(clock)):
+        changes.stream_handler({'Records': [stream_record('MODIFY', '1')]}, None)
+
+    # Assert
+    calls = mock_dynamodb.meta.client.batch_write_item.call_args_list
+    positions = [call.kwargs['RequestItems']['ChangeLog'][0]['PutRequest']['Item']['Position'][:13] for call in calls]
+    assert positions == ['1700000000000', '1700000003000'], \
+        "Stream Handler: Expected the late change to be written again under a fresh position, got {}".format(positions)
+
+def test_stream_handler_gives_up_on_slow_writes(mock_dynamodb, monkeypatch):
+    # Arrange
+    mock_dynamodb.name = 'ChangeLog'
+    mock_dynamodb.meta.client.batch_write_item.return_value = {'UnprocessedItems': {}}
+    clock = iter(range(1700000000000, 1800000000000, 5000))
+    monkeypatch.setattr(changes, 'now_ms', lambda: next(clock))
+
+    # Act / Assert
+    with pytest.raises(RuntimeError):
+        changes.stream_handler({'Records': [stream_record('MODIFY', '1')]}, None)
+    assert mock_dynamodb.meta.client.batch_write_item.call_count == changes.late_writes
+
+def test_get_changes(mock_dynamodb):
+    # Arrange
+    since = '1699999990000-0000000000000000000000000000000000000001-NodeGroup'
+    mock_dynamodb.query.return_value = {'Items': [
+        {'Position': since, 'Table': 'NodeGroup', 'Event': 'INSERT', 'Keys': {'Name': 'BT Base Server'}},
+        {'Position': '1699999995000-0000000000000000000000000000000000000002-NodeGroup', 'Table': 'NodeGroup',
+         'Event': 'MODIFY', 'Keys': {'Name': 'BT Base Server'}, 'Version': Decimal(2)},
+    ]}
+
+    # Act
+    response = client.get("/changes", params={'since': since})
+
+    # Assert
+    assert response.status_code == 200, \
+        "Get Changes: Expected status code 200, got {}".format(response.status_code)
+    assert response.json() == {
+        'changes': [{
+            'token': '1699999995000-0000000000000000000000000000000000000002-NodeGroup',
+            'table': 'NodeGroup',
+            'event': 'MODIFY',
+            'keys': {'Name': 'BT Base Server'},
+            'version': 2,
+        }],
+        # Everything up to the settle horizon has been read
+        'next_token': '1699999998000',
+        'more': False,
+    }, "Get Changes: Unexpected body {}".format(response.json())
+    mock_dynamodb.query.assert_called_once_with(
+        KeyConditionExpression=Key('Feed').eq('changes#0') & Key('Position').between(since, '1699999998000'),
+        Limit=501
+    )
+
+def test_get_changes_pages(mock_dynamodb):
+    # Arrange
+    items = [{'Position': '16999999{:05d}-{:040d}-Node'.format(i, i), 'Table': 'Node', 'Event': 'INSERT',
+              'Keys': {'UniqueName': 'us01vlbase{:02d}.saas-n.com'.format(i)}} for i in range(3)]
+    mock_dynamodb.query.return_value = {'Items': items, 'LastEvaluatedKey': {'Feed': 'changes#0', 'Position': items[-1]['Position']}}
+
+    # Act
+    response = client.get("/changes", params={'limit': 2})
+
+    # Assert
+    data = response.json()
+    assert (len(data['changes']), data['more'], data['next_token']) == (2, True, items[1]['Position']), \
+        "Get Changes: Expected two changes and the token of the second, got {}".format(data)
+
+def test_feed_spreads_items_over_shards():
+    # Act
+    feeds = [changes.feed('Node', {'UniqueName': 'us01vlbase{:04d}.saas-n.com'.format(i)}) for i in range(1000)]
+
+    # Assert
+    # Every change of one item lands in the same partition, and no partition
+    # takes much more than its share
+    assert feeds == [changes.feed('Node', {'UniqueName': 'us01vlbase{:04d}.saas-n.com'.format(i)}) for i in range(1000)], \
+        "Feed: Expected the partition of an item to be stable"
+    counts = {name: feeds.count(name) for name in set(feeds)}
+    assert set(counts) == {'changes#{}'.format(shard) for shard in range(changes.shards)}, \
+        "Feed: Expected every partition to be used, got {}".format(counts)
+    assert max(counts.values()) < 2 * 1000 / changes.shards, \
+        "Feed: Expected an even spread, got {}".format(counts)
+
+def test_get_changes_merges_shards(mock_dynamodb, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(changes, 'shards', 3)
+    positions = ['16999999{:05d}-{:040d}-Node'.format(i, i) for i in range(6)]
+    logged = {'changes#{}'.format(shard): [
+        {'Position': position, 'Table': 'Node', 'Event': 'INSERT', 'Keys': {'UniqueName': position}}
+        for position in positions[shard::3]
+    ] for shard in range(3)}
+
+    def query(KeyConditionExpression, Limit):
+        feed, position = (condition.get_expression() for condition in KeyConditionExpression.get_expression()['values'])
+        low = position['values'][1] if position['operator'] == 'BETWEEN' else ''
+        return {'Items': [item for item in logged[feed['values'][1]] if item['Position'] >= low][:Limit]}
+    mock_dynamodb.query.side_effect = query
+
+    # Act
+    first = client.get("/changes", params={'limit': 4}).json()
+    rest = client.get("/changes", params={'limit': 4, 'since': first['next_token']}).json()
+
+    # Assert
+    assert [change['token'] for change in first['changes']] == positions[:4] and first['more'], \
+        "Get Changes: Expected the first four changes of all partitions in order, got {}".format(first)
+    assert [change['token'] for change in rest['changes']] == positions[4:] and not rest['more'], \
+        "Get Changes: Expected the remaining changes, got {}".format(rest)
+    assert mock_dynamodb.query.call_count == 6, \
+        "Get Changes: Expected one query per partition and call, got {}".format(mock_dynamodb.query.call_count)
+
+def test_get_changes_rejects_bad_and_expired_tokens(mock_dynamodb):
+    # Act
+    invalid = client.get("/changes", params={'since': 'yesterday'})
+    expired = client.get("/changes", params={'since': '1600000000000'})
+
+    # Assert
+    assert invalid.status_code == 400, \
+        "Get Changes: Expected status code 400, got {}".format(invalid.status_code)
+    assert expired.status_code == 410, \
+        "Get Changes: Expected status code 410, got {}".format(expired.status_code)
+    mock_dynamodb.query.assert_not_called()
+
+def test_sync_caches_notifies_subscribers(mock_dynamodb, monkeypatch):
+    # Arrange
+    cache = MagicMock(ttl=60.0)
+    monkeypatch.setattr(changes, 'subscribers', {'NodeGroup': [(cache, lambda keys: keys['Name'])]})
+    monkeypatch.setattr(changes, 'poll_interval', 5.0)
+    monkeypatch.setattr(changes, '_synced_to', None)
+    monkeypatch.setattr(changes, '_synced_at', 0.0)
+    mock_dynamodb.query.return_value = {'Items': [
+        {'Position': '1699999997000-0000000000000000000000000000000000000001-NodeGroup', 'Table': 'NodeGroup',
+         'Event': 'MODIFY', 'Keys': {'Name': 'BT Base Server'}},
+    ]}
+
+    # Act
+    changes.sync_caches(mock_dynamodb)
+    first_sync_queries = mock_dynamodb.query.call_count
+    monkeypatch.setattr(changes, '_synced_at', 0.0)
+    monkeypatch.setattr(changes, 'now_ms', lambda: 1700000005000)
+    changes.sync_caches(mock_dynamodb)
+    changes.sync_caches(mock_dynamodb)
+
+    # Assert
+    # The first sync only records where the log stands; the second applies
+    # the changes since, and the third is not due yet
+    assert first_sync_queries == 0, \
+        "Sync Caches: Expected the first sync not to read the log, it queried {} times".format(first_sync_queries)
+    cache.invalidate.assert_called_once_with('BT Base Server')
+    cache.clear.assert_not_called()
+    mock_dynamodb.query.assert_called_once()
+    # Only the changes of subscribed tables are read
+    assert mock_dynamodb.query.call_args.kwargs['FilterExpression'] == Attr('Table').is_in(['NodeGroup'])
+
+def test_sync_caches_clears_instead_of_long_replays(mock_dynamodb, monkeypatch):
+    # Arrange
+    cache = MagicMock(ttl=60.0)
+    monkeypatch.setattr(changes, 'subscribers', {'NodeGroup': [(cache, lambda keys: keys['Name'])]})
+    monkeypatch.setattr(changes, 'poll_interval', 5.0)
+    monkeypatch.setattr(changes, 'sync_limit', 2)
+    mock_dynamodb.query.return_value = {'Items': [
+        {'Position': '1699999997000-{:040d}-NodeGroup'.format(i), 'Table': 'NodeGroup',
+         'Event': 'MODIFY', 'Keys': {'Name': 'BT Group {}'.format(i)}} for i in range(3)
+    ]}
+
+    # Act
+    # Three changes behind, one more than the limit
+    monkeypatch.setattr(changes, '_synced_to', '1699999990000')
+    monkeypatch.setattr(changes, '_synced_at', 0.0)
+    changes.sync_caches(mock_dynamodb)
+    backlog_queries = mock_dynamodb.query.call_count
+    # Two minutes behind, longer than the TTL
+    monkeypatch.setattr(changes, '_synced_to', '1699999878000')
+    monkeypatch.setattr(changes, '_synced_at', 0.0)
+    changes.sync_caches(mock_dynamodb)
+
+    # Assert
+    assert cache.clear.call_count == 2, \
+        "Sync Caches: Expected both syncs to clear the cache, got {}".format(cache.clear.call_count)
+    cache.invalidate.assert_not_called()
+    assert mock_dynamodb.query.call_count == backlog_queries == 1, \
+        "Sync Caches: Expected a gap longer than the TTL to skip the read"
+    assert mock_dynamodb.query.call_args.kwargs['Limit'] == 3
+
+def test_sync_caches_without_subscribers_reads_nothing(mock_dynamodb, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(changes, 'subscribers', {})
+    monkeypatch.setattr(changes, 'poll_interval', 5.0)
+    monkeypatch.setattr(changes, '_synced_to', '1699999990000')
+    monkeypatch.setattr(changes, '_synced_at', 0.0)
+
+    # Act
+    changes.sync_caches(mock_dynamodb)
+
+    # Assert
+    mock_dynamodb.query.assert_not_called()
+    assert changes._synced_to == '1699999998000', "Sync Caches: Expected the sync to move on"
+
+def test_sync_skipped_while_breaker_is_open(mock_dynamodb, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(changes, 'subscribers', {'NodeGroup': [(MagicMock(ttl=60.0), lambda keys: keys['Name'])]})
+    breaker = dynamo.CircuitBreaker(threshold=1, cooldown=30)
+    breaker.record(True)
+    monkeypatch.setattr(dynamo, 'breakers', {'ChangeLog': breaker})
+    monkeypatch.setattr(changes, 'poll_interval', 5.0)
+    monkeypatch.setattr(changes, '_synced_to', '1699999990000')
+    monkeypatch.setattr(changes, '_synced_at', 0.0)
+
+    # Act
+    asyncio.run(changes.sync())
+
+    # Assert
+    mock_dynamodb.query.assert_not_called()
+    assert changes._synced_to == '1699999990000', "Sync: Expected the skipped changes to be replayed later"
+
+def test_failed_sync_does_not_fail_the_read(mock_dynamodb, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(changes, 'subscribers', {'NodeGroup': [(MagicMock(ttl=60.0), lambda keys: keys['Name'])]})
+    monkeypatch.setattr(dynamo, 'breakers', {})
+    monkeypatch.setattr(changes, 'poll_interval', 5.0)
+    monkeypatch.setattr(changes, '_synced_to', '1699999990000')
+    monkeypatch.setattr(changes, '_synced_at', 0.0)
+    mock_dynamodb.query.side_effect = ClientError(
+        {'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Rate exceeded'}}, 'Query'
+    )
+
+    # Act
+    asyncio.run(changes.sync())
+
+    # Assert
+    assert changes._synced_to == '1699999990000', "Sync: Expected the failed sync to be replayed later"
+    assert dynamo.breaker_for(None).failures == 1, "Sync: Expected the throttled sync to reach the breaker"
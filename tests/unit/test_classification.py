@@ -0,0 +1,96 @@
+import pytest
+from unittest.mock import patch
+from boto3.dynamodb.conditions import Key
+from lambdas.src.handlers import classification
+
+NODE_ARN = 'arn:aws:dynamodb:us-east-1:123456789012:table/Node/stream/2024-01-01T00:00:00.000'
+NODE_GROUP_ARN = 'arn:aws:dynamodb:us-east-1:123456789012:table/NodeGroup/stream/2024-01-01T00:00:00.000'
+
+def node(i, node_group_name='BT Base Server'):
+    return {
+        'UniqueName': 'us01vlbase{:02d}.saas-n.com'.format(i),
+        'NodeGroupName': node_group_name,
+        'EnvironmentName': 'master',
+        'PuppetClusterName': 'ny2-saas-n',
+        'Version': 1
+    }
+
+@pytest.fixture(scope='function')
+def mock_tables():
+    # Patch the three tables used in the classification module
+    with patch('lambdas.src.handlers.classification.node_table') as node_table, \
+         patch('lambdas.src.handlers.classification.node_group_table') as node_group_table, \
+         patch('lambdas.src.handlers.classification.classification_table') as classification_table:
+        classification_table.name = 'Classification'
+        classification_table.meta.client.batch_write_item.return_value = {'UnprocessedItems': {}}
+        node_group_table.query.return_value = {
+            'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {'bt_product': 'cea'}, 'Version': 4}]
+        }
+        yield node_table, node_group_table, classification_table
+
+def written(classification_table):
+    calls = classification_table.meta.client.batch_write_item.call_args_list
+    return [request for call in calls for request in call.kwargs['RequestItems']['Classification']]
+
+def test_classification_item():
+    # Act
+    item = classification.classification_item(
+        {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server',
+         'environment_name': 'master', 'puppet_cluster_name': 'ny2-saas-n'},
+        {'Name': 'BT Base Server', 'Class': 'roles::base_server', 'Parameters': '{"bt_product": "cea"}', 'Version': 4}
+    )
+
+    # Assert
+    assert item == {
+        'UniqueName': 'us01vlbase01.saas-n.com',
+        'NodeGroupName': 'BT Base Server',
+        'EnvironmentName': 'master',
+        'PuppetClusterName': 'ny2-saas-n',
+        'Class': 'roles::base_server',
+        'Parameters': {'bt_product': 'cea'},
+        'NodeGroupVersion': 4
+    }, "Classification Item: Unexpected item {}".format(item)
+
+def test_node_group_change_fans_out_to_members(mock_tables):
+    # Arrange
+    node_table, node_group_table, classification_table = mock_tables
+    node_table.query.side_effect = [
+        {'Items': [node(i) for i in range(20)], 'LastEvaluatedKey': {'UniqueName': 'us01vlbase19.saas-n.com'}},
+        {'Items': [node(i) for i in range(20, 30)]}
+    ]
+    record = {'eventName': 'MODIFY', 'eventSourceARN': NODE_GROUP_ARN,
+              'dynamodb': {'Keys': {'Name': {'S': 'BT Base Server'}, 'Class': {'S': 'roles::base_server'}}}}
+
+    # Act
+    result = classification.stream_handler({'Records': [record, record]}, None)
+
+    # Assert
+    assert result == {"classifications": 30}, "Stream Handler: Unexpected result {}".format(result)
+    assert node_table.query.call_args_list[0].kwargs == {
+        'IndexName': 'NodeGroupNameIndex', 'KeyConditionExpression': Key('NodeGroupName').eq('BT Base Server')
+    }
+    requests = written(classification_table)
+    assert len(requests) == 30 and all(request['PutRequest']['Item']['NodeGroupVersion'] == 4 for request in requests), \
+        "Stream Handler: Expected 30 documents at node group version 4, got {}".format(requests)
+    # The group is read once per batch, however many records name it
+    node_group_table.query.assert_called_once()
+
+def test_node_change_rebuilds_from_current_item(mock_tables):
+    # Arrange
+    node_table, node_group_table, classification_table = mock_tables
+    node_table.query.side_effect = lambda KeyConditionExpression: {
+        'Items': [node(1)] if KeyConditionExpression == Key('UniqueName').eq('us01vlbase01.saas-n.com') else []
+    }
+    records = [{'eventName': event, 'eventSourceARN': NODE_ARN,
+                'dynamodb': {'Keys': {'UniqueName': {'S': unique_name}, 'NodeGroupName': {'S': 'BT Base Server'}}}}
+               for event, unique_name in (('REMOVE', 'us01vlbase01.saas-n.com'), ('REMOVE', 'us01vlbase02.saas-n.com'))]
+
+    # Act
+    classification.stream_handler({'Records': records}, None)
+
+    # Assert
+    # us01vlbase01 was moved rather than deleted, so its document is kept
+    assert written(classification_table) == [
+        {'PutRequest': {'Item': classification.classification_item(node(1), node_group_table.query.return_value['Items'][0])}},
+        {'DeleteRequest': {'Key': {'UniqueName': 'us01vlbase02.saas-n.com'}}}
+    ], "Stream Handler: Unexpected requests {}".format(written(classification_table))
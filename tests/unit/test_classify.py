@@ -0,0 +1,198 @@
+import json
+from decimal import Decimal
+import yaml
+import zlib
+import pytest
+from unittest.mock import patch, MagicMock
+from fastapi.testclient import TestClient
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import Binary
+from lambdas.src.handlers.classify import app
+from lambdas.src.handlers.environment import environment_cache
+from lambdas.src.handlers.node_group import node_group_cache
+
+# Initialize the TestClient with FastAPI app
+client = TestClient(app)
+
+@pytest.fixture(scope='function')
+def mock_tables():
+    # Patch the three tables used in the classify module and start every
+    # test with empty lookup caches
+    node_group_cache.clear()
+    environment_cache.clear()
+    with patch('lambdas.src.handlers.classify.node_table') as node_table, \
+         patch('lambdas.src.handlers.classify.node_group_table') as node_group_table, \
+         patch('lambdas.src.handlers.classify.classification_table') as classification_table, \
+         patch('lambdas.src.handlers.classify.environment_table') as environment_table:
+        node_table.query.return_value = {
+            'Items': [{
+                'UniqueName': 'us01vlbase01.saas-n.com',
+                'NodeGroupName': 'BT Base Server',
+                'EnvironmentName': 'master',
+                'PuppetClusterName': 'ny2-saas-n'
+            }]
+        }
+        node_group_table.query.return_value = {
+            'Items': [{
+                'Name': 'BT Base Server',
+                'Class': 'roles::base_server',
+                'ParameterSet': {'bt_product': 'cea'}
+            }]
+        }
+        environment_table.get_item.return_value = {
+            'Item': {'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}
+        }
+        # No materialized document yet, so classify joins the tables itself
+        classification_table.get_item.return_value = {}
+        yield node_table, node_group_table, environment_table
+
+def test_classify_node_json(mock_tables):
+    node_table, node_group_table, environment_table = mock_tables
+
+    # Act
+    response = client.get("/classify/us01vlbase01.saas-n.com?format=json")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Classify Node: Expected status code 200, got {}".format(response.status_code)
+    assert response.json() == {
+        'classes': {'roles::base_server': {}},
+        'parameters': {'bt_product': 'cea', 'puppet_cluster': 'ny2-saas-n'},
+        'environment': 'master'
+    }, "Classify Node: Unexpected classification {}".format(response.json())
+
+    node_table.query.assert_called_once_with(
+        KeyConditionExpression=Key('UniqueName').eq('us01vlbase01.saas-n.com')
+    )
+    node_group_table.query.assert_called_once_with(
+        KeyConditionExpression=Key('Name').eq('BT Base Server')
+    )
+    environment_table.get_item.assert_called_once_with(
+        Key={'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}
+    )
+
+def test_classify_node_yaml(mock_tables):
+    # Act
+    response = client.get("/classify/us01vlbase01.saas-n.com")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Classify Node: Expected status code 200, got {}".format(response.status_code)
+    assert response.headers['content-type'].startswith('application/x-yaml')
+    assert yaml.safe_load(response.text) == {
+        'classes': {'roles::base_server': {}},
+        'parameters': {'bt_product': 'cea', 'puppet_cluster': 'ny2-saas-n'},
+        'environment': 'master'
+    }, "Classify Node: Unexpected classification {}".format(response.text)
+
+def test_classify_node_not_found(mock_tables):
+    node_table, node_group_table, environment_table = mock_tables
+    node_table.query.return_value = {'Items': []}
+
+    # Act
+    response = client.get("/classify/missing.saas-n.com")
+
+    # Assert
+    assert response.status_code == 404, \
+        "Classify Node: Expected status code 404, got {}".format(response.status_code)
+    node_group_table.query.assert_not_called()
+    environment_table.get_item.assert_not_called()
+
+def test_classify_node_with_legacy_attributes(mock_tables):
+    node_table, node_group_table, environment_table = mock_tables
+    # Nodes written before the attribute rename use lowercase names
+    node_table.query.return_value = {
+        'Items': [{
+            'UniqueName': 'us01vlbase01.saas-n.com',
+            'NodeGroupName': 'BT Base Server',
+            'environment_name': 'master',
+            'puppet_cluster_name': 'ny2-saas-n'
+        }]
+    }
+
+    # Act
+    response = client.get("/classify/us01vlbase01.saas-n.com?format=json")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Classify Node: Expected status code 200, got {}".format(response.status_code)
+    environment_table.get_item.assert_called_once_with(
+        Key={'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}
+    )
+
+def test_classify_node_uses_lookup_caches(mock_tables):
+    node_table, node_group_table, environment_table = mock_tables
+
+    # Act
+    first = client.get("/classify/us01vlbase01.saas-n.com?format=json")
+    second = client.get("/classify/us01vlbase01.saas-n.com?format=json")
+
+    # Assert
+    assert first.json() == second.json(), \
+        "Classify Node: Expected cached lookups to give the same classification"
+    assert node_table.query.call_count == 2
+    node_group_table.query.assert_called_once()
+    environment_table.get_item.assert_called_once()
+
+def test_classify_node_yaml_with_numeric_parameters(mock_tables):
+    node_table, node_group_table, environment_table = mock_tables
+    node_group_table.query.return_value = {
+        'Items': [{
+            'Name': 'BT Base Server',
+            'Class': 'roles::base_server',
+            'ParameterSet': {'bt_product': 'cea', 'bt_workers': Decimal('4'), 'bt_weight': Decimal('0.5')}
+        }]
+    }
+
+    # Act
+    response = client.get("/classify/us01vlbase01.saas-n.com")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Classify Node: Expected status code 200, got {}".format(response.status_code)
+    assert yaml.safe_load(response.text)['parameters'] == {
+        'bt_product': 'cea', 'bt_workers': 4, 'bt_weight': 0.5, 'puppet_cluster': 'ny2-saas-n'
+    }, "Classify Node: Unexpected parameters {}".format(response.text)
+
+def test_classify_node_with_legacy_parameters(mock_tables):
+    node_table, node_group_table, environment_table = mock_tables
+    node_group_table.query.return_value = {
+        'Items': [{
+            'Name': 'BT Base Server',
+            'Class': 'roles::base_server',
+            'Parameters': json.dumps({'bt_product': 'cea'})
+        }]
+    }
+
+    # Act
+    response = client.get("/classify/us01vlbase01.saas-n.com?format=json")
+
+    # Assert
+    assert response.json()['parameters'] == {'bt_product': 'cea', 'puppet_cluster': 'ny2-saas-n'}, \
+        "Classify Node: Expected legacy parameters to be decoded, got {}".format(response.json())
+
+def test_classify_node_reads_materialized_document(mock_tables):
+    node_table, node_group_table, environment_table = mock_tables
+    compressed = Binary(zlib.compress(json.dumps({'bt_product': 'lob'}).encode()))
+
+    # Act
+    with patch('lambdas.src.handlers.classify.classification_table') as classification_table:
+        classification_table.get_item.return_value = {'Item': {
+            'UniqueName': 'us01vlbase01.saas-n.com',
+            'NodeGroupName': 'BT Base Server',
+            'EnvironmentName': 'master',
+            'PuppetClusterName': 'ny2-saas-n',
+            'Class': 'roles::base_server',
+            'Parameters': compressed
+        }}
+        response = client.get("/classify/us01vlbase01.saas-n.com?format=json")
+
+    # Assert
+    assert response.json() == {
+        'classes': {'roles::base_server': {}},
+        'parameters': {'bt_product': 'lob', 'puppet_cluster': 'ny2-saas-n'},
+        'environment': 'master'
+    }, "Classify Node: Unexpected classification {}".format(response.json())
+    classification_table.get_item.assert_called_once_with(Key={'UniqueName': 'us01vlbase01.saas-n.com'})
+    node_table.query.assert_not_called()
+    node_group_table.query.assert_not_called()
@@ -0,0 +1,31 @@
+import pytest
+from benchmarks.bench_cold_start import HANDLERS, import_breakdown, profile
+
+@pytest.mark.parametrize('name', sorted(HANDLERS))
+def test_import_defers_dynamodb_client(name):
+    # Act
+    result = profile('lambdas.src.handlers.' + name)
+
+    # Assert
+    assert not result['client_built'], \
+        "Cold Start: Expected {} not to build a DynamoDB client at import".format(name)
+    assert not result['resource_layer_loaded'], \
+        "Cold Start: Expected {} not to load the boto3 resource layer".format(name)
+    assert 'fastapi' in result['packages'], \
+        "Cold Start: Expected an import breakdown, got {}".format(result['packages'])
+
+def test_import_breakdown_sums_self_time_per_package():
+    # Arrange
+    output = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       300 |        300 |   botocore.compat",
+        "import time:       200 |        500 | botocore",
+        "import time:      1000 |       1000 | fastapi",
+    ])
+
+    # Act
+    packages = import_breakdown(output)
+
+    # Assert
+    assert packages == {'botocore': 0.5, 'fastapi': 1.0}, \
+        "Import Breakdown: Unexpected totals {}".format(packages)
@@ -0,0 +1,359 @@
+import asyncio
+import json
+import threading
+import time
+import botocore.session
+import pytest
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+from lambdas.src.handlers import dynamo, metrics
+
+def test_run_offloads_to_pool():
+    # Act
+    thread_name = asyncio.run(dynamo.run(lambda: threading.current_thread().name))
+
+    # Assert
+    assert thread_name.startswith('dynamodb'), \
+        "Run: Expected call to execute on the DynamoDB pool, ran on '{}'".format(thread_name)
+
+def test_run_passes_arguments():
+    # Act
+    result = asyncio.run(dynamo.run(dict, Key={'UniqueName': 'us01vlbase01.saas-n.com'}))
+
+    # Assert
+    assert result == {'Key': {'UniqueName': 'us01vlbase01.saas-n.com'}}, \
+        "Run: Expected keyword arguments to be forwarded, got {}".format(result)
+
+def test_run_overlaps_blocking_calls():
+    async def two_calls():
+        await asyncio.gather(dynamo.run(time.sleep, 0.2), dynamo.run(time.sleep, 0.2))
+
+    # Act
+    start = time.perf_counter()
+    asyncio.run(two_calls())
+    elapsed = time.perf_counter() - start
+
+    # Assert
+    assert elapsed < 0.35, \
+        "Run: Expected blocking calls to overlap, took {:.2f}s".format(elapsed)
+
+def throttling_error():
+    return ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Rate exceeded'}}, 'Query')
+
+def test_run_raises_503_when_throttled(monkeypatch):
+    # Arrange
+    monkeypatch.setattr(dynamo, 'breakers', {})
+    query = MagicMock(side_effect=throttling_error())
+
+    # Act
+    with pytest.raises(dynamo.Throttled) as raised:
+        asyncio.run(dynamo.run(query))
+
+    # Assert
+    assert raised.value.status_code == 503, \
+        "Run: Expected status code 503, got {}".format(raised.value.status_code)
+    assert raised.value.headers == {'Retry-After': '5'}, \
+        "Run: Expected Retry-After of the breaker cooldown, got {}".format(raised.value.headers)
+
+def test_circuit_breaker_fails_fast_while_open(monkeypatch):
+    # Arrange
+    monkeypatch.setattr(dynamo, 'breakers', {None: dynamo.CircuitBreaker(threshold=2, cooldown=30)})
+    query = MagicMock(side_effect=throttling_error())
+    for _ in range(2):
+        with pytest.raises(dynamo.Throttled):
+            asyncio.run(dynamo.run(query))
+
+    # Act
+    with pytest.raises(dynamo.Throttled):
+        asyncio.run(dynamo.run(query))
+
+    # Assert
+    assert query.call_count == 2, \
+        "Circuit Breaker: Expected no call while open, got {} calls".format(query.call_count)
+
+def test_circuit_breaker_closes_after_successful_probe(monkeypatch):
+    # Arrange
+    breaker = dynamo.CircuitBreaker(threshold=1, cooldown=30)
+    monkeypatch.setattr(dynamo, 'breakers', {None: breaker})
+    with pytest.raises(dynamo.Throttled):
+        asyncio.run(dynamo.run(MagicMock(side_effect=throttling_error())))
+    breaker.opened_at -= 30
+
+    # Act
+    result = asyncio.run(dynamo.run(dict, Count=1))
+
+    # Assert
+    assert result == {'Count': 1}, "Circuit Breaker: Expected the probe to go through, got {}".format(result)
+    assert breaker.opened_at is None and breaker.allow(), "Circuit Breaker: Expected the breaker to close"
+
+def test_circuit_breaker_is_open_leaves_the_probe():
+    # Arrange
+    breaker = dynamo.CircuitBreaker(threshold=1, cooldown=30)
+    breaker.record(True)
+    open_during_cooldown = breaker.is_open()
+    breaker.opened_at -= 30
+
+    # Act
+    open_after_cooldown = breaker.is_open()
+
+    # Assert
+    assert open_during_cooldown and not open_after_cooldown, \
+        "Circuit Breaker: Expected is_open() only during the cooldown"
+    assert breaker.allow() and breaker.is_open(), \
+        "Circuit Breaker: Expected the probe to still be available, and open while it runs"
+
+def test_circuit_breakers_are_per_table(monkeypatch):
+    # Arrange
+    monkeypatch.setattr(dynamo, 'breakers', {})
+    monkeypatch.setattr(dynamo, 'breaker_threshold', 2)
+    low_level = MagicMock()
+    low_level.query.side_effect = lambda TableName, **kwargs: (_ for _ in ()).throw(throttling_error()) \
+        if TableName == 'Node' else {'Items': []}
+    monkeypatch.setattr(dynamo, 'client', lambda: low_level)
+    node_table, node_group_table = dynamo.Table('Node'), dynamo.Table('NodeGroup')
+    for _ in range(2):
+        with pytest.raises(dynamo.Throttled):
+            asyncio.run(dynamo.run(node_table.query))
+
+    # Act
+    with pytest.raises(dynamo.Throttled):
+        asyncio.run(dynamo.run(node_table.query))
+    result = asyncio.run(dynamo.run(node_group_table.query))
+
+    # Assert
+    assert low_level.query.call_count == 3, \
+        "Circuit Breaker: Expected only the throttled table to fail fast, got {} calls".format(low_level.query.call_count)
+    assert result == {'Items': []}, "Circuit Breaker: Expected the other table to be read, got {}".format(result)
+
+def test_write_batch_throttling_reaches_breaker(monkeypatch):
+    # Arrange
+    monkeypatch.setattr(dynamo, 'breakers', {})
+    low_level = MagicMock()
+    low_level.batch_write_item.side_effect = lambda RequestItems: {'UnprocessedItems': RequestItems}
+    monkeypatch.setattr(dynamo, 'client', lambda: low_level)
+    node_table = dynamo.Table('Node')
+    requests = [{'DeleteRequest': {'Key': {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}}}]
+
+    # Act
+    errors = asyncio.run(dynamo.run(dynamo.write_batch, node_table, requests, 2, 0))
+
+    # Assert
+    # The items are reported, and the call counts as throttled
+    assert errors == ["Unprocessed after 2 attempts"], "Write Batch: Unexpected errors {}".format(errors)
+    assert dynamo.breaker_for('Node').failures == 1, \
+        "Write Batch: Expected the throttled batch to be counted, got {}".format(dynamo.breaker_for('Node').failures)
+    assert dynamo.breaker_for(None).failures == 0, "Write Batch: Expected other breakers to be untouched"
+
+def test_transaction_chunks_keep_units_whole():
+    # Arrange
+    units = [[{'Put': {}}] * 2 for _ in range(120)] + [[{'Put': {}}] * 3]
+
+    # Act
+    chunks = dynamo.transaction_chunks(units)
+
+    # Assert
+    assert [len(chunk) for chunk in chunks] == [50, 50, 21], \
+        "Transaction Chunks: Expected chunks of at most 100 actions, got {}".format([len(chunk) for chunk in chunks])
+    assert [i for chunk in chunks for i in chunk] == list(range(121)), "Transaction Chunks: Expected every unit once"
+
+def test_client_hooks_record_retries_throttles_and_capacity():
+    # Arrange
+    metrics.reset()
+    request = metrics.RequestMetrics({'route': SimpleNamespace(path='/nodes/{unique_name}')})
+    token = metrics.current_request.set(request)
+
+    # Act
+    try:
+        dynamo.count_throttle(response=(None, {'Error': {'Code': 'ProvisionedThroughputExceededException'}}), attempts=1)
+        dynamo.count_throttle(response=(None, {'Items': []}), attempts=2)
+        dynamo.record_call(parsed={'Items': [], 'ConsumedCapacity': {'TableName': 'Node', 'CapacityUnits': 0.5},
+                                   'ResponseMetadata': {'RetryAttempts': 1}})
+        dynamo.record_call(parsed={'ConsumedCapacity': [{'TableName': 'Node', 'CapacityUnits': 2.0},
+                                                        {'TableName': 'NodeGroup', 'CapacityUnits': 1.0}]})
+    finally:
+        metrics.current_request.reset(token)
+
+    # Assert
+    counters = metrics.snapshot()
+    assert counters == {'/nodes/{unique_name}': {'retries': 1, 'throttles': 1}}, \
+        "Metrics: Unexpected counters {}".format(counters)
+    assert (request.calls, request.capacity) == (2, 3.5), \
+        "Metrics: Expected 2 calls and 3.5 capacity units, got {} and {}".format(request.calls, request.capacity)
+
+def test_request_capacity_is_asked_for_where_supported():
+    # Arrange
+    model = botocore.session.get_session().get_service_model('dynamodb')
+    query, explicit, listing = {}, {'ReturnConsumedCapacity': 'NONE'}, {}
+
+    # Act
+    dynamo.request_capacity(params=query, model=model.operation_model('Query'))
+    dynamo.request_capacity(params=explicit, model=model.operation_model('Query'))
+    dynamo.request_capacity(params=listing, model=model.operation_model('ListTables'))
+
+    # Assert
+    assert query == {'ReturnConsumedCapacity': 'TOTAL'}, "Request Capacity: Unexpected params {}".format(query)
+    assert explicit == {'ReturnConsumedCapacity': 'NONE'}, "Request Capacity: Expected an explicit value to be kept"
+    assert listing == {}, "Request Capacity: Expected ListTables to be left alone, got {}".format(listing)
+
+def test_write_batch_reports_items_left_unprocessed():
+    # Arrange
+    table = MagicMock()
+    table.name = 'Node'
+    request = {'PutRequest': {'Item': {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}}}
+    table.meta.client.batch_write_item.return_value = {'UnprocessedItems': {'Node': [request]}}
+
+    # Act
+    errors = dynamo.write_batch(table, [request], max_attempts=3, base_delay=0)
+
+    # Assert
+    assert errors == ['Unprocessed after 3 attempts'], \
+        "Write Batch: Expected request to fail after 3 attempts, got {}".format(errors)
+    assert table.meta.client.batch_write_item.call_count == 3
+
+def test_get_batch_retries_unprocessed_keys():
+    # Arrange
+    table = MagicMock()
+    table.name = 'Node'
+    first = {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}
+    second = {'UniqueName': 'us01vlbase02.saas-n.com', 'NodeGroupName': 'BT Base Server'}
+    table.meta.client.batch_get_item.side_effect = [
+        {'Responses': {'Node': [first]}, 'UnprocessedKeys': {'Node': {'Keys': [second]}}},
+        {'Responses': {'Node': [second]}, 'UnprocessedKeys': {}}
+    ]
+
+    # Act
+    items = dynamo.get_batch(table, [first, second], base_delay=0)
+
+    # Assert
+    assert items == [first, second], \
+        "Get Batch: Expected both items, got {}".format(items)
+    retry = table.meta.client.batch_get_item.call_args_list[1]
+    assert retry.kwargs == {'RequestItems': {'Node': {'Keys': [second]}}}, \
+        "Get Batch: Expected only the unprocessed key to be resent, got {}".format(retry.kwargs)
+
+def test_get_batch_fails_on_keys_left_unprocessed():
+    # Arrange
+    table = MagicMock()
+    table.name = 'Node'
+    key = {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}
+    table.meta.client.batch_get_item.return_value = {'Responses': {'Node': []}, 'UnprocessedKeys': {'Node': {'Keys': [key]}}}
+
+    # Act / Assert
+    with pytest.raises(HTTPException) as error:
+        dynamo.get_batch(table, [key], max_attempts=3, base_delay=0)
+    assert error.value.status_code == 503
+    assert table.meta.client.batch_get_item.call_count == 3
+
+def test_parallel_scan_reads_every_segment():
+    # Arrange
+    # Each of the 3 segments returns two pages of two items
+    def scan(Segment, TotalSegments, ExclusiveStartKey=None):
+        page = 1 if ExclusiveStartKey else 0
+        response = {'Items': [{'UniqueName': 'node-{}-{}-{}'.format(Segment, page, i)} for i in range(2)]}
+        if not page:
+            response['LastEvaluatedKey'] = {'UniqueName': 'node-{}-0-1'.format(Segment)}
+        return response
+    table = MagicMock()
+    table.scan.side_effect = scan
+
+    # Act
+    items = list(dynamo.parallel_scan(table, 3))
+
+    # Assert
+    assert len(items) == 12, "Parallel Scan: Expected 12 items, got {}".format(len(items))
+    assert len({item['UniqueName'] for item in items}) == 12, "Parallel Scan: Expected no duplicates"
+    assert {call.kwargs['Segment'] for call in table.scan.call_args_list} == {0, 1, 2}
+
+def test_parallel_scan_raises_segment_errors():
+    # Arrange
+    table = MagicMock()
+    table.scan.side_effect = RuntimeError('throttled')
+
+    # Act / Assert
+    try:
+        list(dynamo.parallel_scan(table, 2))
+    except RuntimeError as error:
+        assert str(error) == 'throttled'
+    else:
+        raise AssertionError("Parallel Scan: Expected the segment error to be raised")
+
+def test_table_forwards_calls_to_shared_client(monkeypatch):
+    # Arrange
+    low_level = MagicMock()
+    low_level.get_item.return_value = {'Item': {'UniqueName': 'us01vlbase01.saas-n.com'}}
+    monkeypatch.setattr(dynamo, '_client', low_level)
+    table = dynamo.Table('Node')
+
+    # Act
+    response = table.get_item(Key={'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'})
+
+    # Assert
+    assert response == {'Item': {'UniqueName': 'us01vlbase01.saas-n.com'}}
+    low_level.get_item.assert_called_once_with(
+        TableName='Node',
+        Key={'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}
+    )
+    assert table.meta.client is low_level, \
+        "Table: Expected meta.client to be the shared low-level client"
+
+def test_dumps_matches_json_encoding(monkeypatch):
+    # Arrange
+    items = [{
+        'UniqueName': 'us01vlbase01.saas-n.com', 'Version': Decimal('3'), 'Weight': Decimal('0.5'),
+        'Parameters': {'ntp::servers': ['10.0.0.1'], 'motd': 'Grüße', 'ports': {Decimal('443')}},
+    }]
+    expected = json.dumps(items, default=dynamo.json_default, sort_keys=True, separators=(',', ':'),
+                          ensure_ascii=False).encode()
+
+    # Act
+    fast = dynamo.dumps(items, sort_keys=True)
+    monkeypatch.setattr(dynamo, 'orjson', None)
+    fallback = dynamo.dumps(items, sort_keys=True)
+
+    # Assert
+    assert fast == expected, "Dumps: Unexpected body {}".format(fast)
+    assert fallback == expected, "Dumps: Expected the json fallback to match, got {}".format(fallback)
+
+def test_dumps_encodes_integers_beyond_64_bits():
+    # Act
+    body = dynamo.dumps({'Count': Decimal(2 ** 70)})
+
+    # Assert
+    assert json.loads(body) == {'Count': 2 ** 70}, "Dumps: Unexpected body {}".format(body)
+
+def test_run_or_stale_does_not_cache_reads_overlapping_a_write():
+    # Arrange
+    from lambdas.src.handlers.cache import TTLCache
+    cache = TTLCache(maxsize=8, ttl=60)
+    reading = threading.Event()
+    written = threading.Event()
+    versions = iter(['v1', 'v2'])
+
+    def read():
+        version = next(versions)
+        if version == 'v1':
+            # The first read sees the record before a write lands
+            reading.set()
+            written.wait(1)
+        return version
+
+    async def write_during_read():
+        first = asyncio.ensure_future(dynamo.run_or_stale(cache, 'BT Base Server', read))
+        await dynamo.run(reading.wait, 1)
+        cache.invalidate('BT Base Server')
+        # A miss after the write must not join the read that started before it
+        second = asyncio.ensure_future(dynamo.run_or_stale(cache, 'BT Base Server', read))
+        await asyncio.sleep(0.05)
+        written.set()
+        return await first, await second
+
+    # Act
+    first, second = asyncio.run(write_during_read())
+
+    # Assert
+    assert (first, second) == ('v1', 'v2'), "Run Or Stale: Unexpected reads {}".format((first, second))
+    assert cache.get('BT Base Server') == 'v2', \
+        "Run Or Stale: Expected the read after the write to be cached, got {}".format(cache.get('BT Base Server'))
@@ -0,0 +1,83 @@
+import json
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from lambdas.src.handlers.enc import app
+from lambdas.src.handlers.environment import environment_cache
+from lambdas.src.handlers.node_group import node_group_cache
+
+# Initialize the TestClient with the unified FastAPI app
+client = TestClient(app)
+
+@pytest.fixture(scope='function')
+def mock_tables():
+    # Patch every table the mounted routers use and start with empty caches
+    node_group_cache.clear()
+    environment_cache.clear()
+    with patch('lambdas.src.handlers.classify.node_table') as node_table, \
+         patch('lambdas.src.handlers.classify.node_group_table') as node_group_table, \
+         patch('lambdas.src.handlers.classify.classification_table') as classification_table, \
+         patch('lambdas.src.handlers.classify.environment_table') as environment_table, \
+         patch('lambdas.src.handlers.node_group.node_group_table', node_group_table):
+        node_table.query.return_value = {
+            'Items': [{
+                'UniqueName': 'us01vlbase01.saas-n.com',
+                'NodeGroupName': 'BT Base Server',
+                'EnvironmentName': 'master',
+                'PuppetClusterName': 'ny2-saas-n'
+            }]
+        }
+        node_group_table.query.return_value = {
+            'Items': [{
+                'Name': 'BT Base Server',
+                'Class': 'roles::base_server',
+                'Parameters': json.dumps({'bt_product': 'cea'})
+            }]
+        }
+        environment_table.get_item.return_value = {
+            'Item': {'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}
+        }
+        # No materialized document yet, so classify joins the tables itself
+        classification_table.get_item.return_value = {}
+        yield node_table, node_group_table, environment_table
+
+def test_healthcheck():
+    # Act
+    response = client.get("/healthcheck")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Healthcheck: Expected status code 200, got {}".format(response.status_code)
+    assert response.json() == {"status": "ok"}
+
+def test_mounts_every_router():
+    # Act
+    paths = app.openapi()["paths"]
+
+    # Assert
+    for path in ("/nodes/{unique_name}", "/nodegroup/{node_group_name}",
+                 "/environment/{environment_name}/{puppet_cluster_name}", "/classify/{unique_name}"):
+        assert path in paths, "Unified App: Expected route {} to be mounted".format(path)
+
+def test_node_group_update_invalidates_classify_cache(mock_tables):
+    node_table, node_group_table, environment_table = mock_tables
+    client.get("/classify/us01vlbase01.saas-n.com?format=json")
+
+    # Act
+    client.put("/nodegroup/BT Base Server", json={
+        'name': 'BT Base Server',
+        'class_': 'roles::base_server',
+        'parameters': {'bt_product': 'lob'}
+    })
+    node_group_table.query.return_value = {
+        'Items': [{
+            'Name': 'BT Base Server',
+            'Class': 'roles::base_server',
+            'Parameters': json.dumps({'bt_product': 'lob'})
+        }]
+    }
+    response = client.get("/classify/us01vlbase01.saas-n.com?format=json")
+
+    # Assert
+    assert response.json()['parameters']['bt_product'] == 'lob', \
+        "Unified App: Expected the update to be visible to classify, got {}".format(response.json())
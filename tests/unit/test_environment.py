@@ -3,7 +3,7 @@ import pytest
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
 from boto3.dynamodb.conditions import Key
-from lambdas.src.handlers.environment import app
+from lambdas.src.handlers.environment import app, environment_cache
 
 # Initialize the TestClient with FastAPI app
 client = TestClient(app)
@@ -11,6 +11,8 @@ client = TestClient(app)
 @pytest.fixture(scope='function')
 def mock_dynamodb():
     # Patch the environment_table used in the FastAPI module
+    # and start every test with an empty environment cache
+    environment_cache.clear()
     with patch('lambdas.src.handlers.environment.environment_table') as mock_table:
         yield mock_table
 
@@ -88,3 +90,69 @@ def test_delete_environment(mock_dynamodb):
     mock_dynamodb.delete_item.assert_called_once_with(
         Key={'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}
     )
+
+def test_read_environment_is_cached(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}]
+    }
+
+    # Act
+    client.get("/environment/master/ny2-saas-n")
+    response = client.get("/environment/master/ny2-saas-n")
+
+    # Assert
+    assert response.json() == [{'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}], \
+        "Read Environment: Unexpected cached response {}".format(response.json())
+    mock_dynamodb.query.assert_called_once()
+    stats = client.get("/cache/environment").json()
+    assert (stats['hits'], stats['misses']) == (1, 1), \
+        "Environment Cache: Expected 1 hit and 1 miss, got {}".format(stats)
+
+def test_delete_environment_invalidates_cache(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}]
+    }
+    client.get("/environment/master/ny2-saas-n")
+
+    # Act
+    client.delete("/environment/master/ny2-saas-n")
+    client.get("/environment/master/ny2-saas-n")
+
+    # Assert
+    assert mock_dynamodb.query.call_count == 2, \
+        "Read Environment: Expected a fresh query after delete, got {} queries".format(mock_dynamodb.query.call_count)
+
+def test_get_all_environments(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.scan.return_value = {
+        'Items': [{'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}]
+    }
+
+    # Act
+    response = client.get("/environment/")
+
+    # Assert
+    assert response.status_code == 200, \
+        "List Environments: Expected status code 200, got {}".format(response.status_code)
+    assert response.json() == {
+        'items': [{'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}],
+        'next_cursor': None
+    }, "List Environments: Unexpected page {}".format(response.json())
+    mock_dynamodb.scan.assert_called_once_with(Limit=100)
+
+def test_read_environment_not_modified(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'EnvironmentName': 'master', 'PuppetClusterName': 'ny2-saas-n'}]
+    }
+    first = client.get("/environment/master/ny2-saas-n")
+
+    # Act
+    response = client.get("/environment/master/ny2-saas-n", headers={'If-None-Match': 'W/"other", ' + first.headers['ETag']})
+
+    # Assert
+    assert response.status_code == 304, \
+        "Read Environment: Expected status code 304, got {}".format(response.status_code)
+    mock_dynamodb.query.assert_called_once()
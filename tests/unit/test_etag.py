@@ -0,0 +1,50 @@
+from decimal import Decimal
+from fastapi import HTTPException
+from lambdas.src.handlers import etag
+
+def test_represent_is_independent_of_key_order():
+    # Act
+    first = etag.represent([{'Name': 'BT Base Server', 'Parameters': {'a': 1, 'b': Decimal('2')}}])
+    second = etag.represent([{'Parameters': {'b': 2, 'a': 1}, 'Name': 'BT Base Server'}])
+
+    # Assert
+    assert first.etag == second.etag, \
+        "Represent: Expected equal content to give the same ETag, got {} and {}".format(first.etag, second.etag)
+
+def test_etag_matches():
+    # Arrange
+    tag = '"abc"'
+
+    # Act / Assert
+    assert etag.etag_matches('"abc"', tag)
+    assert etag.etag_matches('W/"abc"', tag)
+    assert etag.etag_matches('"xyz", "abc"', tag)
+    assert etag.etag_matches('*', tag)
+    assert not etag.etag_matches('"xyz"', tag)
+    assert not etag.etag_matches(None, tag)
+
+def test_represent_uses_version():
+    # Act
+    representation = etag.represent([{'Name': 'BT Base Server', 'Version': Decimal(12)}])
+
+    # Assert
+    assert representation.etag == '"v12"', \
+        "Represent: Expected the Version as ETag, got {}".format(representation.etag)
+
+def test_expected_version():
+    # Arrange
+    item = {'Name': 'BT Base Server', 'Version': Decimal(3)}
+
+    # Act / Assert
+    assert etag.expected_version(None, item) == 3
+    assert etag.expected_version('"v3"', item) == 3
+    assert etag.expected_version('W/"v3"', item) == 3
+    assert etag.expected_version('*', {}) is None
+    for if_match, status in (('"v2"', 409), ('"abc"', 400)):
+        try:
+            etag.expected_version(if_match, item)
+        except HTTPException as error:
+            assert error.status_code == status, \
+                "Expected version: Expected {} for {}, got {}".format(status, if_match, error.status_code)
+        else:
+            raise AssertionError("Expected version: Expected {} to be rejected".format(if_match))
@@ -0,0 +1,49 @@
+import json
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from lambdas.src.handlers import metrics
+from lambdas.src.handlers.node import app
+
+# Initialize the TestClient with FastAPI app
+client = TestClient(app)
+
+def test_request_timing_adds_server_timing_and_emf(capsys):
+    # Arrange
+    with patch('lambdas.src.handlers.node.node_table') as mock_table:
+        mock_table.query.return_value = {
+            'Items': [{'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}]
+        }
+
+        # Act
+        response = client.get("/nodes/us01vlbase01.saas-n.com")
+
+    # Assert
+    stages = [part.split(';')[0] for part in response.headers['Server-Timing'].split(', ')]
+    assert stages == ['dynamodb', 'serialize', 'total'], \
+        "Request Timing: Unexpected Server-Timing stages {}".format(stages)
+    record = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert (record['Route'], record['Method'], record['Status']) == ('/nodes/{unique_name}', 'GET', 200), \
+        "Request Timing: Unexpected EMF properties {}".format(record)
+    names = [metric['Name'] for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']]
+    assert names[:3] == ['Latency', 'DynamodbTime', 'SerializeTime'], \
+        "Request Timing: Unexpected EMF metrics {}".format(names)
+
+def test_request_timing_records_error_status(capsys):
+    # Act
+    response = client.get("/nodes/us01vlbase01.saas-n.com/unknown")
+
+    # Assert
+    record = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert (record['Route'], record['Status']) == ('none', response.status_code), \
+        "Request Timing: Unexpected EMF properties {}".format(record)
+
+def test_emf_can_be_turned_off(capsys, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(metrics, 'emf_enabled', False)
+
+    # Act
+    response = client.get("/healthcheck")
+
+    # Assert
+    assert 'Server-Timing' in response.headers, "Request Timing: Expected the Server-Timing header to stay"
+    assert capsys.readouterr().out == '', "Request Timing: Expected no EMF line"
@@ -1,8 +1,11 @@
+import base64
 import json
 import pytest
+from decimal import Decimal
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 
 # Import the FastAPI app
 from lambdas.src.handlers.node import app
@@ -13,7 +16,11 @@ client = TestClient(app)
 @pytest.fixture(scope='function')
 def mock_dynamodb():
     # Patch the node_table used in the node_handler module
-    with patch('lambdas.src.handlers.node.node_table') as mock_table:
+    # and pin the clock new records take their first Version from
+    with patch('lambdas.src.handlers.node.node_table') as mock_table, \
+            patch('lambdas.src.handlers.node.guard_table') as mock_guard_table, \
+            patch('lambdas.src.handlers.dynamo.initial_version', return_value=1700000000000):
+        mock_guard_table.name = 'NameGuard'
         yield mock_table
 
 def test_healthcheck():
@@ -28,9 +35,9 @@ def test_healthcheck():
 
 def test_create_node(mock_dynamodb):
     # Arrange
-    # Mock DynamoDB responses
-    mock_dynamodb.query.return_value = {'Items': []}  # Node does not exist
-    mock_dynamodb.put_item.return_value = {}  # Mimic DynamoDB's response
+    # Mock DynamoDB responses: no node has the name yet
+    mock_dynamodb.query.return_value = {'Items': []}
+    mock_dynamodb.meta.client.transact_write_items.return_value = {}
 
     # Prepare the mock data for the node
     node_data = {
@@ -49,12 +56,50 @@ def test_create_node(mock_dynamodb):
     assert response.json() == {"message": "Node created successfully"}, \
         "Create Node: Expected message 'Node created successfully', got '{}'".format(response.json())
 
-    mock_dynamodb.put_item.assert_called_once_with(Item={
-        'UniqueName': 'us01vlbase01.saas-n.com',
-        'NodeGroupName': 'BT Base Server',
+    # The node is written together with a claim on its name
+    mock_dynamodb.put_item.assert_not_called()
+    claim, put = mock_dynamodb.meta.client.transact_write_items.call_args.kwargs['TransactItems']
+    assert (claim['Put']['TableName'], claim['Put']['Item']['Name']) == ('NameGuard', 'node#us01vlbase01.saas-n.com'), \
+        "Create Node: Unexpected name claim {}".format(claim)
+    assert claim['Put']['ConditionExpression'] == 'attribute_not_exists(#name)', \
+        "Create Node: Expected the claim to require a free name, got {}".format(claim)
+    assert put == {'Put': {
+        'TableName': mock_dynamodb.name,
+        'Item': {
+            'UniqueName': 'us01vlbase01.saas-n.com',
+            'NodeGroupName': 'BT Base Server',
+            'EnvironmentName': 'master',
+            'PuppetClusterName': 'ny2-saas-n',
+            'Version': 1700000000000
+        },
+        'ConditionExpression': 'attribute_not_exists(#key)',
+        'ExpressionAttributeNames': {'#key': 'UniqueName'},
+    }}, "Create Node: Unexpected put {}".format(put)
+
+def test_create_node_already_exists(mock_dynamodb):
+    # Arrange
+    # The name claim is rejected because another create took the name
+    mock_dynamodb.query.return_value = {'Items': []}
+    mock_dynamodb.meta.client.transact_write_items.side_effect = ClientError(
+        {'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+         'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}]},
+        'TransactWriteItems'
+    )
+    node_data = {
+        'unique_name': 'us01vlbase01.saas-n.com',
+        'node_group_name': 'BT Base Server',
         'environment_name': 'master',
         'puppet_cluster_name': 'ny2-saas-n'
-    })
+    }
+
+    # Act
+    response = client.post("/nodes/", json=node_data)
+
+    # Assert
+    assert response.status_code == 400, \
+        "Create Node: Expected status code 400, got {}".format(response.status_code)
+    assert response.json() == {"detail": "Node with this UniqueName already exists"}, \
+        "Create Node: Unexpected error body {}".format(response.json())
 
 def test_read_node(mock_dynamodb):
     # Arrange
@@ -100,16 +145,109 @@ def test_update_node(mock_dynamodb):
     assert response.json() == {"message": "Node updated successfully"}, \
         "Update Node: Expected message 'Node updated successfully', got '{}'".format(response.json())
 
-    mock_dynamodb.delete_item.assert_called_once_with(Key={
-        'UniqueName': 'us01vlbase01.saas-n.com',
-        'NodeGroupName': 'BT Base Server'
-    })
-    mock_dynamodb.put_item.assert_called_once_with(Item={
-        'UniqueName': 'us01vlbase01.saas-n.com',
-        'NodeGroupName': 'BT Apache Server',
+    # The node group is part of the key, so the old item is deleted and the
+    # new one written in a single transaction
+    mock_dynamodb.delete_item.assert_not_called()
+    mock_dynamodb.put_item.assert_not_called()
+    mock_dynamodb.meta.client.transact_write_items.assert_called_once_with(TransactItems=[
+        {'Delete': {
+            'TableName': mock_dynamodb.name,
+            'Key': {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'},
+            'ExpressionAttributeNames': {'#key': 'UniqueName', '#version': 'Version'},
+            # Rows written before versioning have no Version to compare
+            'ConditionExpression': 'attribute_exists(#key) AND attribute_not_exists(#version)'
+        }},
+        {'Put': {
+            'TableName': mock_dynamodb.name,
+            'Item': {
+                'UniqueName': 'us01vlbase01.saas-n.com',
+                'NodeGroupName': 'BT Apache Server',
+                'EnvironmentName': 'production',
+                'PuppetClusterName': 'ny2-saas-n',
+                'Version': 1700000000000
+            },
+            # Never overwrites a node already at the new key
+            'ConditionExpression': 'attribute_not_exists(#key)',
+            'ExpressionAttributeNames': {'#key': 'UniqueName'}
+        }}
+    ])
+
+def test_update_node_same_node_group(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server', 'environment_name': 'master', 'puppet_cluster_name': 'ny2-saas-n', 'Version': 3}]
+    }
+    updated_node_data = {
+        'unique_name': 'us01vlbase01.saas-n.com',
+        'node_group_name': 'BT Base Server',
         'environment_name': 'production',
         'puppet_cluster_name': 'ny2-saas-n'
-    })
+    }
+
+    # Act
+    response = client.put("/nodes/us01vlbase01.saas-n.com", json=updated_node_data)
+
+    # Assert
+    assert response.status_code == 200, \
+        "Update Node: Expected status code 200, got {}".format(response.status_code)
+    assert response.headers['ETag'] == '"v4"', \
+        "Update Node: Expected ETag \"v4\", got {}".format(response.headers.get('ETag'))
+    mock_dynamodb.update_item.assert_called_once_with(
+        Key={'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'},
+        UpdateExpression="SET EnvironmentName = :environment_name, PuppetClusterName = :puppet_cluster_name, "
+                         "Version = :version "
+                         "REMOVE environment_name, puppet_cluster_name",
+        ExpressionAttributeValues={':environment_name': 'production', ':puppet_cluster_name': 'ny2-saas-n', ':version': 4},
+        ConditionExpression=Attr('UniqueName').exists() & Attr('Version').eq(3)
+    )
+    mock_dynamodb.meta.client.transact_write_items.assert_not_called()
+
+def test_update_node_concurrent_write_conflicts(mock_dynamodb):
+    # Arrange
+    # Another request bumped the Version between the query and the update
+    mock_dynamodb.query.return_value = {
+        'Items': [{'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server', 'Version': 3}]
+    }
+    mock_dynamodb.update_item.side_effect = ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+        'UpdateItem'
+    )
+    updated_node_data = {
+        'unique_name': 'us01vlbase01.saas-n.com',
+        'node_group_name': 'BT Base Server',
+        'environment_name': 'production',
+        'puppet_cluster_name': 'ny2-saas-n'
+    }
+
+    # Act
+    response = client.put("/nodes/us01vlbase01.saas-n.com", json=updated_node_data)
+
+    # Assert
+    assert response.status_code == 409, \
+        "Update Node: Expected status code 409, got {}".format(response.status_code)
+
+def test_update_node_stale_if_match(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server', 'Version': 5}]
+    }
+    updated_node_data = {
+        'unique_name': 'us01vlbase01.saas-n.com',
+        'node_group_name': 'BT Base Server',
+        'environment_name': 'production',
+        'puppet_cluster_name': 'ny2-saas-n'
+    }
+
+    # Act
+    stale = client.put("/nodes/us01vlbase01.saas-n.com", json=updated_node_data, headers={'If-Match': '"v4"'})
+    malformed = client.put("/nodes/us01vlbase01.saas-n.com", json=updated_node_data, headers={'If-Match': 'abc'})
+
+    # Assert
+    assert stale.status_code == 409, \
+        "Update Node: Expected status code 409 for a stale If-Match, got {}".format(stale.status_code)
+    assert malformed.status_code == 400, \
+        "Update Node: Expected status code 400 for a malformed If-Match, got {}".format(malformed.status_code)
+    mock_dynamodb.update_item.assert_not_called()
 
 def test_delete_node(mock_dynamodb):
     # Arrange
@@ -127,6 +265,315 @@ def test_delete_node(mock_dynamodb):
     assert response.json() == {"message": "Node deleted successfully"}, \
         "Delete Node: Expected message 'Node deleted successfully', got '{}'".format(response.json())
 
-    mock_dynamodb.delete_item.assert_called_once_with(
-        Key={'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Apache Server'}
+    # The node is deleted together with the claim on its name
+    mock_dynamodb.delete_item.assert_not_called()
+    mock_dynamodb.meta.client.transact_write_items.assert_called_once_with(TransactItems=[
+        {'Delete': {
+            'TableName': mock_dynamodb.name,
+            'Key': {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Apache Server'},
+            'ConditionExpression': 'attribute_exists(#key)',
+            'ExpressionAttributeNames': {'#key': 'UniqueName'},
+        }},
+        {'Delete': {'TableName': 'NameGuard', 'Key': {'Name': 'node#us01vlbase01.saas-n.com'}}},
+    ])
+
+def test_create_nodes_batch(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.name = 'Node'
+    mock_dynamodb.meta.client.transact_write_items.return_value = {}
+    nodes = [{
+        'unique_name': 'us01vlbase{:02d}.saas-n.com'.format(i),
+        'node_group_name': 'BT Base Server',
+        'environment_name': 'master',
+        'puppet_cluster_name': 'ny2-saas-n'
+    } for i in range(60)]
+
+    # Act
+    response = client.post("/nodes/batch", json=nodes)
+
+    # Assert
+    assert response.status_code == 200, \
+        "Create Nodes: Expected status code 200, got {}".format(response.status_code)
+    data = response.json()
+    assert (data['succeeded'], data['failed']) == (60, 0), \
+        "Create Nodes: Expected 60 created and 0 failed, got {}".format(data)
+    assert all(result['status'] == 'created' for result in data['results'])
+
+    # Each node is written with the claim on its name, 50 nodes per
+    # transaction of 100 actions
+    calls = mock_dynamodb.meta.client.transact_write_items.call_args_list
+    assert sorted(len(call.kwargs['TransactItems']) for call in calls) == [20, 100], \
+        "Create Nodes: Expected transactions of 100 and 20 actions, got {}".format(calls)
+    claim, put = calls[0].kwargs['TransactItems'][:2]
+    assert claim['Put']['Item'] == {'Name': 'node#us01vlbase00.saas-n.com'} and \
+        put['Put']['ConditionExpression'] == 'attribute_not_exists(#key)', \
+        "Create Nodes: Expected a claim and a conditional put, got {} and {}".format(claim, put)
+
+def test_create_nodes_batch_rejects_taken_names(mock_dynamodb):
+    # Arrange
+    # The first name exists under another node group
+    mock_dynamodb.meta.client.transact_write_items.side_effect = [
+        ClientError({'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+                     'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}] + [{'Code': 'None'}] * 3},
+                    'TransactWriteItems'),
+        {}
+    ]
+    nodes = [{
+        'unique_name': 'us01vlbase{:02d}.saas-n.com'.format(i),
+        'node_group_name': 'BT Web Server',
+        'environment_name': 'master',
+        'puppet_cluster_name': 'ny2-saas-n'
+    } for i in range(2)]
+
+    # Act
+    response = client.post("/nodes/batch", json=nodes)
+
+    # Assert
+    data = response.json()
+    assert [(result['status'], result.get('detail')) for result in data['results']] == [
+        ('failed', 'Node with this UniqueName already exists'), ('created', None)
+    ], "Create Nodes: Unexpected per-node results {}".format(data['results'])
+
+def test_delete_nodes_batch_reports_missing_nodes(mock_dynamodb):
+    # Arrange
+    # The second node does not exist, so its delete condition cancels the
+    # first transaction; the other nodes are sent again without it
+    mock_dynamodb.meta.client.transact_write_items.side_effect = [
+        ClientError({'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+                     'CancellationReasons': [{'Code': 'None'}] * 2 + [{'Code': 'ConditionalCheckFailed'}] +
+                                            [{'Code': 'None'}] * 3},
+                    'TransactWriteItems'),
+        {}
+    ]
+    nodes = [
+        {'unique_name': 'us01vlbase01.saas-n.com', 'node_group_name': 'BT Base Server'},
+        {'unique_name': 'us01vlbase02.saas-n.com', 'node_group_name': 'BT Base Server'},
+        {'unique_name': 'us01vlbase03.saas-n.com', 'node_group_name': 'BT Base Server'},
+        {'unique_name': 'us01vlbase01.saas-n.com', 'node_group_name': 'BT Web Server'}
+    ]
+
+    # Act
+    response = client.request("DELETE", "/nodes/batch", json=nodes)
+
+    # Assert
+    assert response.status_code == 200, \
+        "Delete Nodes: Expected status code 200, got {}".format(response.status_code)
+    data = response.json()
+    assert [(result['status'], result.get('detail')) for result in data['results']] == [
+        ('deleted', None), ('failed', 'Node not found'), ('deleted', None), ('failed', 'Duplicate node in request')
+    ], "Delete Nodes: Unexpected per-node results {}".format(data['results'])
+    retry = mock_dynamodb.meta.client.transact_write_items.call_args_list[1].kwargs['TransactItems']
+    assert [action['Delete']['Key'] for action in retry] == [
+        {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'},
+        {'Name': 'node#us01vlbase01.saas-n.com'},
+        {'UniqueName': 'us01vlbase03.saas-n.com', 'NodeGroupName': 'BT Base Server'},
+        {'Name': 'node#us01vlbase03.saas-n.com'},
+    ], "Delete Nodes: Expected only the existing nodes to be resent, got {}".format(retry)
+
+def test_lookup_nodes(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.name = 'Node'
+    found = [{'UniqueName': 'us01vlbase{:03d}.saas-n.com'.format(i), 'NodeGroupName': 'BT Base Server'} for i in range(0, 250, 2)]
+    mock_dynamodb.meta.client.batch_get_item.side_effect = lambda RequestItems: {
+        'Responses': {'Node': [key for key in RequestItems['Node']['Keys'] if key in found]}
+    }
+    mock_dynamodb.query.return_value = {'Items': []}
+    nodes = [{'unique_name': 'us01vlbase{:03d}.saas-n.com'.format(i), 'node_group_name': 'BT Base Server'} for i in range(250)]
+
+    # Act
+    response = client.post("/nodes/lookup", json={'nodes': nodes, 'unique_names': ['us01vlmissing.saas-n.com']})
+
+    # Assert
+    assert response.status_code == 200, \
+        "Lookup Nodes: Expected status code 200, got {}".format(response.status_code)
+    data = response.json()
+    assert (data['found'], len(data['not_found'])) == (125, 126), \
+        "Lookup Nodes: Expected 125 found and 126 not found, got {} and {}".format(data['found'], len(data['not_found']))
+    assert data['nodes']['us01vlbase000.saas-n.com'] == [found[0]]
+    assert data['nodes']['us01vlbase001.saas-n.com'] is None
+    assert data['nodes']['us01vlmissing.saas-n.com'] is None
+    # 250 keys are read in chunks of at most 100, bare names are queried
+    calls = mock_dynamodb.meta.client.batch_get_item.call_args_list
+    assert sorted(len(call.kwargs['RequestItems']['Node']['Keys']) for call in calls) == [50, 100, 100], \
+        "Lookup Nodes: Expected chunks of 100, 100 and 50 keys, got {}".format(calls)
+    mock_dynamodb.query.assert_called_once_with(
+        KeyConditionExpression=Key('UniqueName').eq('us01vlmissing.saas-n.com')
     )
+
+def test_lookup_nodes_skips_duplicate_keys(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.name = 'Node'
+    mock_dynamodb.meta.client.batch_get_item.return_value = {'Responses': {'Node': []}}
+    node = {'unique_name': 'us01vlbase01.saas-n.com', 'node_group_name': 'BT Base Server'}
+
+    # Act
+    response = client.post("/nodes/lookup", json={'nodes': [node, node]})
+
+    # Assert
+    assert response.json() == {
+        'nodes': {'us01vlbase01.saas-n.com': None}, 'found': 0, 'not_found': ['us01vlbase01.saas-n.com']
+    }, "Lookup Nodes: Unexpected body {}".format(response.json())
+    mock_dynamodb.meta.client.batch_get_item.assert_called_once_with(RequestItems={'Node': {'Keys': [
+        {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}
+    ]}})
+
+def test_get_all_nodes_paginates(mock_dynamodb):
+    # Arrange
+    last_key = {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}
+    mock_dynamodb.scan.return_value = {
+        'Items': [{'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}],
+        'LastEvaluatedKey': last_key
+    }
+
+    # Act
+    first = client.get("/nodes/?limit=1")
+    mock_dynamodb.scan.return_value = {'Items': [{'UniqueName': 'us01vlbase02.saas-n.com', 'NodeGroupName': 'BT Base Server'}]}
+    second = client.get("/nodes/", params={'limit': 1, 'cursor': first.json()['next_cursor']})
+
+    # Assert
+    assert first.status_code == 200, \
+        "List Nodes: Expected status code 200, got {}".format(first.status_code)
+    assert first.json()['next_cursor'], "List Nodes: Expected a cursor for the next page"
+    assert second.json() == {
+        'items': [{'UniqueName': 'us01vlbase02.saas-n.com', 'NodeGroupName': 'BT Base Server'}],
+        'next_cursor': None
+    }, "List Nodes: Unexpected last page {}".format(second.json())
+    mock_dynamodb.scan.assert_called_with(Limit=1, ExclusiveStartKey=last_key)
+
+def test_get_all_nodes_rejects_bad_cursor(mock_dynamodb):
+    # Act
+    response = client.get("/nodes/?cursor=not-a-cursor")
+
+    # Assert
+    assert response.status_code == 400, \
+        "List Nodes: Expected status code 400, got {}".format(response.status_code)
+    mock_dynamodb.scan.assert_not_called()
+
+def test_get_all_nodes_rejects_tampered_cursor(mock_dynamodb):
+    # Arrange
+    # Well-formed cursors whose key does not fit the table
+    wrong_type = base64.urlsafe_b64encode(json.dumps({'UniqueName': ['a']}).encode()).decode()
+    wrong_key = base64.urlsafe_b64encode(json.dumps({'Name': 'BT Base Server'}).encode()).decode()
+    mock_dynamodb.scan.side_effect = ClientError(
+        {'Error': {'Code': 'ValidationException', 'Message': 'The provided starting key is invalid'}}, 'Scan'
+    )
+
+    # Act
+    responses = [
+        client.get("/nodes/", params={'cursor': wrong_type}),
+        client.get("/nodes/", params={'cursor': wrong_key}),
+        client.get("/nodes/", params={'cursor': wrong_key, 'stream': 'true'}),
+    ]
+
+    # Assert
+    for response in responses:
+        assert response.status_code == 400, \
+            "List Nodes: Expected status code 400, got {}".format(response.status_code)
+        assert response.json() == {'detail': 'Invalid cursor'}, \
+            "List Nodes: Unexpected body {}".format(response.json())
+    assert mock_dynamodb.scan.call_count == 2, \
+        "List Nodes: Expected the cursor of the wrong type to be rejected before the scan"
+
+def test_get_all_nodes_stream(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.scan.side_effect = [
+        {'Items': [{'UniqueName': 'us01vlbase01.saas-n.com'}], 'LastEvaluatedKey': {'UniqueName': 'us01vlbase01.saas-n.com'}},
+        {'Items': [{'UniqueName': 'us01vlbase02.saas-n.com'}]}
+    ]
+
+    # Act
+    response = client.get("/nodes/?stream=true&limit=1")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Stream Nodes: Expected status code 200, got {}".format(response.status_code)
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [{'UniqueName': 'us01vlbase01.saas-n.com'}, {'UniqueName': 'us01vlbase02.saas-n.com'}], \
+        "Stream Nodes: Expected both pages to be streamed, got {}".format(lines)
+    assert mock_dynamodb.scan.call_count == 2
+
+def test_get_nodes_by_puppet_cluster(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server', 'PuppetClusterName': 'ny2-saas-n'}]
+    }
+
+    # Act
+    response = client.get("/nodes/puppet_cluster/ny2-saas-n?limit=10")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Nodes By Puppet Cluster: Expected status code 200, got {}".format(response.status_code)
+    assert response.json()['items'][0]['UniqueName'] == 'us01vlbase01.saas-n.com'
+    mock_dynamodb.query.assert_called_once_with(
+        Limit=10,
+        IndexName='PuppetClusterNameIndex',
+        KeyConditionExpression=Key('PuppetClusterName').eq('ny2-saas-n')
+    )
+
+def test_get_nodes_by_hostgroup(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {'Items': []}
+
+    # Act
+    response = client.get("/nodes/hostgroup/BT%20Base%20Server")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Nodes By Hostgroup: Expected status code 200, got {}".format(response.status_code)
+    assert response.json() == {'items': [], 'next_cursor': None}
+    mock_dynamodb.query.assert_called_once_with(
+        Limit=100,
+        IndexName='NodeGroupNameIndex',
+        KeyConditionExpression=Key('NodeGroupName').eq('BT Base Server')
+    )
+
+def test_get_nodes_by_environment(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {'Items': []}
+
+    # Act
+    response = client.get("/nodes/environment/master")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Nodes By Environment: Expected status code 200, got {}".format(response.status_code)
+    mock_dynamodb.query.assert_called_once_with(
+        Limit=100,
+        IndexName='EnvironmentNameIndex',
+        KeyConditionExpression=Key('EnvironmentName').eq('master')
+    )
+
+def test_read_node_not_modified(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server'}]
+    }
+    first = client.get("/nodes/us01vlbase01.saas-n.com")
+
+    # Act
+    response = client.get("/nodes/us01vlbase01.saas-n.com", headers={'If-None-Match': first.headers['ETag']})
+
+    # Assert
+    assert response.status_code == 304, \
+        "Read Node: Expected status code 304, got {}".format(response.status_code)
+    assert response.content == b'', "Read Node: Expected an empty 304 body"
+    assert response.headers['ETag'] == first.headers['ETag']
+
+def test_read_node_not_modified_skips_serialization(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server', 'Version': Decimal(4)}]
+    }
+
+    # Act
+    with patch('lambdas.src.handlers.etag.dumps') as mock_dumps:
+        response = client.get("/nodes/us01vlbase01.saas-n.com", headers={'If-None-Match': '"v4"'})
+
+    # Assert
+    # The Version alone answers the request, so the body is never built
+    assert response.status_code == 304, \
+        "Read Node: Expected status code 304, got {}".format(response.status_code)
+    assert response.headers['ETag'] == '"v4"', "Read Node: Unexpected ETag {}".format(response.headers['ETag'])
+    mock_dumps.assert_not_called()
@@ -1,9 +1,17 @@
+import asyncio
 import json
+import time
+import httpx
 import pytest
 from unittest.mock import patch, MagicMock
 from fastapi.testclient import TestClient
-from boto3.dynamodb.conditions import Key
-from lambdas.src.handlers.node_group import app
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+import zlib
+from decimal import Decimal
+from boto3.dynamodb.types import Binary
+from lambdas.src.handlers import dynamo, metrics
+from lambdas.src.handlers.node_group import app, node_group_cache
 
 # Initialize the TestClient with FastAPI app
 client = TestClient(app)
@@ -11,9 +19,25 @@ client = TestClient(app)
 @pytest.fixture(scope='function')
 def mock_dynamodb():
     # Patch the node_group_table used in the FastAPI module
-    with patch('lambdas.src.handlers.node_group.node_group_table') as mock_table:
+    # and start every test with an empty node group cache
+    # and pin the clock new records take their first Version from
+    # and give every node group no member nodes unless a test says otherwise
+    node_group_cache.clear()
+    with patch('lambdas.src.handlers.node_group.node_group_table') as mock_table, \
+            patch('lambdas.src.handlers.node_group.node_table') as mock_node_table, \
+            patch('lambdas.src.handlers.node_group.guard_table') as mock_guard_table, \
+            patch('lambdas.src.handlers.dynamo.initial_version', return_value=1700000000000):
+        mock_guard_table.name = 'NameGuard'
+        mock_node_table.name = 'Node'
+        mock_node_table.query.return_value = {'Items': [], 'Count': 0}
         yield mock_table
 
+@pytest.fixture(scope='function')
+def mock_node_table(mock_dynamodb):
+    # The Node table patched by mock_dynamodb, read for group membership
+    from lambdas.src.handlers import node_group
+    return node_group.node_table
+
 def test_healthcheck():
     # Act
     response = client.get("/healthcheck")
@@ -32,9 +56,9 @@ def test_create_node_group(mock_dynamodb):
         'parameters': {'bt_product': 'cea'}
     }
 
-    # Mock DynamoDB responses
-    mock_dynamodb.query.return_value = {'Items': []}  # Node group does not exist
-    mock_dynamodb.put_item.return_value = {}  # Mimic DynamoDB's response
+    # Mock DynamoDB responses: no node group has the name yet
+    mock_dynamodb.query.return_value = {'Items': []}
+    mock_dynamodb.meta.client.transact_write_items.return_value = {}
 
     # Act
     response = client.post("/nodegroup/", json=node_group_data)
@@ -45,13 +69,46 @@ def test_create_node_group(mock_dynamodb):
     assert response.json() == {"message": "Node Group created successfully"}, \
         "Create Node Group: Expected message 'Node Group created successfully', got '{}'".format(response.json())
 
-    # Ensure that put_item was called with the correct arguments
-    mock_dynamodb.put_item.assert_called_once_with(Item={
-        'Name': 'BT Base Server',
-        'Class': 'roles::base_server',
-        'Parameters': json.dumps({'bt_product': 'cea'})
+    # The node group is written together with a claim on its name
+    mock_dynamodb.put_item.assert_not_called()
+    claim, put = mock_dynamodb.meta.client.transact_write_items.call_args.kwargs['TransactItems']
+    assert (claim['Put']['TableName'], claim['Put']['Item']['Name']) == ('NameGuard', 'nodegroup#BT Base Server'), \
+        "Create Node Group: Unexpected name claim {}".format(claim)
+    assert put == {'Put': {
+        'TableName': mock_dynamodb.name,
+        'Item': {
+            'Name': 'BT Base Server',
+            'Class': 'roles::base_server',
+            'ParameterSet': {'bt_product': 'cea'},
+            'Version': 1700000000000
+        },
+        'ConditionExpression': 'attribute_not_exists(#key)',
+        'ExpressionAttributeNames': {'#key': 'Name'},
+    }}, "Create Node Group: Unexpected put {}".format(put)
+
+def test_create_node_group_already_exists(mock_dynamodb):
+    # Arrange
+    # A node group with the name exists under another class, so its claim
+    # cancels the transaction
+    mock_dynamodb.meta.client.transact_write_items.side_effect = ClientError(
+        {'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+         'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}]},
+        'TransactWriteItems'
+    )
+
+    # Act
+    response = client.post("/nodegroup/", json={
+        'name': 'BT Base Server',
+        'class_': 'roles::base_server',
+        'parameters': {'bt_product': 'cea'}
     })
 
+    # Assert
+    assert response.status_code == 400, \
+        "Create Node Group: Expected status code 400, got {}".format(response.status_code)
+    assert response.json() == {"detail": "Node group with this name already exists"}, \
+        "Create Node Group: Unexpected error body {}".format(response.json())
+
 def test_read_node_group(mock_dynamodb):
     # Arrange
     # Mock the return value for query
@@ -73,6 +130,59 @@ def test_read_node_group(mock_dynamodb):
         KeyConditionExpression=Key('Name').eq('BT Base Server')
     )
 
+def test_read_node_group_serves_stale_entry_while_throttled(mock_dynamodb, monkeypatch):
+    # Arrange
+    # Entries expire as soon as they are cached but stay available as stale
+    monkeypatch.setattr(dynamo, 'breakers', {})
+    monkeypatch.setattr(node_group_cache, 'ttl', -1)
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server'}]
+    }
+    client.get("/nodegroup/BT%20Base%20Server")
+    metrics.reset()
+    mock_dynamodb.query.side_effect = ClientError(
+        {'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Rate exceeded'}}, 'Query'
+    )
+
+    # Act
+    stale = client.get("/nodegroup/BT%20Base%20Server")
+    missing = client.get("/nodegroup/BT%20Apache%20Server")
+
+    # Assert
+    assert stale.status_code == 200, \
+        "Read Node Group: Expected the stale entry to be served, got {}".format(stale.status_code)
+    assert stale.json() == [{'Name': 'BT Base Server', 'Class': 'roles::base_server'}], \
+        "Read Node Group: Unexpected stale body {}".format(stale.json())
+    assert missing.status_code == 503, \
+        "Read Node Group: Expected status code 503 without a cached entry, got {}".format(missing.status_code)
+    assert 'Retry-After' in missing.headers, "Read Node Group: Expected a Retry-After header"
+    counters = client.get("/metrics").json()['counters']
+    assert counters['/nodegroup/{node_group_name}']['stale_served'] == 1, \
+        "Read Node Group: Expected the stale response to be counted, got {}".format(counters)
+
+def test_concurrent_reads_share_one_query(mock_dynamodb):
+    # Arrange
+    def slow_query(**kwargs):
+        time.sleep(0.1)
+        return {'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server'}]}
+    mock_dynamodb.query.side_effect = slow_query
+
+    async def burst():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://enc') as async_client:
+            return await asyncio.gather(*(async_client.get("/nodegroup/BT%20Base%20Server") for _ in range(5)))
+
+    # Act
+    responses = asyncio.run(burst())
+
+    # Assert
+    assert [response.status_code for response in responses] == [200] * 5, \
+        "Read Node Group: Expected every read to succeed, got {}".format([response.status_code for response in responses])
+    assert mock_dynamodb.query.call_count == 1, \
+        "Read Node Group: Expected one query for the burst, got {}".format(mock_dynamodb.query.call_count)
+    assert node_group_cache.stats()['coalesced'] == 4, \
+        "Read Node Group: Expected 4 coalesced reads, got {}".format(node_group_cache.stats())
+
 def test_update_node_group(mock_dynamodb):
     # Arrange
     # Mock the return value for query
@@ -98,19 +208,82 @@ def test_update_node_group(mock_dynamodb):
     assert response.json() == {"message": "Node Group updated successfully"}, \
         "Update Node Group: Expected message 'Node Group updated successfully', got '{}'".format(response.json())
 
-    # Ensure that delete_item and put_item were called with the correct arguments
-    mock_dynamodb.delete_item.assert_called_once_with(Key={
-        'Name': 'BT Base Server',
-        'Class': 'roles::base_server'
-    })
-    mock_dynamodb.put_item.assert_called_once_with(Item={
-        'Name': 'BT Base Server',
-        'Class': 'roles::apache_server',
-        'Parameters': json.dumps({
-            'bt_product': 'cea',
-            'bt_role': 'apache'
-        })
-    })
+    # The class is part of the key, so the old item is deleted and the new one
+    # written in a single transaction
+    mock_dynamodb.delete_item.assert_not_called()
+    mock_dynamodb.put_item.assert_not_called()
+    mock_dynamodb.meta.client.transact_write_items.assert_called_once_with(TransactItems=[
+        {'Delete': {
+            'TableName': mock_dynamodb.name,
+            'Key': {'Name': 'BT Base Server', 'Class': 'roles::base_server'},
+            'ExpressionAttributeNames': {'#key': 'Name', '#version': 'Version'},
+            'ConditionExpression': 'attribute_exists(#key) AND attribute_not_exists(#version)'
+        }},
+        {'Put': {
+            'TableName': mock_dynamodb.name,
+            'Item': {
+                'Name': 'BT Base Server',
+                'Class': 'roles::apache_server',
+                'ParameterSet': {
+                    'bt_product': 'cea',
+                    'bt_role': 'apache'
+                },
+                'Version': 1700000000000
+            },
+            'ConditionExpression': 'attribute_not_exists(#key)',
+            'ExpressionAttributeNames': {'#key': 'Name'}
+        }}
+    ])
+
+def test_update_node_group_same_class(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'Parameters': json.dumps({'bt_product': 'cea'}), 'Version': Decimal(7)}]
+    }
+
+    # Act
+    response = client.put("/nodegroup/BT%20Base%20Server", json={
+        'name': 'BT Base Server',
+        'class_': 'roles::base_server',
+        'parameters': {'bt_product': 'cea', 'bt_role': 'apache'}
+    }, headers={'If-Match': '"v7"'})
+
+    # Assert
+    assert response.status_code == 200, \
+        "Update Node Group: Expected status code 200, got {}".format(response.status_code)
+    assert response.headers['ETag'] == '"v8"', \
+        "Update Node Group: Expected ETag \"v8\", got {}".format(response.headers.get('ETag'))
+    mock_dynamodb.update_item.assert_called_once_with(
+        Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'},
+        UpdateExpression="SET #parameters = :parameters, Version = :version REMOVE #legacy",
+        ExpressionAttributeNames={'#parameters': 'ParameterSet', '#legacy': 'Parameters'},
+        ExpressionAttributeValues={':parameters': {'bt_product': 'cea', 'bt_role': 'apache'}, ':version': 8},
+        ConditionExpression=Attr('Name').exists() & Attr('Version').eq(Decimal(7))
+    )
+    mock_dynamodb.meta.client.transact_write_items.assert_not_called()
+
+def test_update_node_group_conflicts(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {}, 'Version': Decimal(7)}]
+    }
+    mock_dynamodb.meta.client.transact_write_items.side_effect = ClientError(
+        {'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+         'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}]},
+        'TransactWriteItems'
+    )
+    node_group_data = {'name': 'BT Base Server', 'class_': 'roles::apache_server', 'parameters': {}}
+
+    # Act
+    stale = client.put("/nodegroup/BT%20Base%20Server", json=node_group_data, headers={'If-Match': '"v6"'})
+    raced = client.put("/nodegroup/BT%20Base%20Server", json=node_group_data)
+
+    # Assert
+    assert stale.status_code == 409, \
+        "Update Node Group: Expected status code 409 for a stale If-Match, got {}".format(stale.status_code)
+    assert raced.status_code == 409, \
+        "Update Node Group: Expected status code 409 for a lost race, got {}".format(raced.status_code)
+    mock_dynamodb.meta.client.transact_write_items.assert_called_once()
 
 def test_delete_node_group(mock_dynamodb):
     # Arrange
@@ -128,7 +301,418 @@ def test_delete_node_group(mock_dynamodb):
     assert response.json() == {"message": "Node group deleted successfully"}, \
         "Delete Node Group: Expected message 'Node group deleted successfully', got '{}'".format(response.json())
 
-    # Ensure that delete_item was called with the correct arguments
-    mock_dynamodb.delete_item.assert_called_once_with(
-        Key={'Name': 'BT Base Server', 'Class': 'roles::apache_server'}
+    # The group is deleted together with the claim on its name
+    mock_dynamodb.delete_item.assert_not_called()
+    mock_dynamodb.meta.client.transact_write_items.assert_called_once_with(TransactItems=[
+        {'Delete': {
+            'TableName': mock_dynamodb.name,
+            'Key': {'Name': 'BT Base Server', 'Class': 'roles::apache_server'},
+            'ConditionExpression': 'attribute_exists(#key)',
+            'ExpressionAttributeNames': {'#key': 'Name'},
+        }},
+        {'Delete': {'TableName': 'NameGuard', 'Key': {'Name': 'nodegroup#BT Base Server'}}},
+    ])
+
+def test_read_node_group_is_cached(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server'}]
+    }
+
+    # Act
+    first = client.get("/nodegroup/BT%20Base%20Server")
+    second = client.get("/nodegroup/BT%20Base%20Server")
+
+    # Assert
+    assert first.json() == second.json(), \
+        "Read Node Group: Expected cached response to match, got {} and {}".format(first.json(), second.json())
+    mock_dynamodb.query.assert_called_once()
+    stats = client.get("/cache/nodegroup").json()
+    assert (stats['hits'], stats['misses']) == (1, 1), \
+        "Node Group Cache: Expected 1 hit and 1 miss, got {}".format(stats)
+
+def test_update_node_group_invalidates_cache(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'Parameters': json.dumps({'bt_product': 'cea'})}]
+    }
+    client.get("/nodegroup/BT%20Base%20Server")
+
+    # Act
+    client.put("/nodegroup/BT%20Base%20Server", json={
+        'name': 'BT Base Server',
+        'class_': 'roles::apache_server',
+        'parameters': {'bt_product': 'cea'}
+    })
+    client.get("/nodegroup/BT%20Base%20Server")
+
+    # Assert
+    assert mock_dynamodb.query.call_count == 3, \
+        "Read Node Group: Expected a fresh query after update, got {} queries".format(mock_dynamodb.query.call_count)
+
+def test_get_all_node_groups(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.scan.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server'}]
+    }
+
+    # Act
+    response = client.get("/nodegroup/?limit=50")
+
+    # Assert
+    assert response.status_code == 200, \
+        "List Node Groups: Expected status code 200, got {}".format(response.status_code)
+    assert response.json() == {
+        'items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server'}],
+        'next_cursor': None
+    }, "List Node Groups: Unexpected page {}".format(response.json())
+    mock_dynamodb.scan.assert_called_once_with(Limit=50)
+
+def test_get_all_node_groups_decodes_parameters(mock_dynamodb):
+    # Arrange
+    parameters = {'bt_param_{:04d}'.format(i): 'value {}'.format(i) for i in range(500)}
+    mock_dynamodb.scan.return_value = {'Items': [
+        {'Name': 'BT Base Server', 'Class': 'roles::base_server',
+         'ParameterSet': Binary(zlib.compress(json.dumps(parameters).encode()))},
+        {'Name': 'BT Web Server', 'Class': 'roles::apache_server', 'Parameters': json.dumps({'bt_role': 'apache'})},
+    ]}
+
+    # Act
+    page = client.get("/nodegroup/")
+    stream = client.get("/nodegroup/?stream=true")
+
+    # Assert
+    assert page.status_code == 200, \
+        "List Node Groups: Expected status code 200, got {}".format(page.status_code)
+    assert [item['Parameters'] for item in page.json()['items']] == [parameters, {'bt_role': 'apache'}], \
+        "List Node Groups: Expected compressed and legacy parameters to be decoded"
+    lines = [json.loads(line) for line in stream.text.splitlines()]
+    assert [item['Parameters'] for item in lines] == [parameters, {'bt_role': 'apache'}], \
+        "List Node Groups: Expected the stream to decode parameters, got {} lines".format(len(lines))
+
+def test_create_node_group_stores_parameters_as_map(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {'Items': []}
+
+    # Act
+    client.post("/nodegroup/", json={
+        'name': 'BT Base Server',
+        'class_': 'roles::base_server',
+        'parameters': {'bt_product': 'cea', 'bt_weight': 1.5, 'bt_ports': [80, 443]}
+    })
+
+    # Assert
+    item = mock_dynamodb.meta.client.transact_write_items.call_args.kwargs['TransactItems'][1]['Put']['Item']
+    assert item['ParameterSet'] == {'bt_product': 'cea', 'bt_weight': Decimal('1.5'), 'bt_ports': [80, 443]}, \
+        "Create Node Group: Expected a native map with Decimal numbers, got {}".format(item['ParameterSet'])
+
+def test_read_node_group_decodes_legacy_parameters(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'Parameters': json.dumps({'bt_product': 'cea'})}]
+    }
+
+    # Act
+    response = client.get("/nodegroup/BT%20Base%20Server")
+
+    # Assert
+    assert response.json()[0]['Parameters'] == {'bt_product': 'cea'}, \
+        "Read Node Group: Expected legacy parameters to be decoded, got {}".format(response.json())
+
+def test_patch_node_group_parameters(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {'bt_product': 'cea', 'bt_tier': 'nonprod'}}]
+    }
+    mock_dynamodb.update_item.return_value = {
+        'Attributes': {'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {'bt_product': 'lob'}, 'Version': Decimal(4)}
+    }
+
+    # Act
+    response = client.patch("/nodegroup/BT%20Base%20Server/parameters", json={
+        'set': {'bt_product': 'lob'},
+        'remove': ['bt_tier']
+    })
+
+    # Assert
+    assert response.status_code == 200, \
+        "Patch Parameters: Expected status code 200, got {}".format(response.status_code)
+    assert response.json()['parameters'] == {'bt_product': 'lob'}, \
+        "Patch Parameters: Unexpected body {}".format(response.json())
+    mock_dynamodb.update_item.assert_called_once_with(
+        Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'},
+        UpdateExpression="SET Version = if_not_exists(Version, :first) + :one, #parameters.#s0 = :s0 "
+                         "REMOVE #parameters.#r0",
+        ExpressionAttributeNames={'#parameters': 'ParameterSet', '#s0': 'bt_product', '#r0': 'bt_tier'},
+        ExpressionAttributeValues={':first': 1700000000000, ':one': 1, ':s0': 'lob'},
+        ConditionExpression=Attr('ParameterSet').attribute_type('M'),
+        ReturnValues='ALL_NEW'
+    )
+    assert response.headers['ETag'] == '"v4"', \
+        "Patch Parameters: Expected the ETag of the new Version, got {}".format(response.headers.get('ETag'))
+
+def test_patch_node_group_parameters_if_match(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {'bt_product': 'cea'}, 'Version': Decimal(3)}]
+    }
+    mock_dynamodb.update_item.return_value = {
+        'Attributes': {'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {}, 'Version': Decimal(4)}
+    }
+
+    # Act
+    response = client.patch("/nodegroup/BT%20Base%20Server/parameters", json={'remove': ['bt_product']},
+                            headers={'If-Match': 'W/"v3"'})
+
+    # Assert
+    assert response.status_code == 200, \
+        "Patch Parameters: Expected status code 200, got {}".format(response.status_code)
+    mock_dynamodb.update_item.assert_called_once_with(
+        Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'},
+        UpdateExpression="SET Version = :version REMOVE #parameters.#r0",
+        ExpressionAttributeNames={'#parameters': 'ParameterSet', '#r0': 'bt_product'},
+        ExpressionAttributeValues={':version': 4},
+        ConditionExpression=Attr('ParameterSet').attribute_type('M') & Attr('Version').eq(Decimal(3)),
+        ReturnValues='ALL_NEW'
     )
+
+def test_patch_node_group_parameters_rejects_legacy_string(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'Parameters': json.dumps({'bt_product': 'cea'})}]
+    }
+
+    # Act
+    response = client.patch("/nodegroup/BT%20Base%20Server/parameters", json={'remove': ['bt_product']})
+
+    # Assert
+    assert response.status_code == 409, \
+        "Patch Parameters: Expected status code 409, got {}".format(response.status_code)
+    mock_dynamodb.update_item.assert_not_called()
+
+def test_patch_node_group_parameters_requires_changes(mock_dynamodb):
+    # Act
+    response = client.patch("/nodegroup/BT%20Base%20Server/parameters", json={})
+
+    # Assert
+    assert response.status_code == 400, \
+        "Patch Parameters: Expected status code 400, got {}".format(response.status_code)
+    mock_dynamodb.query.assert_not_called()
+
+def test_create_node_group_compresses_large_parameters(mock_dynamodb):
+    # Arrange
+    parameters = {'bt_param_{:04d}'.format(i): 'value {}'.format(i) for i in range(500)}
+    mock_dynamodb.query.return_value = {'Items': []}
+
+    # Act
+    client.post("/nodegroup/", json={'name': 'BT Base Server', 'class_': 'roles::base_server', 'parameters': parameters})
+
+    # Assert
+    stored = mock_dynamodb.meta.client.transact_write_items.call_args.kwargs['TransactItems'][1]['Put']['Item']['ParameterSet']
+    assert isinstance(stored, Binary), \
+        "Create Node Group: Expected large parameters to be stored as Binary, got {}".format(type(stored))
+    assert json.loads(zlib.decompress(stored.value)) == parameters
+
+def test_read_node_group_decompresses_parameters(mock_dynamodb):
+    # Arrange
+    compressed = Binary(zlib.compress(json.dumps({'bt_product': 'cea'}).encode()))
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': compressed}]
+    }
+
+    # Act
+    response = client.get("/nodegroup/BT%20Base%20Server")
+
+    # Assert
+    assert response.json()[0]['Parameters'] == {'bt_product': 'cea'}, \
+        "Read Node Group: Expected compressed parameters to be decoded, got {}".format(response.json())
+
+def test_patch_compressed_parameters_rewrites_whole_set(mock_dynamodb):
+    # Arrange
+    compressed = Binary(zlib.compress(json.dumps({'bt_product': 'cea', 'bt_tier': 'nonprod'}).encode()))
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': compressed}]
+    }
+    mock_dynamodb.update_item.return_value = {
+        'Attributes': {'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {'bt_product': 'lob'}, 'Version': Decimal(4)}
+    }
+
+    # Act
+    response = client.patch("/nodegroup/BT%20Base%20Server/parameters", json={
+        'set': {'bt_product': 'lob'},
+        'remove': ['bt_tier']
+    })
+
+    # Assert
+    assert response.status_code == 200, \
+        "Patch Parameters: Expected status code 200, got {}".format(response.status_code)
+    mock_dynamodb.update_item.assert_called_once_with(
+        Key={'Name': 'BT Base Server', 'Class': 'roles::base_server'},
+        UpdateExpression="SET #parameters = :parameters, Version = :version",
+        ExpressionAttributeNames={'#parameters': 'ParameterSet'},
+        ExpressionAttributeValues={':parameters': {'bt_product': 'lob'}, ':version': 1700000000000},
+        ConditionExpression=Attr('ParameterSet').eq(compressed) & Attr('Version').not_exists(),
+        ReturnValues='ALL_NEW'
+    )
+
+def test_read_node_group_not_modified_skips_dynamodb(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server'}]
+    }
+    first = client.get("/nodegroup/BT%20Base%20Server")
+
+    # Act
+    response = client.get("/nodegroup/BT%20Base%20Server", headers={'If-None-Match': first.headers['ETag']})
+
+    # Assert
+    assert response.status_code == 304, \
+        "Read Node Group: Expected status code 304, got {}".format(response.status_code)
+    mock_dynamodb.query.assert_called_once()
+
+def test_read_node_group_etag_changes_with_content(mock_dynamodb):
+    # Arrange
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {'bt_product': 'cea'}}]
+    }
+    first = client.get("/nodegroup/BT%20Base%20Server")
+    node_group_cache.clear()
+    mock_dynamodb.query.return_value = {
+        'Items': [{'Name': 'BT Base Server', 'Class': 'roles::base_server', 'ParameterSet': {'bt_product': 'lob'}}]
+    }
+
+    # Act
+    response = client.get("/nodegroup/BT%20Base%20Server", headers={'If-None-Match': first.headers['ETag']})
+
+    # Assert
+    assert response.status_code == 200, \
+        "Read Node Group: Expected status code 200, got {}".format(response.status_code)
+    assert response.headers['ETag'] != first.headers['ETag']
+
+MEMBERS = [
+    {'UniqueName': 'us01vlbase01.saas-n.com', 'NodeGroupName': 'BT Base Server', 'EnvironmentName': 'master',
+     'PuppetClusterName': 'ny2-saas-n', 'Version': 4},
+    {'UniqueName': 'us01vlbase02.saas-n.com', 'NodeGroupName': 'BT Base Server', 'EnvironmentName': 'master',
+     'PuppetClusterName': 'ny2-saas-n'},
+]
+
+def test_get_node_group_members_with_count(mock_dynamodb, mock_node_table):
+    # Arrange
+    def query(**kwargs):
+        if kwargs.get('Select') == 'COUNT':
+            return {'Count': 2}
+        return {'Items': MEMBERS[:1], 'LastEvaluatedKey': {'UniqueName': 'us01vlbase01.saas-n.com'}}
+    mock_node_table.query.side_effect = query
+
+    # Act
+    response = client.get("/nodegroup/BT%20Base%20Server/nodes?limit=1&count=true")
+
+    # Assert
+    assert response.status_code == 200, \
+        "Node Group Members: Expected status code 200, got {}".format(response.status_code)
+    body = response.json()
+    assert (body['items'], body['count']) == (MEMBERS[:1], 2), \
+        "Node Group Members: Unexpected page {}".format(body)
+    assert body['next_cursor'], "Node Group Members: Expected a cursor for the next page"
+    mock_node_table.query.assert_any_call(
+        Limit=1, IndexName='NodeGroupNameIndex', KeyConditionExpression=Key('NodeGroupName').eq('BT Base Server')
+    )
+    mock_node_table.scan.assert_not_called()
+
+def test_reassign_node_group_members(mock_dynamodb, mock_node_table):
+    # Arrange
+    mock_dynamodb.query.return_value = {'Items': [{'Name': 'BT Web Server', 'Class': 'roles::apache_server'}]}
+    mock_node_table.query.return_value = {'Items': MEMBERS}
+    mock_node_table.meta.client.transact_write_items.return_value = {}
+
+    # Act
+    response = client.post("/nodegroup/BT%20Base%20Server/reassign", json={'target': 'BT Web Server'})
+
+    # Assert
+    assert response.json() == {"moved": 2, "failed": 0, "failures": []}, \
+        "Reassign Members: Unexpected body {}".format(response.json())
+    moves = sorted((call.kwargs['TransactItems'] for call in mock_node_table.meta.client.transact_write_items.call_args_list),
+                   key=lambda items: items[1]['Put']['Item']['UniqueName'])
+    # Each old item is only deleted at the Version read from the index
+    assert [move[0]['Delete']['Key'] for move in moves] == [
+        {'UniqueName': member['UniqueName'], 'NodeGroupName': 'BT Base Server'} for member in MEMBERS
+    ], "Reassign Members: Unexpected deletes {}".format(moves)
+    assert moves[0][0]['Delete']['ExpressionAttributeValues'] == {':version': 4}, \
+        "Reassign Members: Expected the delete to be conditioned on Version 4, got {}".format(moves[0][0])
+    assert 'attribute_not_exists(#version)' in moves[1][0]['Delete']['ConditionExpression'], \
+        "Reassign Members: Expected an unversioned node to require no Version, got {}".format(moves[1][0])
+    assert [move[1]['Put']['Item'] for move in moves] == [
+        dict(MEMBERS[0], NodeGroupName='BT Web Server', Version=5),
+        dict(MEMBERS[1], NodeGroupName='BT Web Server', Version=1700000000000),
+    ], "Reassign Members: Unexpected moved items {}".format(moves)
+    mock_node_table.meta.client.batch_write_item.assert_not_called()
+
+def test_reassign_reports_members_changed_meanwhile(mock_dynamodb, mock_node_table):
+    # Arrange
+    mock_dynamodb.query.return_value = {'Items': [{'Name': 'BT Web Server', 'Class': 'roles::apache_server'}]}
+    mock_node_table.query.return_value = {'Items': MEMBERS}
+
+    def transact_write_items(TransactItems):
+        if TransactItems[0]['Delete']['Key']['UniqueName'] == 'us01vlbase01.saas-n.com':
+            raise ClientError(
+                {'Error': {'Code': 'TransactionCanceledException', 'Message': 'Transaction cancelled'},
+                 'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}]},
+                'TransactWriteItems'
+            )
+        return {}
+    mock_node_table.meta.client.transact_write_items.side_effect = transact_write_items
+
+    # Act
+    response = client.post("/nodegroup/BT%20Base%20Server/reassign", json={'target': 'BT Web Server'})
+
+    # Assert
+    assert response.json() == {"moved": 1, "failed": 1, "failures": [{
+        "unique_name": "us01vlbase01.saas-n.com", "detail": "Node was modified or deleted by another request"
+    }]}, "Reassign Members: Unexpected body {}".format(response.json())
+
+def test_reassign_requires_existing_target(mock_dynamodb, mock_node_table):
+    # Arrange
+    mock_dynamodb.query.return_value = {'Items': []}
+
+    # Act
+    response = client.post("/nodegroup/BT%20Base%20Server/reassign", json={'target': 'BT Web Server'})
+
+    # Assert
+    assert response.status_code == 404, \
+        "Reassign Members: Expected status code 404, got {}".format(response.status_code)
+    mock_node_table.query.assert_not_called()
+
+def test_delete_node_group_with_members_conflicts(mock_dynamodb, mock_node_table):
+    # Arrange
+    mock_dynamodb.query.return_value = {'Items': [{'Name': 'BT Base Server', 'Class': 'roles::apache_server'}]}
+    mock_node_table.query.return_value = {'Count': 1}
+
+    # Act
+    response = client.delete("/nodegroup/BT%20Base%20Server")
+
+    # Assert
+    assert response.status_code == 409, \
+        "Delete Node Group: Expected status code 409, got {}".format(response.status_code)
+    mock_dynamodb.delete_item.assert_not_called()
+
+def test_delete_node_group_cascades_to_members(mock_dynamodb, mock_node_table):
+    # Arrange
+    mock_dynamodb.query.return_value = {'Items': [{'Name': 'BT Base Server', 'Class': 'roles::apache_server'}]}
+    mock_node_table.query.return_value = {'Items': MEMBERS}
+    mock_node_table.meta.client.transact_write_items.return_value = {}
+
+    # Act
+    response = client.delete("/nodegroup/BT%20Base%20Server?cascade=true")
+
+    # Assert
+    assert response.json() == {"message": "Node group deleted successfully", "nodes_deleted": 2}, \
+        "Delete Node Group: Unexpected body {}".format(response.json())
+    # Both members and their name claims go in one transaction
+    actions = mock_node_table.meta.client.transact_write_items.call_args.kwargs['TransactItems']
+    assert [action['Delete']['Key'] for action in actions] == [
+        {'UniqueName': MEMBERS[0]['UniqueName'], 'NodeGroupName': 'BT Base Server'},
+        {'Name': 'node#' + MEMBERS[0]['UniqueName']},
+        {'UniqueName': MEMBERS[1]['UniqueName'], 'NodeGroupName': 'BT Base Server'},
+        {'Name': 'node#' + MEMBERS[1]['UniqueName']},
+    ], "Delete Node Group: Unexpected member deletes {}".format(actions)
+    mock_dynamodb.meta.client.transact_write_items.assert_called_once()
@@ -0,0 +1,70 @@
+"""Claim the names of existing nodes and node groups in the NameGuard table.
+
+Creates, renames and deletes keep NameGuard in step with the Node and
+NodeGroup tables, and a create only checks the claim. Items written before
+the claims existed have none, so run this once after deploying:
+
+    python -m tools.backfill_name_guard --segments 8
+
+Writing a claim that exists already changes nothing, so the tool can be run
+again. Names held by more than one item are listed; delete all but one of
+those items. A node deleted while the tool runs may leave its claim behind;
+run it while no deletes are in progress, or delete such claims by hand.
+"""
+import argparse
+import sys
+import time
+
+from lambdas.src.handlers import dynamo, node, node_group
+
+def backfill(table, hash_key, claim, guard_table, total_segments, max_workers=None):
+    # Returns (claims written, names held by several items, seconds taken)
+    start = time.perf_counter()
+    seen, duplicates = set(), set()
+    pending = []
+    written = 0
+
+    def flush():
+        nonlocal written
+        errors = dynamo.write_batch(guard_table, pending)
+        failed = [error for error in errors if error is not None]
+        if failed:
+            raise RuntimeError("Could not write {} claims: {}".format(len(failed), failed[0]))
+        written += len(pending)
+        pending.clear()
+
+    for item in dynamo.parallel_scan(table, total_segments, max_workers, ProjectionExpression='#key',
+                                     ExpressionAttributeNames={'#key': hash_key}):
+        name = item[hash_key]
+        if name in seen:
+            duplicates.add(name)
+            continue
+        seen.add(name)
+        pending.append({'PutRequest': {'Item': {'Name': claim(name)}}})
+        if len(pending) == dynamo.BATCH_WRITE_SIZE:
+            flush()
+    if pending:
+        flush()
+    return written, sorted(duplicates), time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=8, help='number of parallel scan segments')
+    parser.add_argument('--workers', type=int, default=None, help='worker threads (default: one per segment)')
+    args = parser.parse_args(argv)
+
+    duplicated = False
+    for label, table, hash_key, claim in (
+        ('nodes', node.node_table, 'UniqueName', node.node_claim),
+        ('node groups', node_group.node_group_table, 'Name', node_group.node_group_claim),
+    ):
+        written, duplicates, elapsed = backfill(table, hash_key, claim, node.guard_table, args.segments, args.workers)
+        print('Claimed {} {} names in {:.2f}s'.format(written, label, elapsed), file=sys.stderr)
+        for name in duplicates:
+            print('Name held by more than one of the {}: {}'.format(label, name), file=sys.stderr)
+        duplicated = duplicated or bool(duplicates)
+    if duplicated:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""Bulk import and export of nodes, node groups and environments.
+
+Import streams CSV, NDJSON or YAML records through a generator pipeline,
+validates them in batches with the handlers' pydantic models (Node,
+NodeGroup, Environment) and writes them with parallel BatchWriteItem
+workers. Progress is checkpointed after every batch, so an interrupted
+import resumes where it stopped when run again with the same --checkpoint:
+
+    python -m tools.bulk import nodes --input nodes.csv --checkpoint nodes.ckpt --workers 8
+    python -m tools.bulk import node_groups --input groups.yaml --errors rejected.ndjson
+    python -m tools.bulk export nodes --output nodes.ndjson.gz --segments 8
+
+Records use the field names of the REST API (unique_name, node_group_name,
+...), so an export imports back unchanged. In CSV, node group parameters are
+a JSON column. Files ending in .gz are compressed; "-" reads stdin or writes
+stdout. Imported records overwrite existing items with the same key. Nodes
+and node groups claim their names in NameGuard as the API does, so a record
+whose name exists under another node group or class is rejected.
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import List
+
+import yaml
+from pydantic import TypeAdapter, ValidationError
+
+from lambdas.src.handlers import dynamo, environment, node, node_group
+
+class Kind:
+    # How one record type maps between its model, items and flat records.
+    # Kinds with a `claim` are written with the claim on their hash key.
+    def __init__(self, model, table, item, key, record, hash_key=None, claim=None):
+        self.model = model
+        self.table = table
+        self.item = item
+        self.key = key
+        self.record = record
+        self.hash_key = hash_key
+        self.claim = claim
+        self.adapter = TypeAdapter(List[model])
+
+KINDS = {
+    'nodes': Kind(
+        node.Node, node.node_table, node.node_item,
+        # A name may only be claimed once per transaction
+        key=lambda item: item['UniqueName'],
+        record=lambda item: {
+            'unique_name': item['UniqueName'],
+            'node_group_name': item['NodeGroupName'],
+            'environment_name': item.get('EnvironmentName', item.get('environment_name')),
+            'puppet_cluster_name': item.get('PuppetClusterName', item.get('puppet_cluster_name')),
+        },
+        hash_key='UniqueName', claim=node.node_claim,
+    ),
+    'node_groups': Kind(
+        node_group.NodeGroup, node_group.node_group_table, node_group.node_group_item,
+        key=lambda item: item['Name'],
+        record=lambda item: {
+            'name': item['Name'],
+            'class_': item['Class'],
+            'parameters': dynamo.from_item_value(node_group.decode_parameters(item).get('Parameters') or {}),
+        },
+        hash_key='Name', claim=node_group.node_group_claim,
+    ),
+    'environments': Kind(
+        environment.Environment, environment.environment_table, environment.environment_item,
+        key=lambda item: (item['EnvironmentName'], item['PuppetClusterName']),
+        record=lambda item: {
+            'environment_name': item['EnvironmentName'],
+            'puppet_cluster_name': item['PuppetClusterName'],
+        },
+    ),
+}
+
+def file_format(path, fmt=None):
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lstrip('.').lower()
+    return {'jsonl': 'ndjson', 'json': 'ndjson', 'yml': 'yaml'}.get(extension, extension or 'ndjson')
+
+def open_text(path, mode):
+    if path == '-':
+        return sys.stdin if mode == 'r' else sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+def read_records(stream, fmt):
+    # Yield one dict per input record without reading the whole input
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            if 'parameters' in row:
+                try:
+                    row['parameters'] = json.loads(row['parameters'] or '{}')
+                except ValueError:
+                    # Left as a string, so validation rejects the row
+                    pass
+            yield row
+    elif fmt == 'ndjson':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == 'yaml':
+        # One record per document; a document holding a list is one batch
+        # of records
+        for document in yaml.safe_load_all(stream):
+            if isinstance(document, list):
+                yield from document
+            elif document is not None:
+                yield document
+    else:
+        raise ValueError('Unsupported format {}'.format(fmt))
+
+def batches(records, size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+def validate(kind, rows):
+    # Validate (row number, record) pairs in one call; only a batch with
+    # errors is validated again record by record to tell them apart.
+    # Returns (models with their row numbers, rejected rows).
+    try:
+        models = kind.adapter.validate_python([record for _, record in rows])
+        return list(zip((number for number, _ in rows), models)), []
+    except ValidationError:
+        pass
+    valid, rejected = [], []
+    for number, record in rows:
+        try:
+            valid.append((number, kind.model.model_validate(record)))
+        except ValidationError as error:
+            rejected.append({'row': number, 'record': record, 'error': error.errors(include_url=False)})
+    return valid, rejected
+
+def write_claimed(kind, requests):
+    # Write items together with the claims on their names: new names in one
+    # transaction with their claims, then items whose name was taken over
+    # their existing item with the same key, if there is one. Returns one
+    # error per request.
+    taken = "Name already exists under another key"
+    items = [request['PutRequest']['Item'] for request in requests]
+    errors = dynamo.write_transaction(kind.table, [[
+        dynamo.claim_name(node.guard_table, kind.claim(item[kind.hash_key])),
+        dynamo.put_new(kind.table, item, kind.hash_key),
+    ] for item in items], taken)
+    existing = [i for i, error in enumerate(errors) if error == taken]
+    overwritten = dynamo.write_transaction(kind.table, [[{'Put': {
+        'TableName': kind.table.name,
+        'Item': items[i],
+        'ConditionExpression': 'attribute_exists(#key)',
+        'ExpressionAttributeNames': {'#key': kind.hash_key},
+    }}] for i in existing], taken)
+    for i, error in zip(existing, overwritten):
+        errors[i] = error
+    return errors
+
+def write_requests(pool, kind, valid):
+    # Submit the batch as 25-item BatchWriteItem calls on the worker pool, or
+    # as transactions of 50 items and their claims for kinds with names. A
+    # key may only appear once per call, so the last record of a key wins.
+    requests = {}
+    for number, model in valid:
+        item = kind.item(model)
+        requests[kind.key(item)] = (number, {'PutRequest': {'Item': item}})
+    pending = list(requests.values())
+    if kind.claim is None:
+        write, size = partial(dynamo.write_batch, kind.table), dynamo.BATCH_WRITE_SIZE
+    else:
+        write, size = partial(write_claimed, kind), dynamo.TRANSACT_WRITE_SIZE // 2
+    return [(chunk, pool.submit(write, [request for _, request in chunk]))
+            for chunk in (pending[i:i + size] for i in range(0, len(pending), size))]
+
+def collect(submitted):
+    # Wait for a batch's calls; returns (items written, rejected rows)
+    written, rejected = 0, []
+    for chunk, future in submitted:
+        for (number, request), error in zip(chunk, future.result()):
+            if error is None:
+                written += 1
+            else:
+                rejected.append({'row': number, 'record': request['PutRequest']['Item'], 'error': error})
+    return written, rejected
+
+def load_checkpoint(path, source, kind_name):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('input') != source or checkpoint.get('kind') != kind_name:
+            raise ValueError('Checkpoint {} belongs to another import ({} of {})'.format(
+                path, checkpoint.get('kind'), checkpoint.get('input')))
+        return checkpoint
+    return {'input': source, 'kind': kind_name, 'rows': 0, 'written': 0, 'rejected': 0}
+
+def save_checkpoint(path, checkpoint):
+    # Written to a temporary file and renamed, so a crash never leaves a
+    # truncated checkpoint
+    if path:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(path + '.tmp', path)
+
+def import_records(kind_name, records, source, batch_size=1000, workers=8, checkpoint_path=None, errors=None,
+                   progress=None):
+    # Returns the final checkpoint: rows read, items written and rows
+    # rejected, counting rows of earlier runs of a resumed import
+    kind = KINDS[kind_name]
+    checkpoint = load_checkpoint(checkpoint_path, source, kind_name)
+    # Rows a previous run finished are read again but not written
+    numbered = islice(enumerate(records, start=1), checkpoint['rows'], None)
+    start = time.perf_counter()
+    done = 0
+
+    def finish(rows, submitted, rejected):
+        nonlocal done
+        written, failed = collect(submitted)
+        for row in rejected + failed:
+            if errors is not None:
+                errors.write(json.dumps(row, default=dynamo.json_default) + '\n')
+        checkpoint['rows'] = rows[-1][0]
+        checkpoint['written'] += written
+        checkpoint['rejected'] += len(rejected) + len(failed)
+        save_checkpoint(checkpoint_path, checkpoint)
+        done += len(rows)
+        if progress:
+            progress(checkpoint, done / (time.perf_counter() - start))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk') as pool:
+        # While one batch is being written the next one is read and
+        # validated; the checkpoint only moves once a batch is written
+        in_flight = None
+        try:
+            for rows in batches(numbered, batch_size):
+                valid, rejected = validate(kind, rows)
+                submitted = write_requests(pool, kind, valid)
+                if in_flight is not None:
+                    # Taken out first: if it fails, later batches must not
+                    # move the checkpoint past it
+                    previous, in_flight = in_flight, None
+                    finish(*previous)
+                in_flight = (rows, submitted, rejected)
+        finally:
+            # Also on an interrupt: the batch's writes are already under way
+            if in_flight is not None:
+                finish(*in_flight)
+    checkpoint['seconds'] = time.perf_counter() - start
+    checkpoint['rows_per_second'] = done / checkpoint['seconds'] if checkpoint['seconds'] else 0.0
+    return checkpoint
+
+def export_records(kind_name, out, fmt, total_segments=8, max_workers=None):
+    # Returns (records written, seconds taken)
+    kind = KINDS[kind_name]
+    start = time.perf_counter()
+    count = 0
+    writer = None
+    for item in dynamo.parallel_scan(kind.table, total_segments, max_workers):
+        record = kind.record(item)
+        if fmt == 'csv':
+            if writer is None:
+                writer = csv.DictWriter(out, fieldnames=list(record))
+                writer.writeheader()
+            if 'parameters' in record:
+                record['parameters'] = json.dumps(record['parameters'], sort_keys=True)
+            writer.writerow(record)
+        elif fmt == 'ndjson':
+            out.write(json.dumps(record, default=dynamo.json_default))
+            out.write('\n')
+        elif fmt == 'yaml':
+            out.write(yaml.safe_dump(record, explicit_start=True, default_flow_style=False, sort_keys=False))
+        else:
+            raise ValueError('Unsupported format {}'.format(fmt))
+        count += 1
+    return count, time.perf_counter() - start
+
+def report(checkpoint, rate):
+    print('{rows} rows read, {written} written, {rejected} rejected ({rate:.0f} rows/s)'.format(
+        rate=rate, **checkpoint), file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('import', help='write records from a file')
+    load.add_argument('kind', choices=sorted(KINDS))
+    load.add_argument('--input', required=True, help='CSV, NDJSON or YAML file, optionally .gz; - for stdin')
+    load.add_argument('--format', choices=['csv', 'ndjson', 'yaml'], help='default: from the file extension')
+    load.add_argument('--batch-size', type=int, default=1000, help='records validated and checkpointed together')
+    load.add_argument('--workers', type=int, default=8, help='parallel write workers')
+    load.add_argument('--checkpoint', help='progress file; an interrupted import resumes from it')
+    load.add_argument('--errors', help='NDJSON file receiving rejected rows')
+
+    dump = commands.add_parser('export', help='write every record to a file')
+    dump.add_argument('kind', choices=sorted(KINDS))
+    dump.add_argument('--output', required=True, help='CSV, NDJSON or YAML file, optionally .gz; - for stdout')
+    dump.add_argument('--format', choices=['csv', 'ndjson', 'yaml'], help='default: from the file extension')
+    dump.add_argument('--segments', type=int, default=8, help='number of parallel scan segments')
+    dump.add_argument('--workers', type=int, default=None, help='worker threads (default: one per segment)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        out = open_text(args.output, 'w')
+        try:
+            count, elapsed = export_records(args.kind, out, file_format(args.output, args.format),
+                                            args.segments, args.workers)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print('Exported {} {} in {:.2f}s ({:.0f} rows/s)'.format(
+            count, args.kind, elapsed, count / elapsed if elapsed else 0), file=sys.stderr)
+        return
+
+    errors = open(args.errors, 'a', encoding='utf-8') if args.errors else None
+    stream = open_text(args.input, 'r')
+    try:
+        records = read_records(stream, file_format(args.input, args.format))
+        checkpoint = import_records(args.kind, records, os.path.abspath(args.input) if args.input != '-' else '-',
+                                    args.batch_size, args.workers, args.checkpoint, errors, progress=report)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        if errors is not None:
+            errors.close()
+    print('Imported {} {} in {:.2f}s ({:.0f} rows/s)'.format(
+        checkpoint['written'], args.kind, checkpoint['seconds'], checkpoint['rows_per_second']), file=sys.stderr)
+    if checkpoint['rejected']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
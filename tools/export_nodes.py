@@ -0,0 +1,42 @@
+"""Export the whole Node table as gzip-compressed NDJSON.
+
+The table is read with a DynamoDB parallel scan (Segment/TotalSegments), one
+worker thread per segment, and written one node per line:
+
+    python -m tools.export_nodes --output nodes.ndjson.gz --segments 8
+"""
+import argparse
+import gzip
+import json
+import sys
+import time
+
+from lambdas.src.handlers import dynamo
+from lambdas.src.handlers.node import node_table
+
+def export_nodes(table, output, total_segments, max_workers=None, page_size=None):
+    # Returns (items written, seconds taken)
+    kwargs = {'Limit': page_size} if page_size else {}
+    start = time.perf_counter()
+    count = 0
+    with gzip.open(output, 'wt', encoding='utf-8') as out:
+        for item in dynamo.parallel_scan(table, total_segments, max_workers, **kwargs):
+            out.write(json.dumps(item, default=dynamo.json_default))
+            out.write('\n')
+            count += 1
+    return count, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', required=True, help='path of the .ndjson.gz file to write')
+    parser.add_argument('--segments', type=int, default=8, help='number of parallel scan segments')
+    parser.add_argument('--workers', type=int, default=None, help='worker threads (default: one per segment)')
+    parser.add_argument('--page-size', type=int, default=None, help='Limit for each Scan call')
+    args = parser.parse_args(argv)
+
+    count, elapsed = export_nodes(node_table, args.output, args.segments, args.workers, args.page_size)
+    print('Exported {} nodes in {:.2f}s ({:.0f} nodes/s) to {}'.format(
+        count, elapsed, count / elapsed if elapsed else 0, args.output), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
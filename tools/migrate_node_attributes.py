@@ -0,0 +1,61 @@
+"""Rename the legacy environment attributes of existing Node items.
+
+Nodes used to be stored with lowercase environment_name/puppet_cluster_name
+attributes. The EnvironmentNameIndex and PuppetClusterNameIndex GSIs only
+index EnvironmentName/PuppetClusterName, so older items have to be rewritten
+before they show up in the list-by-environment and list-by-cluster routes:
+
+    python -m tools.migrate_node_attributes --segments 8
+"""
+import argparse
+import sys
+import time
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from lambdas.src.handlers import dynamo
+from lambdas.src.handlers.node import node_table
+
+def migrate_item(table, item):
+    # Returns True when the item was rewritten, False when a concurrent
+    # update or delete got to it first
+    try:
+        table.update_item(
+            Key={'UniqueName': item['UniqueName'], 'NodeGroupName': item['NodeGroupName']},
+            UpdateExpression="SET EnvironmentName = if_not_exists(EnvironmentName, :environment_name), "
+                             "PuppetClusterName = if_not_exists(PuppetClusterName, :puppet_cluster_name) "
+                             "REMOVE environment_name, puppet_cluster_name",
+            ConditionExpression=Attr('UniqueName').exists(),
+            ExpressionAttributeValues={
+                ':environment_name': item['environment_name'],
+                ':puppet_cluster_name': item['puppet_cluster_name'],
+            }
+        )
+    except ClientError as error:
+        if dynamo.condition_failed(error):
+            return False
+        raise
+    return True
+
+def migrate_nodes(table, total_segments, max_workers=None):
+    # Returns (items rewritten, seconds taken)
+    start = time.perf_counter()
+    count = 0
+    legacy = Attr('environment_name').exists() & Attr('puppet_cluster_name').exists()
+    for item in dynamo.parallel_scan(table, total_segments, max_workers, FilterExpression=legacy):
+        if migrate_item(table, item):
+            count += 1
+    return count, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=8, help='number of parallel scan segments')
+    parser.add_argument('--workers', type=int, default=None, help='worker threads (default: one per segment)')
+    args = parser.parse_args(argv)
+
+    count, elapsed = migrate_nodes(node_table, args.segments, args.workers)
+    print('Migrated {} nodes in {:.2f}s'.format(count, elapsed), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Move NodeGroup parameters stored as JSON strings into ParameterSet maps.
+
+Parameter sets above NODE_GROUP_COMPRESS_THRESHOLD are written compressed,
+the same way node_group.py stores them.
+
+Every row of the NodeGroup table whose Parameters attribute is still a string
+is rewritten in place, while the service keeps running:
+
+    python -m tools.migrate_node_group_parameters --segments 4
+
+The string moves to ParameterSet and Parameters is removed, so the row also
+leaves the ParametersIndex LSI, which keeps its definition and the table.
+Reads fall back to the string until a row is migrated, and the tool can be
+run again.
+"""
+import argparse
+import json
+import sys
+import time
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from lambdas.src.handlers import dynamo
+from lambdas.src.handlers.node_group import encode_parameters, node_group_table
+
+def convert(item):
+    # The ParameterSet value of a row still holding a JSON string
+    return encode_parameters(json.loads(item['Parameters']))
+
+def migrate_in_place(table, total_segments, max_workers=None):
+    # Returns (items rewritten, seconds taken)
+    start = time.perf_counter()
+    count = 0
+    legacy = Attr('Parameters').attribute_type('S')
+    for item in dynamo.parallel_scan(table, total_segments, max_workers, FilterExpression=legacy):
+        try:
+            table.update_item(
+                Key={'Name': item['Name'], 'Class': item['Class']},
+                UpdateExpression="SET #parameters = :parameters REMOVE #legacy",
+                ExpressionAttributeNames={'#parameters': 'ParameterSet', '#legacy': 'Parameters'},
+                ExpressionAttributeValues={':parameters': convert(item)},
+                # Leave rows alone that were rewritten since the scan read them
+                ConditionExpression=Attr('Parameters').eq(item['Parameters'])
+            )
+        except ClientError as error:
+            if dynamo.condition_failed(error):
+                continue
+            raise
+        count += 1
+    return count, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=4, help='number of parallel scan segments')
+    parser.add_argument('--workers', type=int, default=None, help='worker threads (default: one per segment)')
+    args = parser.parse_args(argv)
+
+    count, elapsed = migrate_in_place(node_group_table, args.segments, args.workers)
+    print('Migrated {} node groups in {:.2f}s'.format(count, elapsed), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Regenerate the materialized Classification documents from scratch.
+
+The stream consumer in classification.py keeps the documents current as
+nodes and node groups change. Run this after creating the Classification
+table, after restoring Node or NodeGroup from a backup, or whenever the view
+is suspected to have drifted:
+
+    python -m tools.rebuild_classifications --segments 8 --prune
+
+Every node gets its document rewritten from the current Node and NodeGroup
+items. With --prune, documents of nodes that no longer exist, or whose node
+group is gone, are deleted as well.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from lambdas.src.handlers import dynamo
+from lambdas.src.handlers.classification import (
+    classification_item, classification_table, node_group_table, node_table
+)
+
+# Write requests sent per round of concurrent BatchWriteItem calls
+FLUSH_SIZE = dynamo.BATCH_WRITE_SIZE * 16
+
+def flush(table, requests):
+    errors = asyncio.run(dynamo.batch_write(table, requests))
+    failed = [error for error in errors if error is not None]
+    if failed:
+        raise RuntimeError("Could not write {} classifications: {}".format(len(failed), failed[0]))
+    return len(requests)
+
+def rebuild(total_segments, max_workers=None, prune=False):
+    # Returns (documents written, documents deleted, seconds taken)
+    start = time.perf_counter()
+    node_groups = {item['Name']: item for item in dynamo.parallel_scan(node_group_table, total_segments, max_workers)}
+
+    written = 0
+    classified = set()
+    requests = []
+    for node in dynamo.parallel_scan(node_table, total_segments, max_workers):
+        node_group = node_groups.get(node['NodeGroupName'])
+        # A node stored under several groups keeps a single document
+        if node_group is None or node['UniqueName'] in classified:
+            continue
+        classified.add(node['UniqueName'])
+        requests.append({'PutRequest': {'Item': classification_item(node, node_group)}})
+        if len(requests) >= FLUSH_SIZE:
+            written += flush(classification_table, requests)
+            requests = []
+    if requests:
+        written += flush(classification_table, requests)
+
+    deleted = 0
+    if prune:
+        requests = [{'DeleteRequest': {'Key': {'UniqueName': item['UniqueName']}}}
+                    for item in dynamo.parallel_scan(classification_table, total_segments, max_workers,
+                                                     ProjectionExpression='UniqueName')
+                    if item['UniqueName'] not in classified]
+        for i in range(0, len(requests), FLUSH_SIZE):
+            deleted += flush(classification_table, requests[i:i + FLUSH_SIZE])
+    return written, deleted, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=8, help='number of parallel scan segments')
+    parser.add_argument('--workers', type=int, default=None, help='worker threads (default: one per segment)')
+    parser.add_argument('--prune', action='store_true', help='delete documents of nodes that no longer classify')
+    args = parser.parse_args(argv)
+
+    written, deleted, elapsed = rebuild(args.segments, args.workers, args.prune)
+    print('Wrote {} classifications and deleted {} in {:.2f}s'.format(written, deleted, elapsed), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()